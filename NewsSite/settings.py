@@ -39,7 +39,11 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    # Первым, чтобы мерить весь стек (news.metrics)
+    'news.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Запросы без cookie получают готовую страницу, минуя остальной стек
+    'news.middleware.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -99,10 +103,26 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'news.fast_render.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
 
+# Анонимные GET list/retrieve в API собираются из .values() без ModelSerializer
+FAST_API_RENDERING = True
+
+# Метрики запросов (news.middleware.RequestMetricsMiddleware): доля отбираемых запросов,
+# допустимая доля времени на сам учёт, заголовок Server-Timing, ротация JSON-лога
+METRICS_SAMPLE_RATE = 1.0 if DEBUG else 0.05
+METRICS_OVERHEAD_BUDGET = 1.0 if DEBUG else 0.01
+METRICS_SERVER_TIMING = DEBUG
+METRICS_LOG_FILE = BASE_DIR / 'request_metrics.jsonl'
+METRICS_LOG_MAX_BYTES = 10 * 1024 * 1024
+METRICS_LOG_BACKUP_COUNT = 5
+
 # Интернационализация
 LANGUAGE_CODE = 'ru'
 LANGUAGES = [
@@ -141,7 +161,23 @@ ACCOUNT_EMAIL_VERIFICATION = 'mandatory'
 ACCOUNT_LOGIN_ON_EMAIL_CONFIRMATION = True
 
 # Email
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Все письма сначала пишутся в таблицу OutboxEmail (news.outbox), реально их
+# отправляет задача dispatch_outbox через OUTBOX_DELIVERY_BACKEND
+EMAIL_BACKEND = 'news.outbox.OutboxEmailBackend'
+OUTBOX_DELIVERY_BACKEND = 'news.email_backends.PooledSMTPEmailBackend'
+# Пул SMTP-соединений: параллельных соединений на процесс, писем в секунду (0 — без ограничения),
+# повторов при временных ошибках и сколько секунд соединение может простаивать в пуле
+EMAIL_POOL_SIZE = 4
+EMAIL_RATE_LIMIT = 10
+EMAIL_SEND_RETRIES = 3
+EMAIL_POOL_IDLE_TIMEOUT = 30
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 8
+# Повторы через 30 с, 1 мин, 2 мин ... но не реже раза в час
+OUTBOX_RETRY_BASE = 30
+OUTBOX_RETRY_MAX = 60 * 60
+# Сколько взятое в работу письмо не достанется другому диспетчеру
+OUTBOX_CLAIM_TIMEOUT = 60 * 5
 EMAIL_HOST = 'smtp.yandex.ru'
 EMAIL_PORT = 465
 EMAIL_USE_SSL = True
@@ -149,6 +185,12 @@ EMAIL_HOST_USER = 'your-email@yandex.ru'
 EMAIL_HOST_PASSWORD = 'your-password'
 DEFAULT_FROM_EMAIL = 'News Portal <your-email@yandex.ru>'
 SITE_URL = 'http://127.0.0.1:8000'
+# Еженедельная рассылка: контрольная точка каждые N получателей, блокировка единственного
+# исполнителя в кэше (продлевается на каждой контрольной точке)
+NEWSLETTER_CHECKPOINT_EVERY = 500
+NEWSLETTER_LOCK_TIMEOUT = 60 * 10
+# Уведомления о новых постах отправляются пачками по столько получателей на одно SMTP-соединение
+NOTIFY_BATCH_SIZE = 100
 
 # Celery
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
@@ -163,12 +205,30 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'news.tasks.weekly_newsletter',
         'schedule': crontab(hour=8, minute=0, day_of_week=1),
     },
+    'recompute-author-ratings-nightly': {
+        'task': 'news.tasks.recompute_author_ratings',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'flush-vote-buffer': {
+        'task': 'news.tasks.flush_vote_buffer',
+        'schedule': 10.0,
+    },
+    'dispatch-outbox': {
+        'task': 'news.tasks.dispatch_outbox',
+        'schedule': 30.0,
+    },
     'auto-switch-theme': {
         'task': 'news.tasks.auto_switch_theme',
         'schedule': crontab(minute=0, hour='*/1'),
     },
 }
 
+# Выбранный часовой пояс хранится в подписанной cookie (news.middleware.TimezoneMiddleware)
+TIMEZONE_COOKIE_NAME = 'django_timezone'
+TIMEZONE_COOKIE_AGE = 60 * 60 * 24 * 365
+# Список поясов для селектора (news.views.timezone_list) меняется только с обновлением pytz
+TIMEZONE_LIST_MAX_AGE = 60 * 60 * 24 * 7
+
 # Кэширование
 CACHES = {
     'default': {
@@ -178,9 +238,56 @@ CACHES = {
     'timezone': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'timezone-cache',
-    }
+    },
+    # Мелкие горячие объекты (меню, список категорий): LRU в процессе перед Redis,
+    # инвалидации рассылаются через Redis pub/sub
+    'tiered': {
+        'BACKEND': 'news.cache_backends.TwoTierCache',
+        'LOCATION': 'tiered',
+        'TIMEOUT': 60 * 10,
+        'OPTIONS': {
+            'REMOTE': 'default',
+            'MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 30,
+        },
+    },
 }
 
+# Старые ссылки ?page=N: граница страницы ищется от запомненных в кэше точек
+# через каждые CHECKPOINT_ROWS строк, так что OFFSET не длиннее шага
+LEGACY_PAGE_CHECKPOINT_ROWS = 500
+LEGACY_PAGE_CHECKPOINT_TIMEOUT = 60 * 10
+
+# Страницы с версионированными ключами сбрасываются сигналами, поэтому TTL может быть долгим
+PAGE_CACHE_TIMEOUT = 60 * 60 * 6
+# Страницы для запросов без cookie (news.middleware.AnonymousPageCacheMiddleware):
+# свежесть проверяется по версиям, TTL ограничивает устаревание меню категорий.
+# MAX_AGE — для общих кэшей, если на странице нет CSRF-токена
+ANONYMOUS_PAGE_CACHE_ALIAS = 'default'
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 60 * 10
+ANONYMOUS_PAGE_CACHE_MAX_AGE = 60
+# Фрагменты страниц постов (тело, комментарии) ключуются по updated_at или версии поста,
+# версии комментариев, языку и часовому поясу
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+# Защита от одновременного пересчёта: сколько отдавать устаревшее значение,
+# сколько держится блокировка пересчёта и как часто её опрашивают ожидающие.
+# UNCACHEABLE_TIMEOUT — сколько после некэшируемого результата считать без блокировки
+STAMPEDE_STALE_TIMEOUT = 60 * 5
+STAMPEDE_LOCK_TIMEOUT = 10
+STAMPEDE_POLL_INTERVAL = 0.05
+STAMPEDE_UNCACHEABLE_TIMEOUT = 5
+
+# Буфер голосов: лайки копятся в Redis и пачками сбрасываются в БД задачей flush_vote_buffer.
+# Для нагрузочных прогонов можно указать 'fakeredis://'.
+VOTE_BUFFER_ENABLED = False
+VOTE_BUFFER_REDIS_URL = 'redis://127.0.0.1:6379/2'
+
+# Цензура: базовый список слов (дополняется таблицей BannedWord).
+# При CENSOR_AT_WRITE шаблоны берут заранее отцензурированные title/content.
+CENSOR_BAD_WORDS = ['плохое', 'запрещённое', 'нецензурное', 'НХЛ', 'Предприятие']
+CENSOR_AT_WRITE = True
+CENSOR_RELOAD_INTERVAL = 60
+
 # Сессии
 SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 SESSION_COOKIE_AGE = 1209600  # 2 недели
@@ -239,6 +346,10 @@ LOGGING = {
 'style': '{',
 'datefmt': '%Y-%m-%d %H:%M:%S',
 },
+'metrics_json': {
+'format': '{message}',
+'style': '{',
+},
 },
 'handlers': {
 'console_debug': {
@@ -281,6 +392,16 @@ LOGGING = {
 'formatter': 'security_file',
 'encoding': 'utf8',
 },
+'metrics_file': {
+'level': 'INFO',
+'class': 'logging.handlers.RotatingFileHandler',
+'filename': METRICS_LOG_FILE,
+'maxBytes': METRICS_LOG_MAX_BYTES,
+'backupCount': METRICS_LOG_BACKUP_COUNT,
+'formatter': 'metrics_json',
+'encoding': 'utf8',
+'delay': True,
+},
 'mail_admins': {
 'level': 'ERROR',
 'filters': ['require_debug_false'],
@@ -319,9 +440,15 @@ LOGGING = {
 'level': 'DEBUG',
 'propagate': False,
 },
+'news.metrics': {
+'handlers': ['metrics_file'],
+'level': 'INFO',
+'propagate': False,
+},
 },
 }
 
+# Тема оформления — обычная cookie, без записи в сессию (news.middleware.ThemeMiddleware)
 DEFAULT_THEME = 'light'  # или 'dark'
 THEME_COOKIE_NAME = 'newsportal_theme'
 THEME_COOKIE_AGE = 30 * 24 * 60 * 60
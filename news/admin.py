@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Post, Author, Category, Comment
+from .models import Post, Author, Category, Comment, BannedWord, OutboxEmail, NewsletterRun
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
@@ -8,6 +8,9 @@ class PostAdmin(admin.ModelAdmin):
     search_fields = ('title', 'content')
     date_hierarchy = 'created_at'
     ordering = ('-created_at',)
+    # Голоса и счётчики меняются только через apply_votes
+    exclude = ('likes', 'dislikes')
+    readonly_fields = ('rating', 'likes_count', 'dislikes_count')
 
     def get_categories(self, obj):
         return ", ".join([category.name for category in obj.categories.all()])
@@ -25,8 +28,29 @@ class CommentAdmin(admin.ModelAdmin):
     search_fields = ('text', 'user__username', 'post__title')
     date_hierarchy = 'created_at'
     ordering = ('-created_at',)
+    exclude = ('likes', 'dislikes')
+    readonly_fields = ('rating', 'likes_count', 'dislikes_count')
 
 @admin.register(Author)
 class AuthorAdmin(admin.ModelAdmin):
     list_display = ('user', 'rating')
-    search_fields = ('user__username',)
\ No newline at end of file
+    search_fields = ('user__username',)
+
+@admin.register(BannedWord)
+class BannedWordAdmin(admin.ModelAdmin):
+    list_display = ('word',)
+    search_fields = ('word',)
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'dedupe_key')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+
+@admin.register(NewsletterRun)
+class NewsletterRunAdmin(admin.ModelAdmin):
+    list_display = ('key', 'status', 'queued', 'last_user_id', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    ordering = ('-started_at',)
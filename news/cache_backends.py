@@ -0,0 +1,246 @@
+"""Двухуровневый кэш: LRU в памяти процесса перед удалённым кэшем (Redis).
+
+Чтение сначала идёт в локальный LRU (ограничен MAX_ENTRIES, записи живут не
+дольше LOCAL_TIMEOUT секунд), при промахе — в кэш REMOTE, и результат
+запоминается локально. Любая запись удаляет ключ локально и публикует его
+в канал CHANNEL Redis pub/sub; фоновый поток в каждом воркере слушает канал
+и выбрасывает такие ключи из своего LRU. Если удалённый кэш не Redis
+(например, locmem в тестах), рассылки нет и спасает только LOCAL_TIMEOUT.
+
+Значение из REMOTE не попадает в LRU, если за время чтения пришла
+инвалидация этого ключа (счётчик поколений), а после fork дочерний процесс
+заводит свой идентификатор узла, чистит LRU и подписывается заново.
+
+    CACHES = {
+        'tiered': {
+            'BACKEND': 'news.cache_backends.TwoTierCache',
+            'OPTIONS': {'REMOTE': 'default', 'MAX_ENTRIES': 1000, 'LOCAL_TIMEOUT': 30},
+        },
+    }
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+logger = logging.getLogger(__name__)
+
+CLEAR_ALL = '*'
+
+# Экземпляры бэкендов Django создаёт на каждый поток, а LRU и подписка
+# должны быть одни на процесс — как у LocMemCache, храним их на уровне модуля
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class _LocalTier:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.node = uuid.uuid4().hex
+        self.pid = os.getpid()
+        self.listener = None
+        # Поколения ключей: растут при каждой инвалидации. Словарь ограничен —
+        # при очистке растёт epoch, и все начатые чтения считаются устаревшими
+        self.generations = {}
+        self.epoch = 0
+        self.stats = {'local_hits': 0, 'local_misses': 0, 'remote_hits': 0, 'remote_misses': 0,
+                      'invalidations': 0}
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        super().__init__(params)
+        self._remote_alias = options.get('REMOTE', 'default')
+        self._max_entries = options.get('MAX_ENTRIES', 1000)
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 30)
+        name = location or 'tiered'
+        self._channel = options.get('CHANNEL', f'cache-invalidation:{name}')
+        with _tiers_lock:
+            tier = _tiers.setdefault(name, _LocalTier())
+        self._tier = tier
+        self._local = tier.entries
+        self._lock = tier.lock
+        self._stats = tier.stats
+
+    @property
+    def remote(self):
+        return caches[self._remote_alias]
+
+    # --- локальный уровень ---
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._local.move_to_end(key)
+                self._stats['local_hits'] += 1
+                return True, pickle.loads(entry[0])
+            if entry is not None:
+                del self._local[key]
+            self._stats['local_misses'] += 1
+            return False, None
+
+    def _generation(self, key):
+        with self._lock:
+            return self._tier.epoch, self._tier.generations.get(key, 0)
+
+    def _local_set(self, key, value, timeout, generation=None):
+        """generation — снимок _generation() до чтения из REMOTE; если ключ с тех пор
+        инвалидирован, прочитанное значение могло устареть и локально не сохраняется"""
+        ttl = self._local_timeout if timeout is None else min(timeout, self._local_timeout)
+        if ttl <= 0:
+            return
+        # Храним копию в pickle, чтобы вызывающий код не мог изменить закэшированный объект
+        entry = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.monotonic() + ttl)
+        with self._lock:
+            tier = self._tier
+            if generation is not None and (tier.epoch, tier.generations.get(key, 0)) != generation:
+                return
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def _local_drop(self, key):
+        with self._lock:
+            tier = self._tier
+            if key == CLEAR_ALL or len(tier.generations) >= self._max_entries:
+                tier.generations.clear()
+                tier.epoch += 1
+            if key == CLEAR_ALL:
+                self._local.clear()
+            else:
+                self._local.pop(key, None)
+                tier.generations[key] = tier.generations.get(key, 0) + 1
+
+    # --- рассылка инвалидаций ---
+
+    def _redis_client(self):
+        client = getattr(self.remote, '_cache', None)
+        if client is None or not hasattr(client, 'get_client'):
+            return None
+        return client.get_client(write=True)
+
+    def _ensure_listener(self):
+        tier = self._tier
+        pid = os.getpid()
+        if tier.listener is not None and tier.pid == pid:
+            return
+        with self._lock:
+            if tier.listener is not None and tier.pid == pid:
+                return
+            if tier.pid != pid:
+                # Процесс форкнут: поток слушателя остался в родителе, а унаследованный
+                # LRU без подписки не узнает об инвалидациях
+                tier.pid = pid
+                tier.node = uuid.uuid4().hex
+                self._local.clear()
+                tier.generations.clear()
+                tier.epoch += 1
+            client = self._redis_client()
+            if client is None:
+                tier.listener = False
+                return
+            tier.listener = threading.Thread(target=self._listen, args=(client,), daemon=True,
+                                             name='two-tier-cache-invalidation')
+            tier.listener.start()
+
+    def _listen(self, client):
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                # После переподключения могли пропустить сообщения — начинаем с чистого листа
+                self._local_drop(CLEAR_ALL)
+                for message in pubsub.listen():
+                    node, _, key = message['data'].decode().partition('|')
+                    if node != self._tier.node:
+                        self._local_drop(key)
+                        with self._lock:
+                            self._stats['invalidations'] += 1
+            except Exception:
+                logger.exception('Подписка на инвалидации кэша прервалась, переподключаемся')
+                time.sleep(1)
+
+    def _invalidate(self, key):
+        self._local_drop(key)
+        client = self._redis_client()
+        if client is not None:
+            try:
+                client.publish(self._channel, f'{self._tier.node}|{key}')
+            except Exception:
+                logger.exception('Не удалось разослать инвалидацию ключа %s', key)
+
+    # --- API кэша ---
+
+    def _local_key(self, key, version):
+        return self.make_and_validate_key(key, version=version)
+
+    def get(self, key, default=None, version=None):
+        self._ensure_listener()
+        local_key = self._local_key(key, version)
+        found, value = self._local_get(local_key)
+        if found:
+            return value
+        generation = self._generation(local_key)
+        sentinel = object()
+        value = self.remote.get(key, sentinel, version=version)
+        with self._lock:
+            self._stats['remote_misses' if value is sentinel else 'remote_hits'] += 1
+        if value is sentinel:
+            return default
+        self._local_set(local_key, value, self._local_timeout, generation)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._relative_timeout(timeout)
+        self.remote.set(key, value, timeout, version=version)
+        local_key = self._local_key(key, version)
+        self._invalidate(local_key)
+        self._local_set(local_key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._relative_timeout(timeout)
+        added = self.remote.add(key, value, timeout, version=version)
+        if added:
+            self._invalidate(self._local_key(key, version))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.remote.touch(key, self._relative_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        deleted = self.remote.delete(key, version=version)
+        self._invalidate(self._local_key(key, version))
+        return deleted
+
+    def has_key(self, key, version=None):
+        found, _ = self._local_get(self._local_key(key, version))
+        return found or self.remote.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.remote.incr(key, delta, version=version)
+        self._invalidate(self._local_key(key, version))
+        return value
+
+    def clear(self):
+        self.remote.clear()
+        self._invalidate(CLEAR_ALL)
+
+    def _relative_timeout(self, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT:
+            return self.default_timeout
+        return timeout
+
+    def stats(self):
+        """Счётчики попаданий по уровням для мониторинга"""
+        with self._lock:
+            return dict(self._stats, local_size=len(self._local))
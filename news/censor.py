@@ -0,0 +1,104 @@
+"""Цензура запрещённых слов.
+
+Регулярное выражение собирается один раз из CENSOR_BAD_WORDS и таблицы
+BannedWord и пересобирается только при изменении списка: в своём процессе —
+сразу по сигналу, в остальных воркерах — по версии в кэше, которая
+проверяется не чаще раза в CENSOR_RELOAD_INTERVAL секунд. Сохранённые
+title_censored/content_censored после изменения списка пересчитывает задача
+news.tasks.recensor_posts.
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.utils import timezone
+
+VERSION_KEY = 'censor:version'
+
+_lock = threading.Lock()
+_state = {'pattern': None, 'version': None, 'checked_at': 0.0}
+
+
+def build_pattern(words):
+    words = sorted({word for word in words if word}, key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile(r'\b(' + '|'.join(map(re.escape, words)) + r')\b', flags=re.IGNORECASE)
+
+
+def _load_words():
+    from .models import BannedWord
+
+    words = list(getattr(settings, 'CENSOR_BAD_WORDS', []))
+    try:
+        words += BannedWord.objects.values_list('word', flat=True)
+    except DatabaseError:
+        # Таблицы ещё нет (миграции не применены) — обходимся списком из настроек
+        pass
+    return words
+
+
+def get_pattern(refresh=False):
+    """refresh=True — сверить версию сразу, не дожидаясь CENSOR_RELOAD_INTERVAL"""
+    now = time.monotonic()
+    if (not refresh and _state['pattern'] is not None
+            and now - _state['checked_at'] < settings.CENSOR_RELOAD_INTERVAL):
+        return _state['pattern']
+    with _lock:
+        version = cache.get(VERSION_KEY, 0)
+        if _state['pattern'] is None or version != _state['version']:
+            _state['pattern'] = build_pattern(_load_words()) or re.compile(r'(?!x)x')
+            _state['version'] = version
+        _state['checked_at'] = now
+    return _state['pattern']
+
+
+def invalidate():
+    """Вызывается при изменении списка слов: пересобрать здесь и во всех воркерах"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+    _state['pattern'] = None
+
+
+def _mask(match):
+    word = match.group()
+    return word[0] + '*' * (len(word) - 1)
+
+
+def censor_text(value):
+    if not isinstance(value, str) or not value:
+        return value
+    return get_pattern().sub(_mask, value)
+
+
+def recensor(model, pattern=None, chunk_size=500):
+    """Пересчитывает сохранённые title_censored/content_censored пачками.
+
+    Записываются только изменившиеся посты; у них же сдвигается updated_at,
+    от которого зависят кэш фрагментов и ETag. Возвращает их pk.
+    """
+    pattern = pattern or get_pattern()
+    fields = ['title_censored', 'content_censored', 'updated_at']
+    updated = []
+    batch = []
+    posts = model.objects.only('pk', 'title', 'content', 'title_censored', 'content_censored')
+    for post in posts.iterator(chunk_size=chunk_size):
+        title, content = pattern.sub(_mask, post.title), pattern.sub(_mask, post.content)
+        if (title, content) == (post.title_censored, post.content_censored):
+            continue
+        post.title_censored, post.content_censored = title, content
+        post.updated_at = timezone.now()
+        batch.append(post)
+        if len(batch) >= chunk_size:
+            model.objects.bulk_update(batch, fields)
+            updated += [post.pk for post in batch]
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, fields)
+        updated += [post.pk for post in batch]
+    return updated
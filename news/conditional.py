@@ -0,0 +1,94 @@
+"""Условные GET-запросы (ETag) для страниц и API постов.
+
+Валидаторы считаются без рендеринга: один запрос за updated_at и счётчиками
+голосов плюс версии из news.page_cache, которые сигналы увеличивают при
+голосах, комментариях, смене категорий поста и переименовании категорий
+или пользователей. Совпавший If-None-Match получает 304 до сериализации
+и шаблонов.
+
+Last-Modified не отдаётся: голоса, переименования и вариант страницы
+(язык, тема, часовой пояс) меняют ответ, не оставляя времени изменения,
+и по If-Modified-Since клиент получал бы устаревший 304.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.translation import get_language
+
+from .models import Post
+from .page_cache import ALL_COMMENTS_VERSION_KEY, get_versions, list_version_key, post_version_key
+from .vote_buffer import buffered_deltas
+
+
+def _digest(*parts):
+    return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def post_state(request, pk, post_type):
+    """Состояние поста для валидаторов; запоминается на запросе, чтобы не считать дважды"""
+    cache = request.__dict__.setdefault('_post_state', {})
+    if pk not in cache:
+        state = (
+            Post.objects.filter(pk=pk, post_type=post_type)
+            .values('updated_at', 'likes_count', 'dislikes_count')
+            .first()
+        )
+        if state is not None:
+            state['version'] = get_versions([post_version_key(pk)])[0]
+            state['buffered'] = buffered_deltas([int(pk)]).get(int(pk))
+        cache[pk] = state
+    return cache[pk]
+
+
+def post_etag(request, pk, post_type, *variant):
+    state = post_state(request, pk, post_type)
+    if state is None:
+        return None
+    return _digest(pk, state['updated_at'].timestamp(), state['likes_count'], state['dislikes_count'],
+                   state['buffered'], state['version'], *variant)
+
+
+def page_variant(request):
+    """То, от чего зависит HTML кроме самого поста: пользователь, язык, тема, часовой пояс"""
+    return (request.user.pk, get_language(), getattr(request, 'theme', ''),
+            getattr(request, 'timezone_name', ''))
+
+
+def html_etag(post_type):
+    # Слабый ETag: разметка зависит от CSRF-токена, меняющегося от запроса к запросу
+    def etag(request, pk):
+        value = post_etag(request, pk, post_type, *page_variant(request))
+        return value and f'W/"{value}"'
+    return etag
+
+
+class ConditionalReadMixin:
+    """ETag для list/retrieve API постов (нужен атрибут post_type)"""
+
+    def get_list_etag(self, request):
+        keys = [list_version_key(self.post_type)]
+        if 'comments' in self.get_requested_fields():
+            keys.append(ALL_COMMENTS_VERSION_KEY)
+        return '"%s"' % _digest(request.get_full_path(), *get_versions(keys))
+
+    def get_retrieve_etag(self, request):
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        etag = post_etag(request, pk, self.post_type, request.get_full_path())
+        return etag and f'"{etag}"'
+
+    def _conditional(self, request, etag, respond):
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+        response = respond()
+        if response.status_code == 200 and etag:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(request, self.get_list_etag(request),
+                                 lambda: super(ConditionalReadMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(request, self.get_retrieve_etag(request),
+                                 lambda: super(ConditionalReadMixin, self).retrieve(request, *args, **kwargs))
@@ -1,16 +1,15 @@
-import pytz
 from django.conf import settings
 
 def timezone_context(request):
     """Контекст-процессор для работы с часовыми поясами"""
     return {
-        'current_timezone': request.session.get('django_timezone', settings.TIME_ZONE),
-        'timezones': pytz.all_timezones,
+        # Полный список не рендерится в каждой странице — селектор берёт его из timezone_list
+        'current_timezone': getattr(request, 'timezone_name', '') or settings.TIME_ZONE,
     }
 
 def theme_context(request):
     """Контекст-процессор для работы с темами оформления"""
     return {
-        'current_theme': request.session.get('theme', settings.DEFAULT_THEME),
+        'current_theme': getattr(request, 'theme', settings.DEFAULT_THEME),
         'available_themes': ['light', 'dark'],
     }
\ No newline at end of file
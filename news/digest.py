@@ -0,0 +1,189 @@
+"""Еженедельный дайджест по подпискам.
+
+Посты за неделю и их категории загружаются один раз, подписки читаются
+потоком в порядке user_id, поэтому число запросов не зависит от числа
+подписчиков: посты + связи с категориями + подписки (пачками по chunk_size).
+Письмо рендерится один раз на набор категорий (DigestRenderer).
+"""
+import logging
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.translation import get_language
+
+from . import locks, outbox
+from .models import NewsletterRun, Post, PostCategory, Subscription
+
+SUBJECT = 'Еженедельная рассылка новых статей'
+LOCK_KEY = 'newsletter:weekly:lock'
+
+logger = logging.getLogger(__name__)
+
+
+def week_posts(since, post_type='article'):
+    return (
+        Post.objects.filter(created_at__gte=since, post_type=post_type)
+        .only('id', 'title', 'content', 'created_at', 'post_type')
+        .order_by('-created_at', '-id')
+    )
+
+
+def post_category_links(post_ids):
+    return PostCategory.objects.filter(post_id__in=post_ids).values_list('category_id', 'post_id')
+
+
+def subscribers(after_user_id=0):
+    # Фильтр по категориям делаем в Python: так SQLite идёт по уникальному индексу
+    # (user, category) в нужном порядке и отдаёт подписки потоком без сортировки
+    return (
+        Subscription.objects.filter(user_id__gt=after_user_id).exclude(user__email='')
+        .select_related('user')
+        .only('category_id', 'user__id', 'user__username', 'user__email')
+        .order_by('user_id', 'category_id')
+    )
+
+
+def _article(post):
+    return {
+        'title': post.title,
+        'url': settings.SITE_URL + post.get_absolute_url(),
+        'summary': post.content[:124] + ('...' if len(post.content) > 124 else ''),
+        'published': post.created_at,
+    }
+
+
+def _iter_digests(since=None, post_type='article', chunk_size=2000, after_user_id=0):
+    """Как iter_digests, но ещё выдаёт сигнатуру — набор категорий пользователя с новыми постами.
+
+    after_user_id пропускает подписчиков, до которых уже дошёл прерванный прогон.
+    """
+    since = since or timezone.now() - timedelta(days=7)
+    posts = list(week_posts(since, post_type))
+    if not posts:
+        return
+    order = {post.pk: index for index, post in enumerate(posts)}
+    articles = {post.pk: _article(post) for post in posts}
+    posts_by_category = {}
+    for category_id, post_id in post_category_links(list(order)):
+        posts_by_category.setdefault(category_id, set()).add(post_id)
+    if not posts_by_category:
+        return
+    # Списки статей одинаковы у всех подписчиков с тем же набором категорий
+    articles_by_signature = {}
+    subscriptions = subscribers(after_user_id).iterator(chunk_size=chunk_size)
+    for _, user_subscriptions in groupby(subscriptions, key=lambda sub: sub.user_id):
+        user_subscriptions = [sub for sub in user_subscriptions if sub.category_id in posts_by_category]
+        if not user_subscriptions:
+            continue
+        signature = tuple(sub.category_id for sub in user_subscriptions)
+        if signature not in articles_by_signature:
+            post_ids = set().union(*(posts_by_category[category_id] for category_id in signature))
+            articles_by_signature[signature] = [articles[pk] for pk in sorted(post_ids, key=order.__getitem__)]
+        yield user_subscriptions[0].user, signature, articles_by_signature[signature]
+
+
+def iter_digests(since=None, post_type='article', chunk_size=2000):
+    """Выдаёт (user, articles) по каждому подписчику, у которого есть новые посты.
+
+    articles — словари title/url/summary/published, от новых к старым, без повторов
+    для постов из нескольких категорий пользователя.
+    """
+    for user, _, articles in _iter_digests(since, post_type, chunk_size):
+        yield user, articles
+
+
+class DigestRenderer:
+    """Рендерит письмо один раз на набор категорий и язык, подставляя только имя.
+
+    Кэш живёт, пока живёт экземпляр, — то есть один прогон рассылки.
+    """
+    USERNAME_PLACEHOLDER = '%%DIGEST_USERNAME%%'
+
+    def __init__(self, memoize=True):
+        self.memoize = memoize
+        self.renders = 0
+        self._rendered = {}
+
+    def _render(self, username, articles):
+        self.renders += 1
+        html_message = render_to_string('emails/weekly_newsletter.html', {
+            'user': {'username': username},
+            'articles': articles,
+        })
+        plain_message = f"Здравствуйте, {username}!\n\nНовые статьи за неделю:\n"
+        for article in articles:
+            plain_message += f"- {article['title']}: {article['url']}\n"
+        return plain_message, html_message
+
+    def render(self, user, signature, articles):
+        """Возвращает (plain, html) для пользователя"""
+        if not self.memoize:
+            return self._render(user.username, articles)
+        key = (signature, get_language())
+        if key not in self._rendered:
+            self._rendered[key] = self._render(self.USERNAME_PLACEHOLDER, articles)
+        plain_message, html_message = self._rendered[key]
+        return (plain_message.replace(self.USERNAME_PLACEHOLDER, user.username),
+                html_message.replace(self.USERNAME_PLACEHOLDER, escape(user.username)))
+
+
+def send_weekly_digest(now=None):
+    """Ставит дайджест за неделю в очередь писем. Возвращает число писем, поставленных этим вызовом.
+
+    Прогон один на неделю (NewsletterRun): завершённый повторно не запускается,
+    прерванный продолжается с контрольной точки. Одновременно работает только
+    один исполнитель — остальные (beat, APScheduler, команда) сразу выходят.
+    """
+    now = now or timezone.now()
+    run, _ = NewsletterRun.objects.get_or_create(
+        key=f'weekly:{now:%G-%V}', defaults={'since': now - timedelta(days=7)},
+    )
+    if run.status == NewsletterRun.STATUS_COMPLETED:
+        return 0
+    token = locks.acquire(LOCK_KEY, settings.NEWSLETTER_LOCK_TIMEOUT)
+    if token is None:
+        logger.info('Рассылка %s уже выполняется другим процессом', run.key)
+        return 0
+    try:
+        return _resume(run, token)
+    finally:
+        locks.release(LOCK_KEY, token)
+
+
+def _resume(run, token):
+    renderer = DigestRenderer()
+    week = run.key.split(':', 1)[1]
+    queued_before = run.queued
+    batch = []
+    for user, signature, articles in _iter_digests(since=run.since, after_user_id=run.last_user_id):
+        batch.append((user, renderer.render(user, signature, articles)))
+        if len(batch) >= settings.NEWSLETTER_CHECKPOINT_EVERY:
+            _checkpoint(run, batch, week)
+            batch = []
+            if not locks.extend(LOCK_KEY, token, settings.NEWSLETTER_LOCK_TIMEOUT):
+                # Блокировка истекла и, возможно, уже у другого исполнителя:
+                # он продолжит с только что записанной контрольной точки
+                logger.warning('Рассылка %s потеряла блокировку, прерываемся', run.key)
+                return run.queued - queued_before
+    _checkpoint(run, batch, week, completed=True)
+    return run.queued - queued_before
+
+
+def _checkpoint(run, batch, week, completed=False):
+    """Письма пачки и продвижение контрольной точки фиксируются одной транзакцией"""
+    with transaction.atomic():
+        for user, (plain_message, html_message) in batch:
+            outbox.enqueue(SUBJECT, plain_message, [user.email], html_body=html_message,
+                           dedupe_key=f'weekly:{user.pk}:{week}')
+        if batch:
+            run.last_user_id = batch[-1][0].pk
+            run.queued += len(batch)
+        if completed:
+            run.status = NewsletterRun.STATUS_COMPLETED
+            run.finished_at = timezone.now()
+        run.save()
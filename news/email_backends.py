@@ -0,0 +1,150 @@
+"""Пул SMTP-соединений с параллельной отправкой и ограничением скорости.
+
+PooledSMTPEmailBackend держит на процесс до EMAIL_POOL_SIZE открытых
+SMTP-соединений и отправляет пачку писем из пула потоков того же размера,
+не быстрее EMAIL_RATE_LIMIT писем в секунду (0 — без ограничения).
+Временные ошибки (обрыв соединения, ответы 4xx) повторяются на свежем
+соединении до EMAIL_SEND_RETRIES раз.
+
+Используется как OUTBOX_DELIVERY_BACKEND, поэтому через него идут письма
+из задач, сигналов и планировщика.
+"""
+import logging
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Равномерно распределяет отправки: не чаще rate в секунду на процесс"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class _Pool:
+    def __init__(self, size, rate):
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.limiter = RateLimiter(rate)
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='smtp-pool')
+
+
+def is_transient(error):
+    """Стоит ли повторять отправку: коды 4xx и обрывы соединения.
+
+    SMTPException наследует OSError, поэтому ошибки SMTP без кода
+    (например, SMTPNotSupportedError) проверяются отдельно и не повторяются.
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                              ConnectionError, TimeoutError))
+
+
+class PooledSMTPEmailBackend(BaseEmailBackend):
+    def __init__(self, host=None, port=None, username=None, password=None, use_tls=None, use_ssl=None,
+                 timeout=None, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.smtp_options = {
+            'host': host or settings.EMAIL_HOST,
+            'port': port or settings.EMAIL_PORT,
+            'username': settings.EMAIL_HOST_USER if username is None else username,
+            'password': settings.EMAIL_HOST_PASSWORD if password is None else password,
+            'use_tls': settings.EMAIL_USE_TLS if use_tls is None else use_tls,
+            'use_ssl': settings.EMAIL_USE_SSL if use_ssl is None else use_ssl,
+            'timeout': timeout if timeout is not None else settings.EMAIL_TIMEOUT,
+        }
+        self.retries = settings.EMAIL_SEND_RETRIES
+        self.idle_timeout = settings.EMAIL_POOL_IDLE_TIMEOUT
+        key = (tuple(self.smtp_options.values()), settings.EMAIL_POOL_SIZE, settings.EMAIL_RATE_LIMIT)
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = _Pool(settings.EMAIL_POOL_SIZE, settings.EMAIL_RATE_LIMIT)
+            self.pool = _pools[key]
+
+    # Соединения живут в пуле, а не в экземпляре бэкенда
+    def open(self):
+        return False
+
+    def close(self):
+        pass
+
+    def _checkout(self):
+        while True:
+            try:
+                connection, last_used = self.pool.idle.get_nowait()
+            except queue.Empty:
+                connection = SMTPEmailBackend(fail_silently=False, **self.smtp_options)
+                connection.open()
+                return connection
+            if time.monotonic() - last_used < self.idle_timeout:
+                return connection
+            # Сервер мог закрыть простаивавшее соединение — не рискуем
+            connection.close()
+
+    def _checkin(self, connection):
+        self.pool.idle.put((connection, time.monotonic()))
+
+    def _send_one(self, message):
+        delay = 0.5
+        for attempt in range(self.retries + 1):
+            self.pool.limiter.acquire()
+            connection = None
+            try:
+                connection = self._checkout()
+                connection.send_messages([message])
+            except Exception as error:
+                if connection is not None:
+                    connection.close()
+                if attempt == self.retries or not is_transient(error):
+                    return error
+                logger.warning('Временная ошибка SMTP (%s), повтор через %.1f с', error, delay)
+                time.sleep(delay)
+                delay *= 2
+            else:
+                self._checkin(connection)
+                return None
+
+    def send_each(self, email_messages):
+        """Отправляет письма параллельно; возвращает список ошибок (None — отправлено)"""
+        messages = [message for message in email_messages if message.recipients()]
+        results = dict.fromkeys(map(id, email_messages))
+        for message, error in zip(messages, self.pool.executor.map(self._send_one, messages)):
+            results[id(message)] = error
+        return [results[id(message)] for message in email_messages]
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        errors = self.send_each(email_messages)
+        failed = [error for error in errors if error is not None]
+        if failed and not self.fail_silently:
+            raise failed[0]
+        return sum(1 for message, error in zip(email_messages, errors)
+                   if error is None and message.recipients())
@@ -0,0 +1,155 @@
+"""Быстрый путь чтения для API: словари из .values() и orjson.
+
+Для анонимных GET list/retrieve ответ собирается без ModelSerializer:
+строки берутся через .values(), вложенные категории и комментарии —
+отдельными плоскими запросами, а JSON кодируется orjson (если установлен).
+Ключи, их порядок и формат значений совпадают с PostSerializer и
+CategorySerializer байт в байт.
+"""
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import Comment, PostCategory
+from .vote_buffer import buffered_deltas
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+POST_COLUMNS = ['title', 'content', 'post_type', 'rating', 'likes_count', 'dislikes_count', 'is_published']
+USER_COLUMNS = ['id', 'username', 'email']
+COMMENT_COLUMNS = ['id', 'content', 'created_at', 'likes_count', 'dislikes_count']
+
+_datetime_field = serializers.DateTimeField()
+
+
+def is_enabled():
+    return getattr(settings, 'FAST_API_RENDERING', True)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson; вывод совпадает с компактным UTF-8 выводом DRF"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data)
+        except TypeError:
+            # Ленивые строки, Decimal и прочее, что orjson не знает — обычным путём
+            return super().render(data, accepted_media_type, renderer_context)
+        # DRF экранирует U+2028/U+2029, чтобы JSON оставался валидным JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def post_values(queryset, fields):
+    """values()-queryset с колонками, нужными для полей fields"""
+    columns = ['id', 'created_at'] + [name for name in POST_COLUMNS if name in fields]
+    if 'author' in fields:
+        columns += [f'author__user__{name}' for name in USER_COLUMNS]
+    return queryset.values(*columns)
+
+
+def _categories_by_post(post_ids):
+    result = {post_id: [] for post_id in post_ids}
+    rows = (
+        PostCategory.objects.filter(post_id__in=post_ids)
+        .order_by('category_id')
+        .values_list('post_id', 'category_id', 'category__name')
+    )
+    for post_id, category_id, name in rows:
+        result[post_id].append({'id': category_id, 'name': name})
+    return result
+
+
+def _comments(post_id, limit):
+    rows = (
+        Comment.objects.filter(post_id=post_id)
+        .order_by('-created_at', '-id')
+        .values(*COMMENT_COLUMNS, *[f'user__{name}' for name in USER_COLUMNS])[:limit]
+    )
+    return [
+        {
+            'id': row['id'],
+            'user': {name: row[f'user__{name}'] for name in USER_COLUMNS},
+            'content': row['content'],
+            'created_at': _datetime_field.to_representation(row['created_at']),
+            'likes_count': row['likes_count'],
+            'dislikes_count': row['dislikes_count'],
+        }
+        for row in rows
+    ]
+
+
+def render_posts(rows, fields, comments_limit):
+    """Собирает словари в формате PostSerializer из строк post_values()"""
+    rows = list(rows)
+    post_ids = [row['id'] for row in rows]
+    categories = _categories_by_post(post_ids) if 'categories' in fields else {}
+    deltas = buffered_deltas(post_ids)
+    data = []
+    for row in rows:
+        likes, dislikes = deltas.get(row['id'], (0, 0))
+        values = {
+            'id': row['id'],
+            'created_at': _datetime_field.to_representation(row['created_at']),
+            'likes_count': row.get('likes_count', 0) + likes,
+            'dislikes_count': row.get('dislikes_count', 0) + dislikes,
+            'rating': row.get('rating', 0) + likes - dislikes,
+        }
+        item = {}
+        for name in fields:
+            if name == 'author':
+                item[name] = {column: row[f'author__user__{column}'] for column in USER_COLUMNS}
+            elif name == 'categories':
+                item[name] = categories[row['id']]
+            elif name == 'comments':
+                item[name] = _comments(row['id'], comments_limit)
+            elif name in values:
+                item[name] = values[name]
+            else:
+                item[name] = row[name]
+        data.append(item)
+    return data
+
+
+class FastReadMixin:
+    """list/retrieve для анонимных GET через render_posts/.values().
+
+    Вьюсет обязан определить:
+
+    - get_fast_queryset() — values()-queryset со всеми колонками ответа;
+    - render_fast(rows) — список словарей в формате сериализатора вьюсета.
+
+    Остальные запросы идут в list/retrieve следующего класса в MRO.
+    """
+
+    def use_fast_path(self, request):
+        return (
+            is_enabled()
+            and request.method == 'GET'
+            and not request.user.is_authenticated
+            and getattr(request.accepted_renderer, 'format', None) == 'json'
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_path(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_fast_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.render_fast(page))
+        return Response(self.render_fast(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_path(request):
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(
+            self.get_fast_queryset(), **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        return Response(self.render_fast([row])[0])
@@ -1,13 +1,12 @@
 from django import forms
-from .models import Post, Comment, Category
+from .models import Post, Comment, Category, timezone_choices
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-import pytz
 
 
 class TimezoneForm(forms.Form):
     timezone = forms.ChoiceField(
-        choices=[(tz, tz) for tz in pytz.all_timezones],
+        choices=timezone_choices,
         label="Выберите часовой пояс"
     )
 
@@ -34,7 +33,8 @@ class CommentForm(forms.ModelForm):
 class PostForm(forms.ModelForm):
     class Meta:
         model = Post
-        exclude = ['post_type', 'created_at', 'author']
+        # Голоса и рейтинг меняет только apply_votes
+        exclude = ['post_type', 'created_at', 'author', 'rating', 'likes', 'dislikes', 'likes_count', 'dislikes_count']
 
 
 class RegisterForm(UserCreationForm):
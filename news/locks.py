@@ -0,0 +1,75 @@
+"""Блокировки на ключах кэша с токеном владельца.
+
+acquire кладёт в ключ случайный токен через cache.add; release и extend
+меняют ключ, только если в нём всё ещё наш токен. Блокировка, которая
+истекла и досталась другому воркеру, не снимается и не продлевается
+прежним владельцем.
+
+На Redis (django.core.cache.backends.redis.RedisCache) сравнение и
+изменение идут одной транзакцией WATCH/MULTI: если ключ поменялся между
+ними, транзакция не выполнится. На остальных бэкендах (locmem в тестах,
+локальные кэши процесса) — get и затем delete/touch.
+"""
+import uuid
+
+import redis
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.redis import RedisCache
+
+
+def _redis(cache, key):
+    """(клиент, ключ в Redis, сериализатор) для RedisCache, иначе None"""
+    if not isinstance(cache, RedisCache):
+        return None
+    raw_key = cache.make_and_validate_key(key)
+    return cache._cache.get_client(raw_key, write=True), raw_key, cache._cache._serializer
+
+
+def _compare_and(cache, key, token, command):
+    backend = _redis(cache, key)
+    if backend is None:
+        if cache.get(key) != token:
+            return False
+        return command(None, key)
+    client, raw_key, serializer = backend
+    with client.pipeline() as pipe:
+        try:
+            pipe.watch(raw_key)
+            if pipe.get(raw_key) != serializer.dumps(token):
+                return False
+            pipe.multi()
+            command(pipe, raw_key)
+            return bool(pipe.execute()[0])
+        except redis.WatchError:
+            # Ключ изменился после проверки — блокировка уже не наша
+            return False
+
+
+def acquire(key, timeout, cache=None):
+    """Берёт блокировку; возвращает токен владельца или None, если она занята"""
+    cache = cache or default_cache
+    token = uuid.uuid4().hex
+    return token if cache.add(key, token, timeout) else None
+
+
+def release(key, token, cache=None):
+    """Снимает блокировку, только если она ещё принадлежит token"""
+    cache = cache or default_cache
+
+    def delete(pipe, raw_key):
+        return cache.delete(raw_key) if pipe is None else pipe.delete(raw_key)
+
+    return _compare_and(cache, key, token, delete)
+
+
+def extend(key, token, timeout, cache=None):
+    """Продлевает блокировку на timeout секунд, только если она ещё принадлежит token.
+
+    False означает, что блокировка потеряна и работу пора прекращать.
+    """
+    cache = cache or default_cache
+
+    def touch(pipe, raw_key):
+        return cache.touch(raw_key, timeout) if pipe is None else pipe.expire(raw_key, timeout)
+
+    return _compare_and(cache, key, token, touch)
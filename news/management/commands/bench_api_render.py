@@ -0,0 +1,70 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from news import views
+from news.models import Author, Category, Comment, Post
+
+ENDPOINTS = [
+    ('GET /api/news/', views.NewsViewSet, 'list', '/api/news/', {}),
+    ('GET /api/news/<pk>/', views.NewsViewSet, 'retrieve', '/api/news/{pk}/', {'pk': None}),
+    ('GET /api/articles/', views.ArticleViewSet, 'list', '/api/articles/', {}),
+    ('GET /api/categories/', views.CategoryViewSet, 'list', '/api/categories/', {}),
+]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает запросы в секунду для API с ModelSerializer и с быстрым путём (.values() + orjson)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на каждый замер')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Создать N новостей и статей на время замера (откатывается после)')
+
+    def seed(self, count):
+        user = User.objects.create_user('bench-api-author', 'bench@example.com')
+        author = Author.objects.create(user=user)
+        categories = [Category.objects.create(name=f'bench-api-{i}') for i in range(5)]
+        for i in range(count):
+            for post_type in ('news', 'article'):
+                post = Post.objects.create(author=author, post_type=post_type,
+                                           title=f'Заголовок {i}', content='Текст новости ' * 50)
+                post.categories.set(categories[:i % 5 + 1])
+                Comment.objects.bulk_create(
+                    Comment(post=post, user=user, content=f'Комментарий {j}') for j in range(3)
+                )
+
+    def measure(self, viewset, action, path, kwargs, count):
+        view = viewset.as_view({'get': action})
+        factory = APIRequestFactory()
+        started = time.perf_counter()
+        for _ in range(count):
+            request = factory.get(path, HTTP_ACCEPT='application/json')
+            request.user = AnonymousUser()
+            response = view(request, **kwargs)
+            response.render()
+        return count / (time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            post_id = Post.objects.filter(post_type='news', is_published=True).values_list('pk', flat=True).first()
+
+            self.stdout.write(f'{"endpoint":<26}{"serializer rps":>16}{"fast rps":>12}{"x":>8}')
+            for name, viewset, action, path, kwargs in ENDPOINTS:
+                if 'pk' in kwargs:
+                    if post_id is None:
+                        continue
+                    kwargs = {'pk': post_id}
+                    path = path.format(pk=post_id)
+                with override_settings(FAST_API_RENDERING=False):
+                    slow = self.measure(viewset, action, path, kwargs, options['requests'])
+                with override_settings(FAST_API_RENDERING=True):
+                    fast = self.measure(viewset, action, path, kwargs, options['requests'])
+                self.stdout.write(f'{name:<26}{slow:>16.0f}{fast:>12.0f}{fast / slow:>7.1f}x')
+            transaction.set_rollback(True)
@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from news.digest import DigestRenderer, _iter_digests
+from news.models import Author, Category, Post, Subscription
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает рендеринг еженедельного дайджеста на каждого получателя и с мемоизацией по набору категорий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=10000)
+        parser.add_argument('--categories', type=int, default=6)
+        parser.add_argument('--posts', type=int, default=40)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def seed(self, recipients, categories_count, posts_count, rng):
+        author = Author.objects.create(user=User.objects.create_user('bench-digest-author'))
+        categories = [Category.objects.create(name=f'bench-digest-{i}') for i in range(categories_count)]
+        for i in range(posts_count):
+            post = Post.objects.create(author=author, post_type='article',
+                                       title=f'Статья {i}', content='Текст статьи ' * 40)
+            post.categories.set(rng.sample(categories, rng.randint(1, 2)))
+        # bulk_create без сигналов: приветственные письма на время замера не нужны
+        users = User.objects.bulk_create(
+            User(username=f'bench-digest-{i}', email=f'bench-digest-{i}@example.com')
+            for i in range(recipients)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, category=category)
+            for user in users
+            for category in rng.sample(categories, rng.randint(1, 3))
+        )
+
+    def measure(self, memoize):
+        renderer = DigestRenderer(memoize=memoize)
+        recipients = 0
+        started = time.process_time()
+        for user, signature, articles in _iter_digests():
+            renderer.render(user, signature, articles)
+            recipients += 1
+        return recipients, renderer.renders, time.process_time() - started
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self.seed(options['recipients'], options['categories'], options['posts'], rng)
+            self.stdout.write(f'{"режим":<14}{"получателей":>12}{"рендеров":>10}{"CPU, с":>9}{"CPU на 10k, с":>15}')
+            for name, memoize in (('на каждого', False), ('мемоизация', True)):
+                recipients, renders, cpu = self.measure(memoize)
+                per_10k = cpu * 10000 / recipients if recipients else 0
+                self.stdout.write(f'{name:<14}{recipients:>12}{renders:>10}{cpu:>9.2f}{per_10k:>15.2f}')
+            transaction.set_rollback(True)
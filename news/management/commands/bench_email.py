@@ -0,0 +1,60 @@
+import asyncio
+import socket
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+
+class Command(BaseCommand):
+    help = ('Замеряет писем в секунду на локальном aiosmtpd: отдельное соединение на письмо '
+            '(как send_mail) против пула PooledSMTPEmailBackend')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.02,
+                            help='Задержка ответа сервера на DATA, секунд (имитация удалённого SMTP)')
+        parser.add_argument('--pool-size', type=int, default=8)
+        parser.add_argument('--rate', type=float, default=0, help='EMAIL_RATE_LIMIT для пула, 0 — без ограничения')
+
+    def handle(self, *args, **options):
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            raise CommandError('Для замера нужен пакет aiosmtpd')
+
+        latency = options['latency']
+
+        class Handler:
+            async def handle_DATA(self, server, session, envelope):
+                await asyncio.sleep(latency)
+                return '250 OK'
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        controller = Controller(Handler(), hostname='127.0.0.1', port=port)
+        controller.start()
+        messages = [
+            EmailMessage('Тема', 'Текст письма ' * 50, 'news@example.com', [f'user{i}@example.com'])
+            for i in range(options['messages'])
+        ]
+        try:
+            with override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=port, EMAIL_USE_SSL=False,
+                                   EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                                   EMAIL_POOL_SIZE=options['pool_size'], EMAIL_RATE_LIMIT=options['rate']):
+                started = time.perf_counter()
+                for message in messages:
+                    get_connection('django.core.mail.backends.smtp.EmailBackend').send_messages([message])
+                serial = len(messages) / (time.perf_counter() - started)
+
+                pooled_backend = get_connection('news.email_backends.PooledSMTPEmailBackend')
+                started = time.perf_counter()
+                pooled_backend.send_messages(messages)
+                pooled = len(messages) / (time.perf_counter() - started)
+        finally:
+            controller.stop()
+
+        self.stdout.write(f'соединение на письмо: {serial:8.1f} писем/с')
+        self.stdout.write(f'пул ({options["pool_size"]} соединений): {pooled:8.1f} писем/с  ({pooled / serial:.1f}x)')
@@ -0,0 +1,33 @@
+import time
+from importlib import import_module
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+
+class Command(BaseCommand):
+    help = ('Считает записи в хранилище сессий и Set-Cookie sessionid на N анонимных запросов '
+            '(каждый запрос без cookie, как у краулера)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument('--path', default='/')
+
+    def handle(self, *args, **options):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        client = Client()
+        session_cookies = 0
+        with mock.patch.object(store, 'save', autospec=True, side_effect=store.save) as save:
+            started = time.perf_counter()
+            for _ in range(options['requests']):
+                client.cookies.clear()
+                response = client.get(options['path'])
+                session_cookies += settings.SESSION_COOKIE_NAME in response.cookies
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write(f'запросов:              {options["requests"]}')
+        self.stdout.write(f'записей сессий:        {save.call_count}')
+        self.stdout.write(f'Set-Cookie {settings.SESSION_COOKIE_NAME}:  {session_cookies}')
+        self.stdout.write(f'время на запрос:       {elapsed / options["requests"] * 1000:.2f} мс')
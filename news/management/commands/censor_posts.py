@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from news.censor import recensor
+from news.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сохранённые отцензурированные заголовки и тексты постов (после изменения списка слов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = recensor(Post, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено {len(updated)} постов.'))
@@ -0,0 +1,89 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.request import Request
+
+from news import digest, views
+from news.models import Category, Comment, Post, Subscription
+from news.pagination import KEYSET_ORDERING, keyset_filter
+
+# Полный проход по таблице без индекса и сортировка во временном B-дереве
+FULL_SCAN = re.compile(r'\bSCAN (\w+)$')
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+class Command(BaseCommand):
+    help = ('Печатает EXPLAIN QUERY PLAN для запросов из news/views.py и news/digest.py '
+            'и отмечает полные проходы и сортировки во временном B-дереве')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strict', action='store_true',
+                            help='Завершиться с ошибкой, если найден хотя бы один проблемный план')
+
+    def viewset_queryset(self, viewset_class, action):
+        request = Request(RequestFactory().get('/'))
+        return viewset_class(request=request, action=action, kwargs={}, format_kwarg=None).get_queryset()
+
+    def querysets(self):
+        user_id = User.objects.values_list('pk', flat=True).first() or 1
+        post_id = Post.objects.values_list('pk', flat=True).first() or 1
+        week_ago = timezone.now() - timedelta(days=7)
+        news = views.NewsListView().get_queryset()
+
+        yield 'views.NewsListView (первая страница)', news[:11]
+        yield 'views.NewsListView (страница по курсору)', keyset_filter(news, timezone.now(), post_id)[:11]
+        yield 'views.NewsListView (предыдущая страница)', (
+            keyset_filter(news, timezone.now(), post_id, reverse=True).order_by('created_at', 'id')[:11]
+        )
+        step = settings.LEGACY_PAGE_CHECKPOINT_ROWS
+        yield 'views.NewsListView (?page=N, шаг от контрольной точки)', (
+            keyset_filter(news, timezone.now(), post_id).values_list('created_at', 'id')[step - 1:step]
+        )
+        yield 'views.NewsSearchView', views.NewsSearchView().get_queryset()[:11]
+        yield 'views.ArticlesListView', views.ArticlesListView().get_queryset()[:11]
+        yield 'views.NewsDetailViewWithComments (пост)', Post.objects.filter(pk=post_id, post_type='news')
+        yield 'views.NewsDetailViewWithComments (комментарии)', (
+            Comment.objects.filter(post_id=post_id).order_by('-created_at')
+        )
+        yield 'views.ArticleDetailView', views.ArticleDetailView().get_queryset().filter(pk=post_id)
+        yield 'views.NewsViewSet.list', self.viewset_queryset(views.NewsViewSet, 'list').order_by(*KEYSET_ORDERING)[:11]
+        yield 'views.ArticleViewSet.list', (
+            self.viewset_queryset(views.ArticleViewSet, 'list').order_by(*KEYSET_ORDERING)[:11]
+        )
+        yield 'views.CategoryViewSet.list', Category.objects.all()
+        yield 'views.CommentViewSet.list', Comment.objects.all()
+        yield 'views.manage_subscriptions', Subscription.objects.filter(user_id=user_id)
+        yield 'digest.iter_digests (посты за неделю)', digest.week_posts(week_ago)
+        yield 'digest.iter_digests (категории постов)', digest.post_category_links([post_id])
+        yield 'digest.iter_digests (подписчики)', digest.subscribers()
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                f'Разбор планов рассчитан на SQLite, текущая БД: {connection.vendor}.'
+            ))
+        problems = []
+        for name, queryset in self.querysets():
+            plan = queryset.explain()
+            flagged = [
+                line for line in plan.splitlines()
+                if FULL_SCAN.search(line.strip()) or TEMP_SORT in line
+            ]
+            if flagged:
+                problems.append(name)
+            style = self.style.WARNING if flagged else self.style.SUCCESS
+            self.stdout.write(style(f'== {name}'))
+            self.stdout.write(plan)
+            for line in flagged:
+                self.stdout.write(self.style.WARNING(f'   ^ {line.strip()}'))
+            self.stdout.write('')
+
+        if problems and options['strict']:
+            raise CommandError('Полный проход или временная сортировка в запросах: ' + '; '.join(problems))
+        self.stdout.write(f'Проблемных планов: {len(problems)}')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from news.search import is_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов (SQLite FTS5)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Количество постов, читаемых и вставляемых за раз')
+
+    def handle(self, *args, **options):
+        if not is_available():
+            self.stdout.write(self.style.WARNING('Полнотекстовый индекс поддерживается только на SQLite.'))
+            return
+        count = rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано {count} постов.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from news.ratings import recompute_author_ratings
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинги всех авторов агрегирующими запросами, пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Количество авторов, обрабатываемых за один проход')
+
+    def handle(self, *args, **options):
+        count = recompute_author_ratings(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитаны рейтинги {count} авторов.'))
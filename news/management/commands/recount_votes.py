@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from news.models import Post, Comment
+from news.votes import recount_votes
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики лайков/дизлайков и рейтинг постов и комментариев по M2M-таблицам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-rating',
+            action='store_true',
+            help='Пересчитать только счётчики, не трогая рейтинг',
+        )
+
+    def handle(self, *args, **options):
+        rating = not options['keep_rating']
+        for model in (Post, Comment):
+            updated = recount_votes(model, rating=rating)
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: пересчитано {updated} записей.'
+            ))
@@ -0,0 +1,153 @@
+"""Метрики запроса: число и время SQL, попадания в кэш, время шаблонов.
+
+Счётчики живут в contextvar и заполняются только внутри collect(), то есть
+для запросов, отобранных RequestMetricsMiddleware. SQL считается через
+connection.execute_wrapper, чтение кэша и рендеринг шаблонов — обёртками,
+которые install() один раз ставит на классы бэкендов кэша и Template; вне
+отобранных запросов обёртка стоит одного чтения contextvar. Вложенные вызовы
+(TwoTierCache → Redis, include внутри шаблона) не считаются повторно.
+"""
+import contextvars
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+from django.utils.module_loading import import_string
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+_MISSING = object()
+_installed = False
+
+
+class RequestMetrics:
+    __slots__ = ('sql_count', 'sql_time', 'cache_hits', 'cache_misses', 'template_time',
+                 'in_cache', 'in_template')
+
+    def __init__(self):
+        self.sql_count = self.cache_hits = self.cache_misses = 0
+        self.sql_time = self.template_time = 0.0
+        self.in_cache = self.in_template = False
+
+
+def _count_sql(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_count += 1
+        metrics.sql_time += perf_counter() - started
+
+
+@contextmanager
+def collect():
+    """Собирает метрики кода внутри блока (в том же потоке/контексте)"""
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(_count_sql))
+            yield metrics
+    finally:
+        _current.reset(token)
+
+
+def _counted_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics.in_cache:
+            return get(self, key, default, version)
+        metrics.in_cache = True
+        try:
+            value = get(self, key, _MISSING, version)
+        finally:
+            metrics.in_cache = False
+        if value is _MISSING:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+    wrapper.counted = True
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    @wraps(get_many)
+    def wrapper(self, keys, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics.in_cache:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        metrics.in_cache = True
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            metrics.in_cache = False
+        metrics.cache_hits += len(found)
+        metrics.cache_misses += len(keys) - len(found)
+        return found
+    wrapper.counted = True
+    return wrapper
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapper(self, context):
+        metrics = _current.get()
+        if metrics is None or metrics.in_template:
+            return render(self, context)
+        metrics.in_template = True
+        started = perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            metrics.template_time += perf_counter() - started
+            metrics.in_template = False
+    wrapper.counted = True
+    return wrapper
+
+
+def install():
+    """Ставит обёртки на бэкенды из CACHES и на Template.render (один раз на процесс)"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    Template.render = _timed_render(Template.render)
+    for options in settings.CACHES.values():
+        backend = import_string(options['BACKEND'])
+        if not getattr(backend.get, 'counted', False):
+            backend.get = _counted_get(backend.get)
+            backend.get_many = _counted_get_many(backend.get_many)
+
+
+def server_timing(metrics, wall):
+    return ', '.join([
+        f'total;dur={wall * 1000:.1f}',
+        f'sql;dur={metrics.sql_time * 1000:.1f};desc="{metrics.sql_count} queries"',
+        f'cache;desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"',
+        f'template;dur={metrics.template_time * 1000:.1f}',
+    ])
+
+
+def as_record(request, response, metrics, wall):
+    match = request.resolver_match
+    return {
+        'method': request.method,
+        'path': request.path,
+        'view': match.view_name if match else None,
+        'status': response.status_code,
+        'wall_ms': round(wall * 1000, 2),
+        'sql_count': metrics.sql_count,
+        'sql_ms': round(metrics.sql_time * 1000, 2),
+        'cache_hits': metrics.cache_hits,
+        'cache_misses': metrics.cache_misses,
+        'template_ms': round(metrics.template_time * 1000, 2),
+    }
@@ -1,14 +1,242 @@
-from django.utils import timezone
+import hashlib
+import json
+import logging
+import random
+from datetime import datetime, timezone as dt_timezone
+from functools import lru_cache
+from time import perf_counter
+from zoneinfo import ZoneInfo
+
 import pytz
-from django.utils.deprecation import MiddlewareMixin
-
-class TimezoneMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        if hasattr(request.user, 'userprofile'):
-            tz = request.user.userprofile.timezone
-            timezone.activate(pytz.timezone(tz))
-
-class ThemeMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        if 'dark_mode' not in request.session:
-            request.session['dark_mode'] = False
\ No newline at end of file
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.translation import get_language_from_request
+
+from . import metrics
+from .models import UserProfile
+from .page_cache import CSRF_PLACEHOLDER, fill_csrf_tokens, strip_csrf_tokens
+
+TIMEZONE_COOKIE_SALT = 'news.timezone'
+THEMES = ('light', 'dark')
+
+metrics_logger = logging.getLogger('news.metrics')
+
+ANONYMOUS_PAGE_KEY_PREFIX = 'anonpage'
+
+
+def is_valid_timezone(name):
+    return name in pytz.all_timezones_set
+
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    """Объекты часовых поясов создаются один раз на процесс"""
+    return ZoneInfo(name)
+
+
+@lru_cache(maxsize=1024)
+def _timezone_from_cookie(value):
+    # Проверка подписи — десятки микросекунд, поэтому результат запоминаем по значению cookie
+    try:
+        name = signing.get_cookie_signer(
+            salt=settings.TIMEZONE_COOKIE_NAME + TIMEZONE_COOKIE_SALT,
+        ).unsign(value)
+    except signing.BadSignature:
+        return ''
+    return name if is_valid_timezone(name) else ''
+
+
+def remember_theme(response, theme):
+    response.set_cookie(settings.THEME_COOKIE_NAME, theme, max_age=settings.THEME_COOKIE_AGE, samesite='Lax')
+
+
+def remember_timezone(response, name):
+    """Записывает выбранный часовой пояс в подписанную cookie"""
+    response.set_signed_cookie(
+        settings.TIMEZONE_COOKIE_NAME, name, salt=TIMEZONE_COOKIE_SALT,
+        max_age=settings.TIMEZONE_COOKIE_AGE, httponly=True, samesite='Lax',
+    )
+
+
+class TimezoneMiddleware:
+    """Активирует часовой пояс из подписанной cookie — без обращений к БД и сессии.
+
+    Cookie ставят set_timezone и вход пользователя (из профиля, см.
+    news.signals); выбранный пояс доступен шаблонам как request.timezone_name.
+    Если cookie нет, а сессия есть (вход был до появления cookie), пояс один
+    раз берётся из профиля и записывается в cookie.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = settings.TIMEZONE_COOKIE_NAME
+
+    def __call__(self, request):
+        value = request.COOKIES.get(self.cookie_name)
+        name = _timezone_from_cookie(value) if value else ''
+        if not name and settings.SESSION_COOKIE_NAME in request.COOKIES:
+            name = request.timezone_changed = self._profile_timezone(request)
+        request.timezone_name = name
+        if name:
+            timezone.activate(get_zone(name))
+        else:
+            timezone.deactivate()
+        response = self.get_response(request)
+        changed = getattr(request, 'timezone_changed', None)
+        if changed:
+            remember_timezone(response, changed)
+        return response
+
+    def _profile_timezone(self, request):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return ''
+        name = UserProfile.objects.filter(user=user).values_list('timezone', flat=True).first()
+        return name if name and is_valid_timezone(name) else ''
+
+
+class ThemeMiddleware:
+    """Тема оформления из cookie (request.theme). Сессию не трогает, поэтому
+    анонимный посетитель не создаёт записей в хранилище сессий."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = settings.THEME_COOKIE_NAME
+
+    def __call__(self, request):
+        theme = request.COOKIES.get(self.cookie_name)
+        request.theme = theme if theme in THEMES else settings.DEFAULT_THEME
+        return self.get_response(request)
+
+
+class AnonymousPageCacheMiddleware:
+    """Отдаёт готовый HTML запросам без cookie раньше сессий, auth, allauth и локали.
+
+    Обходятся: методы кроме GET/HEAD, запросы с любой cookie (у вошедшего
+    пользователя всегда есть сессия) или заголовком Authorization.
+    Сохраняются только ответы 200 text/html представлений, отметивших свои
+    версии (news.page_cache.page_versions); при выдаче версии сверяются
+    одним get_many, так что правки видны сразу.
+
+    CSRF-токены в сохранённой разметке заменяются меткой; при выдаче
+    подставляется токен нового секрета и ставится CSRF-cookie. Токен у
+    каждой копии свой, поэтому ответ помечен private, а Vary: Cookie
+    отделяет его от страниц посетителей с cookie.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cache = caches[settings.ANONYMOUS_PAGE_CACHE_ALIAS]
+        self.timeout = settings.ANONYMOUS_PAGE_CACHE_TIMEOUT
+
+    def __call__(self, request):
+        meta = request.META
+        if (request.method not in ('GET', 'HEAD')
+                or meta.get('HTTP_COOKIE') or 'HTTP_AUTHORIZATION' in meta):
+            return self.get_response(request)
+        key = self._key(request)
+        entry = self.cache.get(key)
+        if entry is not None:
+            response = self._replay(request, entry)
+            if response is not None:
+                return response
+        request.anonymous_page_cache = True
+        response = self.get_response(request)
+        self._store(request, key, response)
+        return response
+
+    def _key(self, request):
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f'{ANONYMOUS_PAGE_KEY_PREFIX}:{get_language_from_request(request, check_path=True)}:{path}'
+
+    def _replay(self, request, entry):
+        content, status, headers, versions = entry
+        if self.cache.get_many(list(versions)) != versions:
+            return None
+        response = HttpResponse(status=status)
+        for name, value in headers:
+            response.headers[name] = value
+        if CSRF_PLACEHOLDER in content:
+            content = fill_csrf_tokens(request, content)
+            self._set_csrf_cookie(request, response)
+        response.content = content
+        return response
+
+    def _store(self, request, key, response):
+        versions = getattr(request, 'page_versions', None)
+        if (versions is None or response.status_code != 200 or response.streaming
+                or not response.get('Content-Type', '').startswith('text/html')
+                or set(response.cookies) - {settings.CSRF_COOKIE_NAME}
+                or response.has_header('Cache-Control')):
+            return
+        content = strip_csrf_tokens(request, response.content)
+        private = CSRF_PLACEHOLDER in content
+        self._patch_headers(response, private)
+        headers = [(name, value) for name, value in response.items() if name != 'Content-Length']
+        self.cache.set(key, (content, response.status_code, headers, versions), self.timeout)
+
+    def _patch_headers(self, response, private):
+        patch_vary_headers(response, ('Cookie', 'Accept-Language'))
+        if private:
+            patch_cache_control(response, private=True, max_age=0)
+        else:
+            patch_cache_control(response, public=True, max_age=settings.ANONYMOUS_PAGE_CACHE_MAX_AGE)
+
+    @staticmethod
+    def _set_csrf_cookie(request, response):
+        response.set_cookie(
+            settings.CSRF_COOKIE_NAME, request.META['CSRF_COOKIE'],
+            max_age=settings.CSRF_COOKIE_AGE, domain=settings.CSRF_COOKIE_DOMAIN,
+            path=settings.CSRF_COOKIE_PATH, secure=settings.CSRF_COOKIE_SECURE,
+            httponly=settings.CSRF_COOKIE_HTTPONLY, samesite=settings.CSRF_COOKIE_SAMESITE,
+        )
+
+
+class RequestMetricsMiddleware:
+    """Для доли запросов METRICS_SAMPLE_RATE пишет строку JSON в логгер news.metrics
+    (view, время, SQL, кэш, шаблоны) и, если включено, заголовок Server-Timing.
+
+    Стоит первым в MIDDLEWARE, чтобы мерить весь стек. Собственные затраты
+    (сбор и запись) сравниваются с временем запросов; если их доля выше
+    METRICS_OVERHEAD_BUDGET, доля отбираемых запросов снижается.
+    """
+    DECAY = 0.99
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.METRICS_SAMPLE_RATE
+        self.budget = settings.METRICS_OVERHEAD_BUDGET
+        self.server_timing = settings.METRICS_SERVER_TIMING
+        # Затухающие суммы времени отобранных запросов и затрат на их учёт
+        self.wall = self.overhead = 0.0
+        if self.sample_rate:
+            metrics.install()
+
+    def effective_rate(self):
+        if not self.overhead:
+            return self.sample_rate
+        # Затраты приходятся только на отобранные запросы, поэтому их доля во всём времени ≈ rate × ratio
+        return min(self.sample_rate, self.budget * self.wall / self.overhead)
+
+    def __call__(self, request):
+        if not self.sample_rate or random.random() >= self.effective_rate():
+            return self.get_response(request)
+        started = perf_counter()
+        with metrics.collect() as collected:
+            setup = perf_counter() - started
+            response = self.get_response(request)
+        finished = perf_counter()
+        wall = finished - started
+        if self.server_timing:
+            response['Server-Timing'] = metrics.server_timing(collected, wall)
+        record = metrics.as_record(request, response, collected, wall)
+        record['ts'] = datetime.now(dt_timezone.utc).isoformat(timespec='milliseconds')
+        metrics_logger.info(json.dumps(record, ensure_ascii=False))
+        overhead = setup + perf_counter() - finished
+        self.wall = self.wall * self.DECAY + wall
+        self.overhead = self.overhead * self.DECAY + overhead
+        return response
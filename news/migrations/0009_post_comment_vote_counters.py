@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:39
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _vote_count(model, field):
+    # Копия news.votes.vote_count_subquery на момент миграции, по историческим моделям
+    m2m = model._meta.get_field(field)
+    source = m2m.m2m_field_name()
+    votes = (
+        m2m.remote_field.through.objects
+        .filter(**{source: OuterRef('pk')})
+        .order_by()
+        .values(source)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(votes), Value(0))
+
+
+def backfill_vote_counters(apps, schema_editor):
+    for model_name in ('Post', 'Comment'):
+        model = apps.get_model('news', model_name)
+        model.objects.update(likes_count=_vote_count(model, 'likes'), dislikes_count=_vote_count(model, 'dislikes'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0008_rename_text_comment_content_comment_dislikes_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_vote_counters, migrations.RunPython.noop),
+    ]
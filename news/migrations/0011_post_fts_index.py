@@ -0,0 +1,32 @@
+from django.db import migrations
+
+FTS_TABLE = 'news_post_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"title, content, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    Post = apps.get_model('news', 'Post')
+    rows = Post.objects.order_by('pk').values_list('pk', 'title', 'content')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)', list(rows))
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0010_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
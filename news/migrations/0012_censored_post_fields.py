@@ -0,0 +1,65 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:50
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Копия news.censor на момент миграции: само приложение может измениться, а миграция — нет
+def _build_pattern(words):
+    words = sorted({word for word in words if word}, key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile(r'\b(' + '|'.join(map(re.escape, words)) + r')\b', flags=re.IGNORECASE)
+
+
+def _mask(match):
+    word = match.group()
+    return word[0] + '*' * (len(word) - 1)
+
+
+def backfill_censored_fields(apps, schema_editor):
+    Post = apps.get_model('news', 'Post')
+    pattern = _build_pattern(getattr(settings, 'CENSOR_BAD_WORDS', []))
+    if pattern is None:
+        Post.objects.update(title_censored=models.F('title'), content_censored=models.F('content'))
+        return
+    batch = []
+    for post in Post.objects.only('pk', 'title', 'content').iterator(chunk_size=500):
+        post.title_censored = pattern.sub(_mask, post.title)
+        post.content_censored = pattern.sub(_mask, post.content)
+        batch.append(post)
+        if len(batch) >= 500:
+            Post.objects.bulk_update(batch, ['title_censored', 'content_censored'])
+            batch = []
+    if batch:
+        Post.objects.bulk_update(batch, ['title_censored', 'content_censored'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0011_post_fts_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BannedWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='content_censored',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='title_censored',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_censored_fields, migrations.RunPython.noop),
+    ]
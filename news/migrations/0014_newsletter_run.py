@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0013_outbox_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsletterRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('since', models.DateTimeField()),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('completed', 'Завершён')], default='running', max_length=10)),
+                ('last_user_id', models.PositiveBigIntegerField(default=0)),
+                ('queued', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:25
+
+import news.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0014_newsletter_run'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='timezone',
+            field=models.CharField(choices=news.models.timezone_choices, default='Europe/Moscow', max_length=50),
+        ),
+    ]
@@ -1,19 +1,31 @@
 from django.urls import reverse
 from django.utils.translation import gettext as _
 from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.db import models
+from django.dispatch import Signal, receiver
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.utils import timezone
 import pytz
+from functools import lru_cache
 
-TIMEZONE_CHOICES = [(tz, tz) for tz in pytz.all_timezones]
+
+@lru_cache(maxsize=None)
+def timezone_choices():
+    """Список часовых поясов для полей и форм; строится при первом обращении"""
+    return [(tz, tz) for tz in pytz.all_timezones]
+
+
+# Отправляется внутри транзакции голосования: instance, rating_delta
+vote_changed = Signal()
 
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     timezone = models.CharField(
         max_length=50,
-        choices=[(tz, tz) for tz in pytz.all_timezones],
+        choices=timezone_choices,
         default='Europe/Moscow'
     )
 
@@ -33,6 +45,82 @@ def save_user_profile(sender, instance, **kwargs):
         instance.userprofile.save()
 
 
+class VotableModel(models.Model):
+    """Денормализованные счётчики голосов для постов и комментариев.
+
+    Счётчики меняются одним атомарным UPDATE через F-выражения, поэтому
+    параллельные голоса не теряются, а остальные поля строки не перезаписываются.
+    Полное сохранение (формы, админка) счётчики не пишет: иначе значения,
+    прочитанные до правки, затёрли бы голоса, поданные за это время.
+    """
+    COUNTER_FIELDS = ('likes_count', 'dislikes_count', 'rating')
+
+    likes_count = models.PositiveIntegerField(default=0)
+    dislikes_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            skip = {*self.COUNTER_FIELDS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skip
+            ]
+        super().save(*args, **kwargs)
+
+    def like(self, user):
+        return self.apply_votes({user.pk: 1})
+
+    def dislike(self, user):
+        return self.apply_votes({user.pk: -1})
+
+    def apply_votes(self, votes):
+        """Применяет пачку голосов {user_id: 1 | -1} одной транзакцией.
+
+        Повторный голос того же знака ничего не меняет, голос противоположного
+        знака переносит пользователя из likes в dislikes и наоборот.
+        Возвращает True, если что-то изменилось.
+        """
+        source = self.likes.source_field_name
+        target = f'{self.likes.target_field_name}_id'
+        tables = {1: self.likes.through.objects, -1: self.dislikes.through.objects}
+        lookup = {f'{source}_id': self.pk, f'{target}__in': list(votes)}
+        with transaction.atomic():
+            # Блокируем строку, чтобы параллельные голоса за один объект не разошлись со счётчиками
+            type(self).objects.select_for_update().filter(pk=self.pk).exists()
+            current = {}
+            for sign, table in tables.items():
+                for user_id in table.filter(**lookup).values_list(target, flat=True):
+                    current[user_id] = sign
+            changed = {user_id: sign for user_id, sign in votes.items()
+                       if current.get(user_id, 0) != sign}
+            if not changed:
+                return False
+            deltas = {1: 0, -1: 0}
+            for sign, table in tables.items():
+                removed = [user_id for user_id in changed if current.get(user_id) == sign]
+                added = [user_id for user_id, new in changed.items() if new == sign]
+                if removed:
+                    table.filter(**{f'{source}_id': self.pk, f'{target}__in': removed}).delete()
+                if added:
+                    table.bulk_create([
+                        table.model(**{f'{source}_id': self.pk, target: user_id})
+                        for user_id in added
+                    ])
+                deltas[sign] = len(added) - len(removed)
+            rating_delta = deltas[1] - deltas[-1]
+            self.likes_count = F('likes_count') + deltas[1]
+            self.dislikes_count = F('dislikes_count') + deltas[-1]
+            self.rating = F('rating') + rating_delta
+            update_fields = ['likes_count', 'dislikes_count', 'rating']
+            self.save(update_fields=update_fields)
+            vote_changed.send(sender=type(self), instance=self, rating_delta=rating_delta)
+        self.refresh_from_db(fields=update_fields)
+        return True
+
+
 class Author(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     rating = models.IntegerField(default=0)
@@ -41,19 +129,10 @@ class Author(models.Model):
         return self.user.username
 
     def update_rating(self):
-        post_rating = sum(post.rating * 3 for post in self.post_set.all())
+        from .ratings import compute_author_ratings
 
-        # Используем правильное имя related_name для комментариев пользователя
-        comments_rating = sum(comment.rating for comment in self.user.comment_set.all())
-
-        # Используем правильное имя related_name для комментариев к постам автора
-        comments_to_posts_rating = sum(
-            comment.rating for post in self.post_set.all()
-            for comment in post.comments.all()
-        )
-
-        self.rating = post_rating + comments_rating + comments_to_posts_rating
-        self.save()
+        self.rating = compute_author_ratings([self.pk])[self.pk]
+        self.save(update_fields=['rating'])
 
 
 class Category(models.Model):
@@ -63,18 +142,29 @@ class Category(models.Model):
         return self.name
 
 
+class BannedWord(models.Model):
+    word = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.word
+
+
 class Subscription(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='subscriptions')
 
     class Meta:
         unique_together = ('user', 'category')
+        indexes = [
+            # Рассылки выбирают подписчиков по категории
+            models.Index(fields=['category', 'user'], name='subscription_category_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.category.name}"
 
 
-class Post(models.Model):
+class Post(VotableModel):
     POST_TYPE_CHOICES = [
         ('article', _('Статья')),
         ('news', _('Новость')),
@@ -87,34 +177,62 @@ class Post(models.Model):
     categories = models.ManyToManyField(Category, through='PostCategory')
     title = models.CharField(max_length=255)
     content = models.TextField()
+    # Заполняются при сохранении, чтобы шаблоны не прогоняли цензуру на каждом рендере
+    title_censored = models.CharField(max_length=255, blank=True, editable=False)
+    content_censored = models.TextField(blank=True, editable=False)
     rating = models.IntegerField(default=0)
     is_published = models.BooleanField(default=True)
 
     likes = models.ManyToManyField(User, related_name='post_likes', blank=True)
     dislikes = models.ManyToManyField(User, related_name='post_dislikes', blank=True)
 
+    class Meta:
+        indexes = [
+            # Списки на сайте: post_type + keyset-сортировка
+            models.Index(fields=['post_type', '-created_at', '-id'], name='post_type_created_idx'),
+            # API: только опубликованные
+            models.Index(fields=['post_type', 'is_published', '-created_at', '-id'],
+                         name='post_type_published_idx'),
+            # Выборки «за неделю» без фильтра по типу
+            models.Index(fields=['created_at'], name='post_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.title} ({self.get_post_type_display()})'
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'title', 'content'} & set(update_fields):
+            self.censor()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'title_censored', 'content_censored'}
+        super().save(*args, **kwargs)
+
+    def censor(self):
+        from .censor import censor_text
+
+        self.title_censored = censor_text(self.title)
+        self.content_censored = censor_text(self.content)
+
     @property
-    def likes_count(self):
-        return self.likes.count()
+    def censored_title(self):
+        if settings.CENSOR_AT_WRITE and (self.title_censored or not self.title):
+            return self.title_censored
+        from .censor import censor_text
+
+        return censor_text(self.title)
 
     @property
-    def dislikes_count(self):
-        return self.dislikes.count()
+    def censored_content(self):
+        if settings.CENSOR_AT_WRITE and (self.content_censored or not self.content):
+            return self.content_censored
+        from .censor import censor_text
 
-    def __str__(self):
-        return f'{self.title} ({self.get_post_type_display()})'
+        return censor_text(self.content)
 
     def preview(self):
         return self.content[:124] + '...' if len(self.content) > 124 else self.content
 
-    def like(self):
-        self.rating += 1
-        self.save()
-
-    def dislike(self):
-        self.rating -= 1
-        self.save()
-
     def get_absolute_url(self):
         if self.post_type == 'news':
             return reverse('news_detail', args=[str(self.pk)])
@@ -130,12 +248,15 @@ class PostCategory(models.Model):
 
     class Meta:
         unique_together = ('post', 'category')
+        indexes = [
+            models.Index(fields=['category', 'post'], name='postcategory_category_idx'),
+        ]
 
     def __str__(self):
         return f"{self.post.title} - {self.category.name}"
 
 
-class Comment(models.Model):
+class Comment(VotableModel):
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
@@ -145,21 +266,76 @@ class Comment(models.Model):
     likes = models.ManyToManyField(User, related_name='comment_likes', blank=True)
     dislikes = models.ManyToManyField(User, related_name='comment_dislikes', blank=True)
 
-    @property
-    def likes_count(self):
-        return self.likes.count()
-
-    @property
-    def dislikes_count(self):
-        return self.dislikes.count()
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created_at'], name='comment_post_created_idx'),
+        ]
 
     def __str__(self):
         return (self.content[:50] + '...') if len(self.content) > 50 else self.content
 
-    def like(self):
-        self.rating += 1
-        self.save()
 
-    def dislike(self):
-        self.rating -= 1
-        self.save()
\ No newline at end of file
+class OutboxEmail(models.Model):
+    """Письмо в очереди на отправку.
+
+    Строка пишется в той же транзакции, что и породившее её изменение, а
+    отправляет её диспетчер (news.outbox.dispatch) уже после коммита.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('В очереди')),
+        (STATUS_SENT, _('Отправлено')),
+        (STATUS_FAILED, _('Ошибка')),
+    ]
+
+    subject = models.CharField(max_length=998)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    # Повторная постановка того же письма (перезапуск задачи) не создаёт дубль
+    dedupe_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} → {', '.join(self.to)} ({self.status})"
+
+
+class NewsletterRun(models.Model):
+    """Прогон еженедельной рассылки с контрольной точкой.
+
+    Подписчики обходятся по возрастанию id, last_user_id сохраняется вместе
+    с пачкой писем в одной транзакции — после сбоя прогон продолжается с неё.
+    """
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, _('Выполняется')),
+        (STATUS_COMPLETED, _('Завершён')),
+    ]
+
+    key = models.CharField(max_length=32, unique=True)
+    since = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    last_user_id = models.PositiveBigIntegerField(default=0)
+    queued = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.status}, {self.queued})"
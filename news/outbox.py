@@ -0,0 +1,164 @@
+"""Транзакционная очередь исходящих писем.
+
+enqueue() пишет OutboxEmail в текущей транзакции и после коммита будит
+задачу dispatch_outbox; если брокер недоступен, письмо подберёт
+периодический запуск той же задачи. dispatch() забирает пачку готовых
+писем, отправляет их через OUTBOX_DELIVERY_BACKEND (пул SMTP-соединений,
+news.email_backends) и при ошибке откладывает письмо с экспоненциальной
+задержкой.
+
+OutboxEmailBackend направляет в очередь и send_mail сторонних приложений
+(например, письма подтверждения allauth), если указать его в EMAIL_BACKEND.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+def _wake_dispatcher():
+    from .tasks import dispatch_outbox
+
+    try:
+        dispatch_outbox.delay()
+    except Exception:
+        # Письмо уже в таблице — его отправит периодический запуск диспетчера
+        logger.exception('Не удалось поставить задачу отправки писем')
+
+
+def _schedule_wake():
+    """Одна побудка диспетчера на транзакцию: остальные письма подберёт он же или beat"""
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(
+        callback[1] is _wake_dispatcher for callback in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(_wake_dispatcher)
+
+
+def enqueue(subject, body, to, html_body='', from_email=None, cc=None, bcc=None, dedupe_key=None):
+    """Ставит письмо в очередь в рамках текущей транзакции"""
+    fields = {
+        'subject': subject,
+        'body': body,
+        'html_body': html_body or '',
+        'from_email': from_email or settings.DEFAULT_FROM_EMAIL,
+        'to': list(to),
+        'cc': list(cc or []),
+        'bcc': list(bcc or []),
+    }
+    if dedupe_key:
+        email, _ = OutboxEmail.objects.get_or_create(dedupe_key=dedupe_key, defaults=fields)
+    else:
+        email = OutboxEmail.objects.create(**fields)
+    _schedule_wake()
+    return email
+
+
+def enqueue_message(message, dedupe_key=None):
+    html_body = next((content for content, mimetype in getattr(message, 'alternatives', [])
+                      if mimetype == 'text/html'), '')
+    return enqueue(message.subject, message.body, message.to, html_body=html_body,
+                   from_email=message.from_email, cc=message.cc, bcc=message.bcc, dedupe_key=dedupe_key)
+
+
+def to_message(email, connection=None):
+    message = EmailMultiAlternatives(email.subject, email.body, email.from_email, email.to,
+                                     cc=email.cc, bcc=email.bcc, connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def retry_delay(attempts):
+    return min(settings.OUTBOX_RETRY_BASE * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX)
+
+
+def send_each(connection, messages):
+    """Ошибка (или None) на каждое письмо; пул SMTP отправляет пачку параллельно"""
+    if hasattr(connection, 'send_each'):
+        return connection.send_each(messages)
+    errors = []
+    for message in messages:
+        try:
+            connection.send_messages([message])
+        except Exception as error:
+            errors.append(error)
+        else:
+            errors.append(None)
+    return errors
+
+
+def _claim(batch_size):
+    """Забирает пачку готовых писем и продлевает им срок, чтобы другой диспетчер их не взял"""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        ids = [email.pk for email in batch]
+        OutboxEmail.objects.filter(pk__in=ids).update(
+            next_attempt_at=now + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT),
+        )
+    return batch
+
+
+def _mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.STATUS_FAILED
+        logger.error('Письмо %s не отправлено после %s попыток: %s', email.pk, email.attempts, error)
+    else:
+        email.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def dispatch(batch_size=None):
+    """Отправляет все готовые письма пачками. Возвращает число отправленных."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    sent = 0
+    while True:
+        batch = _claim(batch_size)
+        if not batch:
+            return sent
+        connection = get_connection(settings.OUTBOX_DELIVERY_BACKEND, fail_silently=False)
+        try:
+            connection.open()
+        except Exception as error:
+            for email in batch:
+                _mark_failed(email, error)
+            return sent
+        try:
+            errors = send_each(connection, [to_message(email, connection) for email in batch])
+        finally:
+            connection.close()
+        for email, error in zip(batch, errors):
+            if error is not None:
+                _mark_failed(email, error)
+                continue
+            email.status = OutboxEmail.STATUS_SENT
+            email.attempts += 1
+            email.sent_at = timezone.now()
+            email.last_error = ''
+            email.save(update_fields=['status', 'attempts', 'sent_at', 'last_error'])
+            sent += 1
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """EMAIL_BACKEND, который не отправляет письма, а кладёт их в OutboxEmail"""
+
+    def send_messages(self, email_messages):
+        for message in email_messages:
+            enqueue_message(message)
+        return len(email_messages)
@@ -0,0 +1,193 @@
+"""Кэш страниц с версионированными ключами.
+
+В ключ страницы входят версии объектов, из которых она собрана (список
+постов данного типа, конкретный пост). Сигналы Post/Comment/голосов
+увеличивают версии, и следующая выдача собирается заново — поэтому TTL
+может быть долгим, а правки видны сразу.
+
+Кэшируются только анонимные GET-запросы. Ключ строится из пути, языка и
+тех cookie, которые реально влияют на разметку (тема, часовой пояс), а не
+из всего заголовка Cookie. CSRF-токены в сохранённой копии заменены меткой,
+при выдаче подставляется токен текущего посетителя. Пересчёт страницы
+защищён от одновременных промахов (см. news.stampede).
+
+Запросы совсем без cookie обслуживает раньше всего стека
+news.middleware.AnonymousPageCacheMiddleware; версии, от которых зависит
+страница, она узнаёт через page_versions / versioned_cache_page.
+"""
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import _unmask_cipher_token, get_token
+from django.utils.translation import get_language
+
+from . import stampede
+
+PAGE_KEY_PREFIX = 'pagecache:page'
+# Меняется при любом изменении комментариев (нужен спискам API с ?expand=comments)
+ALL_COMMENTS_VERSION_KEY = 'pagecache:v:comments'
+CSRF_PLACEHOLDER = b'%%CSRF_TOKEN%%'
+_MASKED_TOKEN_RE = re.compile(rb'(?<![a-zA-Z0-9])[a-zA-Z0-9]{64}(?![a-zA-Z0-9])')
+
+
+def list_version_key(post_type):
+    return f'pagecache:v:list:{post_type}'
+
+
+def post_version_key(pk):
+    return f'pagecache:v:post:{pk}'
+
+
+def comments_version_key(post_id):
+    return f'pagecache:v:comments:{post_id}'
+
+
+def _initial_version():
+    # Если ключ версии вытеснен из кэша, новая версия не совпадёт ни с одной старой
+    return time.time_ns()
+
+
+def get_versions(keys):
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+
+
+def bump_post(post):
+    """Сбрасывает страницы поста и списка его типа после коммита транзакции"""
+    keys = [post_version_key(post.pk), list_version_key(post.post_type)]
+    transaction.on_commit(lambda: bump(*keys))
+
+
+def bump_post_comments(post_id):
+    keys = [post_version_key(post_id), comments_version_key(post_id), ALL_COMMENTS_VERSION_KEY]
+    transaction.on_commit(lambda: bump(*keys))
+
+
+def bump_posts(posts, comments=False):
+    """Сбрасывает после коммита страницы постов и списков их типов; posts — пары (pk, post_type).
+
+    comments=True — ещё и комментарии этих постов (в них выводятся имена пользователей).
+    """
+    keys = set()
+    for pk, post_type in posts:
+        keys.update((post_version_key(pk), list_version_key(post_type)))
+        if comments:
+            keys.update((comments_version_key(pk), ALL_COMMENTS_VERSION_KEY))
+    if keys:
+        transaction.on_commit(lambda: bump(*keys))
+
+
+def _page_key(request, versions):
+    parts = [
+        request.get_full_path(),
+        get_language() or '',
+        getattr(request, 'theme', ''),
+        getattr(request, 'timezone_name', ''),
+        ','.join(map(str, versions)),
+    ]
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    return f'{PAGE_KEY_PREFIX}:{digest}'
+
+
+def strip_csrf_tokens(request, content):
+    """Заменяет меткой CSRF-токены, выданные этому посетителю, — копию можно отдавать другим"""
+    secret = request.META.get('CSRF_COOKIE')
+    if not secret:
+        return content
+    return _MASKED_TOKEN_RE.sub(
+        lambda match: CSRF_PLACEHOLDER if _unmask_cipher_token(match[0].decode()) == secret else match[0],
+        content,
+    )
+
+
+def fill_csrf_tokens(request, content):
+    """Подставляет вместо метки токен текущего посетителя.
+
+    get_token() помечает CSRF-cookie к выдаче; если CsrfViewMiddleware
+    ещё не отработал (кэш до стека), cookie ставит вызывающий.
+    """
+    if CSRF_PLACEHOLDER not in content:
+        return content
+    return content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+
+
+def _is_cacheable_request(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not len(get_messages(request))
+    )
+
+
+def remember_versions(request, keys, versions):
+    """Запоминает версии, из которых собрана страница (для AnonymousPageCacheMiddleware)"""
+    if getattr(request, 'anonymous_page_cache', False):
+        request.page_versions = dict(zip(keys, versions))
+
+
+def page_versions(version_keys):
+    """Отмечает, от каких версий зависит страница, не кэшируя её в самом представлении.
+
+    Без такой отметки AnonymousPageCacheMiddleware страницу не сохраняет.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if getattr(request, 'anonymous_page_cache', False):
+                keys = version_keys(request, *args, **kwargs)
+                remember_versions(request, keys, get_versions(keys))
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def versioned_cache_page(version_keys, timeout=None):
+    """Аналог cache_page, но ключ зависит от версий version_keys(request, *args, **kwargs)"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+            keys = version_keys(request, *args, **kwargs)
+            versions = get_versions(keys)
+            remember_versions(request, keys, versions)
+
+            def cacheable(response):
+                return response.status_code == 200 and not response.streaming
+
+            def render():
+                response = view_func(request, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+                if cacheable(response):
+                    response.content = strip_csrf_tokens(request, response.content)
+                return response
+
+            response = stampede.get_or_compute(
+                _page_key(request, versions), render,
+                settings.PAGE_CACHE_TIMEOUT if timeout is None else timeout,
+                cacheable=cacheable,
+            )
+            if not response.streaming:
+                response.content = fill_csrf_tokens(request, response.content)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,213 @@
+"""Keyset-пагинация списков постов по (created_at, id).
+
+Вместо OFFSET и COUNT(*) следующая страница выбирается условием
+«строго раньше последней показанной записи», поэтому глубокие страницы
+стоят столько же, сколько первая. Старые ссылки вида ?page=N продолжают
+работать: граница страницы ищется по индексу от ближайшей контрольной
+точки (позиции каждой LEGACY_PAGE_CHECKPOINT_ROWS-й строки хранятся в кэше),
+поэтому даже глубокая страница читает не больше шага, дальше отдаются курсоры.
+"""
+import base64
+import hashlib
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+KEYSET_ORDERING = ('-created_at', '-id')
+CHECKPOINTS_KEY_PREFIX = 'keyset:checkpoints'
+
+
+def encode_cursor(created_at, pk, reverse=False):
+    raw = f'{created_at.isoformat()}|{pk}|{int(reverse)}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (created_at, pk, reverse) или None для битого курсора"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, pk, reverse = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk), reverse == '1'
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """Страница keyset-пагинации с интерфейсом, похожим на django Page"""
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @staticmethod
+    def _position(row):
+        # Строки бывают и моделями, и словарями из .values()
+        if isinstance(row, dict):
+            return row['created_at'], row['id']
+        return row.created_at, row.pk
+
+    @property
+    def next_cursor(self):
+        if self.has_next_page and self.object_list:
+            return encode_cursor(*self._position(self.object_list[-1]))
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous_page and self.object_list:
+            return encode_cursor(*self._position(self.object_list[0]), reverse=True)
+        return None
+
+
+def keyset_filter(queryset, created_at, pk, reverse=False):
+    """Записи строго после (created_at, pk) в порядке KEYSET_ORDERING (или до — при reverse).
+
+    Условие записано как диапазон по created_at с исключением «хвоста» равных
+    значений, а не через OR: так SQLite идёт по индексу без временной сортировки.
+    """
+    if reverse:
+        return queryset.filter(created_at__gte=created_at).exclude(created_at=created_at, id__lte=pk)
+    return queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+
+
+def _seek(rows, position, offset):
+    """(created_at, id) строки через offset после position (или от начала) либо None"""
+    if position is not None:
+        rows = keyset_filter(rows, *position)
+    found = rows[offset:offset + 1]
+    return found[0] if found else None
+
+
+def row_position(queryset, index):
+    """(created_at, id) строки с номером index (с нуля) в порядке KEYSET_ORDERING.
+
+    Позиции последних строк каждого блока из LEGACY_PAGE_CHECKPOINT_ROWS
+    запоминаются в кэше одним списком на запрос; поиск начинается от
+    ближайшей из них, недостающие точки достраиваются по очереди. Новые
+    посты сдвигают номера, поэтому список живёт LEGACY_PAGE_CHECKPOINT_TIMEOUT.
+    """
+    step = settings.LEGACY_PAGE_CHECKPOINT_ROWS
+    rows = queryset.order_by(*KEYSET_ORDERING).values_list('created_at', 'id')
+    block = (index + 1) // step
+    if not block:
+        return _seek(rows, None, index)
+    key = f'{CHECKPOINTS_KEY_PREFIX}:{step}:{hashlib.md5(str(rows.query).encode()).hexdigest()}'
+    checkpoints = cache.get(key) or []
+    if len(checkpoints) < block:
+        while len(checkpoints) < block:
+            position = _seek(rows, checkpoints[-1] if checkpoints else None, step - 1)
+            if position is None:
+                return None
+            checkpoints.append(position)
+        cache.set(key, checkpoints, settings.LEGACY_PAGE_CHECKPOINT_TIMEOUT)
+    position, offset = checkpoints[block - 1], index - block * step
+    return position if offset < 0 else _seek(rows, position, offset)
+
+
+def paginate_keyset(queryset, per_page, cursor=None, page=None):
+    """Отдаёт KeysetPage для queryset, упорядоченного по KEYSET_ORDERING"""
+    queryset = queryset.order_by(*KEYSET_ORDERING)
+    position = decode_cursor(cursor) if cursor else None
+    legacy = position is None and page and page > 1
+    if legacy:
+        # Старая ссылка ?page=N: ищем последнюю запись предыдущей страницы
+        boundary = row_position(queryset, (page - 1) * per_page - 1)
+        if boundary is None:
+            # Как у Paginator: номер за последней страницей — 404, а не пустая страница
+            raise Http404('Страница за концом списка')
+        position = (*boundary, False)
+
+    if position is None:
+        rows = list(queryset[:per_page + 1])
+        return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=False)
+
+    created_at, pk, reverse = position
+    if reverse:
+        rows = list(
+            keyset_filter(queryset, created_at, pk, reverse=True)
+            .order_by('created_at', 'id')[:per_page + 1]
+        )
+        has_previous = len(rows) > per_page
+        return KeysetPage(rows[:per_page][::-1], has_next=True, has_previous=has_previous)
+
+    rows = list(keyset_filter(queryset, created_at, pk)[:per_page + 1])
+    if legacy and not rows:
+        raise Http404('Страница за концом списка')
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=True)
+
+
+class KeysetPaginationMixin:
+    """Подменяет стандартную пагинацию ListView на keyset-пагинацию"""
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        page_number = self.request.GET.get(self.page_kwarg)
+        page = paginate_keyset(
+            queryset,
+            page_size,
+            cursor=self.request.GET.get(self.cursor_kwarg),
+            page=int(page_number) if page_number and page_number.isdigit() else None,
+        )
+        return None, page, page.object_list, page.has_other_pages()
+
+
+class PostCursorPagination(BasePagination):
+    """Курсорная пагинация API по (created_at, id) с поддержкой старых ?page=N"""
+    page_size = 10
+    cursor_query_param = 'cursor'
+    page_query_param = 'page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.page_query_param)
+        page_number = request.query_params.get(self.page_query_param)
+        self.page = paginate_keyset(
+            queryset,
+            self.page_size,
+            cursor=request.query_params.get(self.cursor_query_param),
+            page=int(page_number) if page_number and page_number.isdigit() else None,
+        )
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
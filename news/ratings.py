@@ -0,0 +1,69 @@
+from django.db.models import F, Sum
+
+from .models import Author, Comment, Post
+
+POST_RATING_WEIGHT = 3
+
+
+def _totals(queryset, group_by):
+    rows = queryset.order_by().values(group_by).annotate(total=Sum('rating'))
+    return {row[group_by]: row['total'] or 0 for row in rows}
+
+
+def compute_author_ratings(author_ids=None):
+    """Считает рейтинг авторов тремя агрегирующими запросами.
+
+    Рейтинг = 3 * сумма рейтингов постов автора
+              + сумма рейтингов комментариев автора
+              + сумма рейтингов комментариев к постам автора.
+    Возвращает словарь {author_id: rating}.
+    """
+    posts = Post.objects.all()
+    own_comments = Comment.objects.filter(user__author__isnull=False)
+    received_comments = Comment.objects.all()
+    if author_ids is None:
+        author_ids = Author.objects.values_list('pk', flat=True)
+    else:
+        posts = posts.filter(author_id__in=author_ids)
+        own_comments = own_comments.filter(user__author__in=author_ids)
+        received_comments = received_comments.filter(post__author_id__in=author_ids)
+
+    ratings = dict.fromkeys(author_ids, 0)
+    for author_id, total in _totals(posts, 'author_id').items():
+        ratings[author_id] += POST_RATING_WEIGHT * total
+    for author_id, total in _totals(own_comments, 'user__author').items():
+        ratings[author_id] += total
+    for author_id, total in _totals(received_comments, 'post__author_id').items():
+        ratings[author_id] += total
+    return ratings
+
+
+def recompute_author_ratings(chunk_size=1000):
+    """Пересчитывает рейтинги всех авторов пачками по chunk_size.
+
+    Возвращает количество обработанных авторов.
+    """
+    author_ids = list(Author.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(author_ids), chunk_size):
+        ratings = compute_author_ratings(author_ids[start:start + chunk_size])
+        Author.objects.bulk_update(
+            [Author(pk=pk, rating=rating) for pk, rating in ratings.items()],
+            ['rating'],
+            batch_size=chunk_size,
+        )
+    return len(author_ids)
+
+
+def apply_post_rating_delta(post, delta):
+    if delta:
+        Author.objects.filter(pk=post.author_id).update(
+            rating=F('rating') + POST_RATING_WEIGHT * delta
+        )
+
+
+def apply_comment_rating_delta(comment, delta):
+    if not delta:
+        return
+    # Рейтинг комментария учитывается и у его автора, и у автора поста
+    Author.objects.filter(user_id=comment.user_id).update(rating=F('rating') + delta)
+    Author.objects.filter(posts__pk=comment.post_id).update(rating=F('rating') + delta)
@@ -0,0 +1,193 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+Индекс news_post_fts (rowid = id поста) хранит title и content и
+обновляется сигналами post_save/post_delete модели Post. Словоформы
+сводятся к основе стеммером (snowballstemmer, если установлен, иначе
+упрощённое отсечение окончаний), и каждое слово запроса ищется как
+префикс основы: «новостями» находит «новость», «новости», «новостей».
+На других СУБД поиск откатывается к icontains.
+
+rank_queryset отдаёт queryset, упорядоченный по релевантности (bm25 с
+весами заголовка и текста) — им пользуется HTML-поиск /search/.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from .models import Post
+
+try:
+    import snowballstemmer
+except ImportError:  # pragma: no cover - стеммер необязателен
+    snowballstemmer = None
+
+FTS_TABLE = 'news_post_fts'
+TITLE_WEIGHT = 5.0
+CONTENT_WEIGHT = 1.0
+MAX_LIMIT = 50
+MAX_OFFSET = 1000
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile('[а-яё]')
+
+RU_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ему', 'ому', 'ыми', 'ими', 'иях', 'ях', 'ах', 'ия', 'ие', 'ий',
+    'ой', 'ей', 'ам', 'ям', 'ом', 'ем', 'ов', 'ев', 'ую', 'юю', 'ая', 'яя', 'ое', 'ее', 'ые',
+    'ых', 'их', 'ию', 'ть', 'ться', 'ет', 'ют', 'ут', 'ит', 'ат', 'ят', 'ла', 'ло', 'ли',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+EN_ENDINGS = ('ing', 'ed', 'es', 's')
+
+_stemmers = {}
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def _fallback_stem(word, endings, min_stem):
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= min_stem:
+            return word[:-len(ending)]
+    return word
+
+
+def stem(word):
+    word = word.lower()
+    language = 'russian' if CYRILLIC_RE.search(word) else 'english'
+    if snowballstemmer is not None:
+        if language not in _stemmers:
+            _stemmers[language] = snowballstemmer.stemmer(language)
+        return _stemmers[language].stemWord(word)
+    if language == 'russian':
+        return _fallback_stem(word, RU_ENDINGS, 3)
+    return _fallback_stem(word, EN_ENDINGS, 3)
+
+
+def build_match(query, column=None):
+    """Строит выражение MATCH: все слова запроса как префиксы их основ"""
+    terms = [f'"{stem(word)}"*' for word in WORD_RE.findall(query)]
+    if not terms:
+        return None
+    expression = ' AND '.join(terms)
+    return f'{{{column}}} : ({expression})' if column else expression
+
+
+def index_post(post):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)',
+            [post.pk, post.title, post.content],
+        )
+
+
+def remove_post(post_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def rebuild_index(chunk_size=2000):
+    """Полностью перестраивает индекс, читая посты пачками. Возвращает число постов."""
+    if not is_available():
+        return 0
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        rows = Post.objects.order_by('pk').values_list('pk', 'title', 'content').iterator(chunk_size=chunk_size)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)', batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)', batch)
+            total += len(batch)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def filter_queryset(queryset, query, column=None):
+    """Оставляет в queryset посты, подходящие под запрос (для фильтров и списков)"""
+    if not is_available():
+        words = WORD_RE.findall(query)
+        fields = [column] if column else ['title', 'content']
+        condition = Q()
+        for word in words:
+            condition &= Q(*[Q(**{f'{field}__icontains': word}) for field in fields], _connector=Q.OR)
+        return queryset.filter(condition)
+    match = build_match(query, column)
+    if match is None:
+        return queryset
+    return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+
+
+def rank_queryset(queryset, query):
+    """Как filter_queryset, но с аннотацией rank (bm25: чем меньше, тем релевантнее)
+    и сортировкой по (rank, pk). Без FTS5 — только фильтр, без ранжирования."""
+    match = build_match(query) if is_available() else None
+    if match is None:
+        return filter_queryset(queryset, query)
+    rank = RawSQL(
+        f'SELECT bm25({FTS_TABLE}, %s, %s) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {Post._meta.db_table}.id',
+        [TITLE_WEIGHT, CONTENT_WEIGHT, match],
+        output_field=FloatField(),
+    )
+    return filter_queryset(queryset, query).annotate(rank=rank).order_by('rank', 'pk')
+
+
+def _highlight(snippet):
+    # Маркеры \x02/\x03 ставит FTS5, текст вокруг экранируем сами
+    return escape(snippet).replace('\x02', '<mark>').replace('\x03', '</mark>')
+
+
+def search(query, post_type=None, limit=20, offset=0):
+    """Ранжированный поиск: список постов с атрибутами rank и snippet"""
+    limit = max(1, min(limit, MAX_LIMIT))
+    offset = max(0, min(offset, MAX_OFFSET))
+    if not is_available():
+        queryset = filter_queryset(Post.objects.filter(is_published=True), query)
+        if post_type:
+            queryset = queryset.filter(post_type=post_type)
+        posts = list(queryset.order_by('-created_at', '-id')[offset:offset + limit])
+        for post in posts:
+            post.rank, post.snippet = None, escape(post.preview())
+        return posts
+
+    match = build_match(query)
+    if match is None:
+        return []
+    sql = (
+        f'SELECT {FTS_TABLE}.rowid, bm25({FTS_TABLE}, %s, %s) AS rank, '
+        f"snippet({FTS_TABLE}, -1, char(2), char(3), '…', 16) "
+        f'FROM {FTS_TABLE} JOIN {Post._meta.db_table} AS p ON p.id = {FTS_TABLE}.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s AND p.is_published'
+    )
+    params = [TITLE_WEIGHT, CONTENT_WEIGHT, match]
+    if post_type:
+        sql += ' AND p.post_type = %s'
+        params.append(post_type)
+    sql += ' ORDER BY rank LIMIT %s OFFSET %s'
+    params += [limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    posts = Post.objects.in_bulk([row[0] for row in rows])
+    results = []
+    for post_id, rank, snippet in rows:
+        post = posts.get(post_id)
+        if post is not None:
+            post.rank, post.snippet = rank, _highlight(snippet)
+            results.append(post)
+    return results
@@ -20,18 +20,40 @@ class CommentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'content', 'created_at']
+        fields = ['id', 'user', 'content', 'created_at', 'likes_count', 'dislikes_count']
+        read_only_fields = ['likes_count', 'dislikes_count']
 
 
-class PostSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Оставляет только поля из context['fields'] (параметр ?fields= во вьюхах)"""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context.get('fields')
+        if requested is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    COMMENTS_LIMIT = 5
+
     author = UserSerializer(source='author.user', read_only=True)
     categories = CategorySerializer(many=True, read_only=True)
-    comments = CommentSerializer(many=True, read_only=True)
+    comments = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = ['id', 'title', 'content', 'author', 'categories', 'comments',
-                  'created_at', 'post_type', 'rating', 'is_published']
+                  'created_at', 'post_type', 'rating', 'likes_count', 'dislikes_count',
+                  'is_published']
+
+    def get_comments(self, obj):
+        # Обычно комментарии уже подгружены Prefetch'ем в preview_comments
+        comments = getattr(obj, 'preview_comments', None)
+        if comments is None:
+            comments = obj.comments.select_related('user').order_by('-created_at', '-id')[:self.COMMENTS_LIMIT]
+        return CommentSerializer(comments, many=True, context=self.context).data
 
 
 # Добавляем недостающие сериализаторы
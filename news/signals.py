@@ -1,73 +1,155 @@
+import logging
+
 from django.contrib.auth.models import Group, User
+from django.contrib.auth.signals import user_logged_in
 from allauth.account.signals import user_signed_up
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
-from django.core.mail import send_mail
-from django.conf import settings
-from django.template.loader import render_to_string
-from django.urls import reverse
-from news.models import Post, Subscription, Category, PostCategory
-from news.tasks import send_new_post_email
+from django.db import transaction
+from django.core.cache import caches
+from news.models import Post, Comment, Category, PostCategory, BannedWord, vote_changed
+from news.ratings import apply_comment_rating_delta, apply_post_rating_delta
+from news import censor, outbox, page_cache, search
+from news.tasks import notify_new_article, recensor_posts
 
-@receiver(post_save, sender=Post)
-def notify_subscribers(sender, instance, created, **kwargs):
-    if created:
-        subscribers_emails = Subscription.objects.filter(
-            category__in=instance.categories.all()
-        ).values_list('user__email', flat=True).distinct()
-        subscribers_emails = [email for email in subscribers_emails if email]
-        if subscribers_emails:
-            subject = f'Новая новость: {instance.title}'
-            message = instance.content
-            send_new_post_email.delay(subject, message, subscribers_emails)  # Отправка асинхронно через Celery
+logger = logging.getLogger(__name__)
 
 @receiver(m2m_changed, sender=PostCategory)
-def notify_subscribers_new_article(sender, instance, action, **kwargs):
-    if action == 'post_add':
-        categories = instance.categories.all()
-        for category in categories:
-            subs = Subscription.objects.filter(category=category).select_related('user')
-            for sub in subs:
-                user = sub.user
-                if not user.email:
-                    continue
-                article_url = settings.SITE_URL + reverse('article_detail', args=[instance.pk])
-                subject = f"Новая статья в категории {category.name}"
-                html_message = render_to_string('emails/new_article.html', {
-                    'user': user,
-                    'article': instance,
-                    'article_url': article_url,
-                })
-                plain_message = (
-                    f"Здравствуйте, {user.username}!\n\n"
-                    f"В категории {category.name} появилась новая статья: {instance.title}\n"
-                    f"Прочитать: {article_url}"
-                )
-                try:
-                    send_mail(subject, plain_message, settings.DEFAULT_FROM_EMAIL,
-                              [user.email], html_message=html_message, fail_silently=False)
-                except Exception as e:
-                    # Для продакшена лучше заменить print на логирование
-                    print(f"Ошибка отправки письма {user.email}: {e}")
+def notify_subscribers_new_article(sender, instance, action, reverse, pk_set, **kwargs):
+    # Рассылка идёт в Celery после коммита; в задачу уходят только id
+    if action == 'post_add' and not reverse and pk_set:
+        post_id, category_ids = instance.pk, sorted(pk_set)
+        transaction.on_commit(lambda: _enqueue_new_article(post_id, category_ids))
+
+
+def _enqueue_new_article(post_id, category_ids):
+    try:
+        notify_new_article.delay(post_id, category_ids)
+    except Exception:
+        logger.exception('Не удалось поставить рассылку о посте %s', post_id)
 
 @receiver(post_save, sender=User)
 def send_welcome_email(sender, instance, created, **kwargs):
     if created and instance.email:
         subject = "Добро пожаловать на News Portal!"
         message = f"Здравствуйте, {instance.username}!\n\nСпасибо за регистрацию на нашем новостном портале!"
-        try:
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [instance.email],
-                fail_silently=False,
-            )
-        except Exception as e:
-            print(f"Ошибка отправки welcome-письма {instance.email}: {e}")
+        outbox.enqueue(subject, message, [instance.email], dedupe_key=f'welcome:{instance.pk}')
+
+@receiver(user_logged_in)
+def remember_profile_timezone(sender, request, user, **kwargs):
+    """При входе часовой пояс из профиля переносится в cookie (см. TimezoneMiddleware)"""
+    profile = getattr(user, 'userprofile', None)
+    if request is not None and profile is not None:
+        request.timezone_changed = profile.timezone
+
 
 @receiver(user_signed_up)
 def add_user_to_common_group(request, user, **kwargs):
     common_group, created = Group.objects.get_or_create(name='common')
     if not user.groups.filter(name='common').exists():
-        user.groups.add(common_group)
\ No newline at end of file
+        user.groups.add(common_group)
+
+
+@receiver(vote_changed, sender=Post)
+def update_author_rating_on_post_vote(sender, instance, rating_delta, **kwargs):
+    apply_post_rating_delta(instance, rating_delta)
+
+
+@receiver(vote_changed, sender=Comment)
+def update_author_rating_on_comment_vote(sender, instance, rating_delta, **kwargs):
+    apply_comment_rating_delta(instance, rating_delta)
+
+
+def _stored_rating(instance):
+    # Экземпляр мог быть загружен до последних голосов, а рейтинг автора их уже учёл,
+    # поэтому вычитаем рейтинг из базы; блокировка не даёт голосу проскочить до удаления
+    rating = type(instance).objects.select_for_update().filter(pk=instance.pk).values_list('rating', flat=True).first()
+    return rating or 0
+
+
+@receiver(pre_delete, sender=Post)
+def update_author_rating_on_post_delete(sender, instance, **kwargs):
+    apply_post_rating_delta(instance, -_stored_rating(instance))
+
+
+@receiver(pre_delete, sender=Comment)
+def update_author_rating_on_comment_delete(sender, instance, **kwargs):
+    apply_comment_rating_delta(instance, -_stored_rating(instance))
+
+
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    # Голосования сохраняют только счётчики — индекс трогать незачем
+    if update_fields is None or {'title', 'content'} & set(update_fields):
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=BannedWord)
+@receiver(post_delete, sender=BannedWord)
+def rebuild_censor_pattern(sender, **kwargs):
+    # Новый список виден воркерам только после коммита; одна задача на транзакцию
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(
+        callback[1] is _recensor_after_commit for callback in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(_recensor_after_commit)
+
+
+def _recensor_after_commit():
+    censor.invalidate()
+    try:
+        recensor_posts.delay()
+    except Exception:
+        logger.exception('Не удалось поставить пересчёт цензуры')
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    # Голоса тоже сохраняют пост (update_fields со счётчиками), так что сюда попадают и они
+    page_cache.bump_post(instance)
+
+
+@receiver(m2m_changed, sender=PostCategory)
+def invalidate_post_pages_on_categories(sender, instance, action, reverse, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        page_cache.bump_post(instance)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_post_page(sender, instance, **kwargs):
+    page_cache.bump_post_comments(instance.post_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_list(sender, **kwargs):
+    from news.views import CATEGORY_LIST_CACHE_KEY
+
+    transaction.on_commit(lambda: caches['tiered'].delete(CATEGORY_LIST_CACHE_KEY))
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def invalidate_category_posts(sender, instance, created=False, **kwargs):
+    # Название категории выводится на страницах её постов и в API
+    if not created:
+        page_cache.bump_posts(Post.objects.filter(categories=instance).values_list('pk', 'post_type'))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_posts(sender, instance, created, update_fields=None, **kwargs):
+    # Вход сохраняет только last_login — имя и почта на страницах не меняются
+    if created or (update_fields is not None and not {'username', 'email'} & set(update_fields)):
+        return
+    page_cache.bump_posts(Post.objects.filter(author__user=instance).values_list('pk', 'post_type'))
+    page_cache.bump_posts(
+        Post.objects.filter(comments__user=instance).distinct().values_list('pk', 'post_type'), comments=True,
+    )
@@ -0,0 +1,98 @@
+"""Защита горячих ключей кэша от «эффекта толпы».
+
+В кэше лежит не само значение, а (значение, логический срок, время расчёта).
+Физический TTL длиннее логического на STAMPEDE_STALE_TIMEOUT, поэтому после
+истечения срока запись ещё какое-то время можно отдавать как устаревшую.
+
+- Пересчёт выполняет один воркер: он берёт блокировку (news.locks),
+  остальные отдают устаревшее значение или ждут появления нового.
+  Снимается блокировка по токену: воркер, который считал дольше
+  STAMPEDE_LOCK_TIMEOUT, не снимет блокировку следующего владельца.
+- Незадолго до истечения срока запись пересчитывается заранее с
+  вероятностью, растущей к концу срока (XFetch): чем дороже расчёт,
+  тем раньше начинается обновление.
+- Если результат не кэшируется (cacheable вернул False), владелец блокировки
+  ставит короткоживущую метку: ожидающие и новые запросы видят её и считают
+  сами параллельно, а не выстраиваются в очередь за блокировкой.
+"""
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+
+from . import locks
+
+LOCK_SUFFIX = ':lock'
+UNCACHEABLE_SUFFIX = ':uncacheable'
+
+
+def _should_recompute_early(expires_at, delta, beta):
+    if expires_at is None:
+        return False
+    return time.time() - delta * beta * math.log(random.random() or 1e-12) >= expires_at
+
+
+def _store(cache, key, value, timeout, delta):
+    if timeout is None:
+        cache.set(key, (value, None, delta), None)
+    else:
+        cache.set(key, (value, time.time() + timeout, delta), timeout + settings.STAMPEDE_STALE_TIMEOUT)
+
+
+def _compute_and_store(cache, key, compute, timeout, cacheable):
+    started = time.monotonic()
+    value = compute()
+    if cacheable is None or cacheable(value):
+        _store(cache, key, value, timeout, time.monotonic() - started)
+    else:
+        cache.set(key + UNCACHEABLE_SUFFIX, 1, settings.STAMPEDE_UNCACHEABLE_TIMEOUT)
+    return value
+
+
+def get_or_compute(key, compute, timeout, cache=None, cacheable=None, beta=1.0):
+    """Возвращает значение из кэша, вызывая compute() не более чем в одном воркере.
+
+    cacheable(value) позволяет не сохранять отдельные результаты (например,
+    ответы с ошибкой). timeout=None — хранить бессрочно.
+    """
+    cache = cache or default_cache
+    lock_key = key + LOCK_SUFFIX
+    uncacheable_key = key + UNCACHEABLE_SUFFIX
+    lock_timeout = settings.STAMPEDE_LOCK_TIMEOUT
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires_at, delta = entry
+        if not _should_recompute_early(expires_at, delta, beta):
+            return value
+        token = locks.acquire(lock_key, lock_timeout, cache)
+        if token is None:
+            # Значение уже пересчитывает другой воркер — отдаём то, что есть
+            return value
+        try:
+            return _compute_and_store(cache, key, compute, timeout, cacheable)
+        finally:
+            locks.release(lock_key, token, cache)
+
+    if cache.get(uncacheable_key) is not None:
+        return compute()
+    deadline = time.monotonic() + lock_timeout
+    token = locks.acquire(lock_key, lock_timeout, cache)
+    while token is None:
+        time.sleep(settings.STAMPEDE_POLL_INTERVAL)
+        found = cache.get_many([key, uncacheable_key])
+        if key in found:
+            return found[key][0]
+        if uncacheable_key in found or time.monotonic() >= deadline:
+            # Результат не кэшируется или владелец блокировки не успел — считаем сами
+            return compute()
+        token = locks.acquire(lock_key, lock_timeout, cache)
+    try:
+        # Пока ждали блокировку, значение мог положить предыдущий владелец
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+        return _compute_and_store(cache, key, compute, timeout, cacheable)
+    finally:
+        locks.release(lock_key, token, cache)
@@ -1,41 +1,104 @@
+import logging
+
 from celery import shared_task
-from django.core.mail import send_mail
+from celery.signals import worker_ready
+from django.contrib.auth.models import User
 from django.conf import settings
-from django.utils.timezone import now
-from datetime import timedelta
+from django.db import transaction
+from django.template.loader import render_to_string
 from .models import Post, Subscription
+from .ratings import recompute_author_ratings as _recompute_author_ratings
+from . import censor, digest, outbox, page_cache, vote_buffer
+
+logger = logging.getLogger(__name__)
 
 @shared_task
 def weekly_newsletter():
-    one_week_ago = now() - timedelta(days=7)
-    recent_posts = Post.objects.filter(created_at__gte=one_week_ago)
-    if not recent_posts.exists():
-        return  # Нет свежих новостей за неделю
-
-    subscribers_emails = Subscription.objects.all().values_list('user__email', flat=True).distinct()
-    subscribers_emails = [email for email in subscribers_emails if email]
-
-    subject = 'Еженедельная рассылка новостей'
-    message_lines = [
-        f"{post.title}\n{post.content}\n---" for post in recent_posts
-    ]
-    message = '\n\n'.join(message_lines)
-
-    if subscribers_emails:
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            subscribers_emails,
-            fail_silently=False,
-        )
+    return digest.send_weekly_digest()
 
 @shared_task
 def send_new_post_email(subject, message, recipient_list):
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        recipient_list,
-        fail_silently=False,
-    )
\ No newline at end of file
+    outbox.enqueue(subject, message, recipient_list)
+
+@shared_task
+def recompute_author_ratings():
+    return _recompute_author_ratings()
+
+@shared_task
+def recensor_posts():
+    """Пересчитывает сохранённые тексты после изменения списка запрещённых слов
+    и сбрасывает страницы списков и изменившихся постов"""
+    updated = censor.recensor(Post, pattern=censor.get_pattern(refresh=True))
+    page_cache.bump(
+        *(page_cache.list_version_key(post_type) for post_type, _ in Post.POST_TYPE_CHOICES),
+        *map(page_cache.post_version_key, updated),
+    )
+    return len(updated)
+
+@shared_task
+def flush_vote_buffer():
+    if vote_buffer.is_enabled():
+        return vote_buffer.flush()
+
+
+@worker_ready.connect
+def drain_vote_buffer_on_start(**kwargs):
+    # Голоса, чей сброс прервала остановка воркера, применяются сразу при старте
+    if vote_buffer.is_enabled():
+        flush_vote_buffer.delay()
+
+
+@shared_task
+def notify_new_article(post_id, category_ids):
+    """Собирает подписчиков всех категорий без повторов и раздаёт их пачками"""
+    user_ids = list(
+        User.objects.filter(subscriptions__category_id__in=category_ids)
+        .exclude(email='')
+        .order_by('id')
+        .values_list('id', flat=True)
+        .distinct()
+    )
+    batch_size = settings.NOTIFY_BATCH_SIZE
+    for start in range(0, len(user_ids), batch_size):
+        send_new_article_batch.delay(post_id, category_ids, user_ids[start:start + batch_size])
+    return len(user_ids)
+
+
+@shared_task
+def send_new_article_batch(post_id, category_ids, user_ids):
+    """Ставит в очередь письма о новом посте пачке подписчиков"""
+    post = Post.objects.filter(pk=post_id).first()
+    if post is None:
+        return 0
+    post_url = settings.SITE_URL + post.get_absolute_url()
+    # Пользователю пишем про одну из его категорий, в которые попал пост
+    categories = {}
+    for sub in (Subscription.objects.filter(user_id__in=user_ids, category_id__in=category_ids)
+                .select_related('category').order_by('category__name')):
+        categories.setdefault(sub.user_id, sub.category)
+    queued = 0
+    with transaction.atomic():
+        for user in User.objects.filter(pk__in=user_ids).exclude(email=''):
+            category = categories.get(user.pk)
+            subject = f"Новая статья в категории {category.name}" if category else "Новая статья"
+            html_message = render_to_string('emails/new_article.html', {
+                'user': user,
+                'article': post,
+                'category': category,
+                'article_url': post_url,
+            })
+            plain_message = (
+                f"Здравствуйте, {user.username}!\n\n"
+                f"{subject}: {post.title}\n"
+                f"Прочитать: {post_url}"
+            )
+            # Перезапуск задачи не задвоит письма
+            outbox.enqueue(subject, plain_message, [user.email], html_body=html_message,
+                           dedupe_key=f'new-post:{post_id}:{user.pk}')
+            queued += 1
+    return queued
+
+
+@shared_task
+def dispatch_outbox():
+    return outbox.dispatch()
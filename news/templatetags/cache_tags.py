@@ -0,0 +1,27 @@
+from django import template
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags.cache import CacheNode, do_cache
+from news.stampede import get_or_compute
+
+register = template.Library()
+
+
+class StampedeCacheNode(CacheNode):
+    def render(self, context):
+        expire_time = self.expire_time_var.resolve(context)
+        if expire_time is not None:
+            expire_time = int(expire_time)
+        cache_name = self.cache_name.resolve(context) if self.cache_name else 'default'
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        cache_key = make_template_fragment_key(self.fragment_name, vary_on)
+        return get_or_compute(cache_key, lambda: self.nodelist.render(context), expire_time,
+                              cache=caches[cache_name])
+
+
+@register.tag('cache')
+def stampede_cache(parser, token):
+    """Тот же {% cache %}, но фрагмент пересчитывает только один запрос"""
+    node = do_cache(parser, token)
+    return StampedeCacheNode(node.nodelist, node.expire_time_var, node.fragment_name,
+                             node.vary_on, node.cache_name)
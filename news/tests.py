@@ -1,3 +1,1284 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import smtplib
+import socket
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.mail import EmailMessage, get_connection, send_mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse
+from django.middleware.csrf import _unmask_cipher_token
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
+
+from news import cache_backends, digest, locks, outbox, page_cache, ratings, search, tasks, vote_buffer
+from news.cache_backends import TwoTierCache
+from news.email_backends import is_transient
+from news.forms import PostForm
+from news.middleware import RequestMetricsMiddleware, TimezoneMiddleware, remember_timezone
+from news.models import Author, BannedWord, Category, Comment, NewsletterRun, OutboxEmail, Post, Subscription
+from news.page_cache import CSRF_PLACEHOLDER
+from news.pagination import encode_cursor
+from news.stampede import LOCK_SUFFIX, get_or_compute
+from news.votes import recount_votes
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'timezone': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'tiered': {'BACKEND': 'news.cache_backends.TwoTierCache', 'OPTIONS': {'REMOTE': 'default'}},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, STAMPEDE_POLL_INTERVAL=0.01)
+class StampedeTests(SimpleTestCase):
+    threads = 32
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    def compute(self):
+        with self.calls_lock:
+            self.calls += 1
+        time.sleep(0.2)
+        return 'page'
+
+    def run_concurrently(self, key, timeout=60):
+        barrier = threading.Barrier(self.threads)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(get_or_compute(key, self.compute, timeout))
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+    def test_cold_key_is_computed_once(self):
+        results = self.run_concurrently('stampede:cold')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['page'] * self.threads)
+
+    def test_expired_key_is_refreshed_once_while_others_get_stale(self):
+        # Логический срок истёк, но запись ещё лежит в кэше
+        cache.set('stampede:stale', ('old', time.time() - 1, 0.1), 60)
+        results = self.run_concurrently('stampede:stale')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results.count('page'), 1)
+        self.assertEqual(results.count('old'), self.threads - 1)
+        self.assertEqual(get_or_compute('stampede:stale', self.compute, 60), 'page')
+
+    def test_uncacheable_result_releases_waiters(self):
+        started = time.monotonic()
+
+        def worker():
+            barrier.wait()
+            get_or_compute('stampede:uncacheable', self.compute, 60, cacheable=lambda value: False)
+
+        barrier = threading.Barrier(self.threads)
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(self.calls, self.threads)
+        # Ожидающие считают параллельно после первого расчёта, а не по очереди за блокировкой
+        self.assertLess(time.monotonic() - started, 0.2 * 4)
+        self.assertIsNone(cache.get('stampede:uncacheable'))
+
+    def test_expired_lock_of_next_owner_is_kept(self):
+        lock_key = 'stampede:slow' + LOCK_SUFFIX
+
+        def slow():
+            # Расчёт пережил STAMPEDE_LOCK_TIMEOUT, и блокировку взял другой воркер
+            cache.delete(lock_key)
+            cache.add(lock_key, 'other', 60)
+            return 'page'
+
+        self.assertEqual(get_or_compute('stampede:slow', slow, 60), 'page')
+        self.assertEqual(cache.get(lock_key), 'other')
+
+
+class FailingEmailBackend(LocmemEmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP недоступен')
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    EMAIL_BACKEND='news.outbox.OutboxEmailBackend',
+    OUTBOX_DELIVERY_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class OutboxTests(TestCase):
+    def test_welcome_email_is_queued_not_sent(self):
+        user = User.objects.create_user('reader', 'reader@example.com', 'pass')
+        self.assertEqual(mail.outbox, [])
+        email = OutboxEmail.objects.get(dedupe_key=f'welcome:{user.pk}')
+        self.assertEqual(email.to, ['reader@example.com'])
+
+        self.assertEqual(outbox.dispatch(), 1)
+        self.assertEqual([m.to for m in mail.outbox], [['reader@example.com']])
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.STATUS_SENT)
+        self.assertEqual(outbox.dispatch(), 0)
+
+    def test_rolled_back_transaction_leaves_no_email(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.enqueue('Тема', 'Текст', ['a@example.com'])
+            raise RuntimeError
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_one_wake_up_per_transaction(self):
+        with mock.patch('news.tasks.dispatch_outbox.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for i in range(50):
+                outbox.enqueue('Тема', 'Текст', [f'user{i}@example.com'])
+        self.assertEqual(len(callbacks), 1)
+        delay.assert_called_once_with()
+
+    def test_dedupe_key(self):
+        outbox.enqueue('Тема', 'Текст', ['a@example.com'], dedupe_key='digest:1')
+        outbox.enqueue('Тема', 'Текст', ['a@example.com'], dedupe_key='digest:1')
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_send_mail_goes_through_outbox(self):
+        send_mail('Тема', 'Текст', None, ['a@example.com'], html_message='<p>Текст</p>')
+        self.assertEqual(mail.outbox, [])
+        outbox.dispatch()
+        self.assertEqual(mail.outbox[0].alternatives[0][0], '<p>Текст</p>')
+
+    @override_settings(OUTBOX_DELIVERY_BACKEND='news.tests.FailingEmailBackend', OUTBOX_MAX_ATTEMPTS=2)
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        email = outbox.enqueue('Тема', 'Текст', ['a@example.com'])
+        self.assertEqual(outbox.dispatch(), 0)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn('SMTP недоступен', email.last_error)
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        outbox.dispatch()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.STATUS_FAILED, 2))
+
+
+class LocalSMTPServerMixin:
+    """Поднимает aiosmtpd на свободном порту; принятые письма копятся в self.received"""
+    smtp_delay = 0
+
+    def setUp(self):
+        super().setUp()
+        self.received = []
+        self.sessions = set()
+        self.reject_first = 0
+        test = self
+
+        class Handler:
+            async def handle_DATA(self, server, session, envelope):
+                if test.smtp_delay:
+                    await asyncio.sleep(test.smtp_delay)
+                if test.reject_first:
+                    test.reject_first -= 1
+                    return '451 Try again later'
+                test.sessions.add(id(session))
+                test.received.append(envelope)
+                return '250 OK'
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        self.controller = Controller(Handler(), hostname='127.0.0.1', port=self.port)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+    def smtp_settings(self, **overrides):
+        return self.settings(
+            CACHES=LOCMEM_CACHES,
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.port,
+            EMAIL_USE_SSL=False, EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+            **overrides,
+        )
+
+
+@unittest.skipIf(Controller is None, 'нужен aiosmtpd')
+class OutboxSMTPTests(LocalSMTPServerMixin, TestCase):
+    """Доставка через настоящий SMTP-клиент на локальный aiosmtpd"""
+
+    def test_batch_is_sent_over_smtp(self):
+        with self.smtp_settings(OUTBOX_DELIVERY_BACKEND='django.core.mail.backends.smtp.EmailBackend'):
+            for i in range(3):
+                outbox.enqueue('Тема', 'Текст', [f'user{i}@example.com'])
+            self.assertEqual(outbox.dispatch(), 3)
+        self.assertEqual(sorted(envelope.rcpt_tos[0] for envelope in self.received),
+                         ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+
+
+@unittest.skipIf(Controller is None, 'нужен aiosmtpd')
+class PooledSMTPBackendTests(LocalSMTPServerMixin, SimpleTestCase):
+    backend = 'news.email_backends.PooledSMTPEmailBackend'
+
+    def messages(self, count):
+        return [EmailMessage('Тема', 'Текст', 'news@example.com', [f'user{i}@example.com'])
+                for i in range(count)]
+
+    def test_sends_concurrently_over_reused_connections(self):
+        with self.smtp_settings(EMAIL_POOL_SIZE=4, EMAIL_RATE_LIMIT=0):
+            sent = get_connection(self.backend).send_messages(self.messages(40))
+        self.assertEqual(sent, 40)
+        self.assertEqual(len(self.received), 40)
+        self.assertLessEqual(len(self.sessions), 4)
+
+    def test_rate_limit(self):
+        with self.smtp_settings(EMAIL_POOL_SIZE=4, EMAIL_RATE_LIMIT=50):
+            started = time.monotonic()
+            get_connection(self.backend).send_messages(self.messages(11))
+            elapsed = time.monotonic() - started
+        # 11 писем при 50/с — не меньше 10 интервалов по 20 мс
+        self.assertGreaterEqual(elapsed, 0.2)
+
+    def test_transient_failures_are_retried(self):
+        self.reject_first = 2
+        with self.smtp_settings(EMAIL_POOL_SIZE=1, EMAIL_RATE_LIMIT=0, EMAIL_SEND_RETRIES=3):
+            errors = get_connection(self.backend).send_each(self.messages(3))
+        self.assertEqual(errors, [None, None, None])
+        self.assertEqual(len(self.received), 3)
+
+
+class IsTransientTests(SimpleTestCase):
+    def test_temporary_failures_are_retried(self):
+        for error in (smtplib.SMTPDataError(451, b'Try again later'),
+                      smtplib.SMTPRecipientsRefused({'a@example.com': (450, b'Mailbox busy'),
+                                                     'b@example.com': (550, b'No such user')}),
+                      smtplib.SMTPServerDisconnected(), smtplib.SMTPConnectError(421, b'Busy'),
+                      ConnectionResetError(), TimeoutError()):
+            self.assertTrue(is_transient(error), error)
+
+    def test_permanent_failures_are_not_retried(self):
+        for error in (smtplib.SMTPDataError(554, b'Rejected'),
+                      smtplib.SMTPAuthenticationError(535, b'Bad credentials'),
+                      smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user')}),
+                      smtplib.SMTPNotSupportedError(), smtplib.SMTPException(), PermissionError()):
+            self.assertFalse(is_transient(error), error)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, NEWSLETTER_CHECKPOINT_EVERY=2)
+class NewsletterRunTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Наука')
+        author = Author.objects.create(user=User.objects.create_user('author', '', 'pass'))
+        post = Post.objects.create(author=author, post_type='article', title='Статья', content='Текст')
+        post.categories.add(category)
+        self.readers = [User.objects.create_user(f'reader{i}', f'reader{i}@example.com', 'pass')
+                        for i in range(5)]
+        for user in self.readers:
+            Subscription.objects.create(user=user, category=category)
+        OutboxEmail.objects.all().delete()
+
+    def test_resumes_from_checkpoint_after_failure(self):
+        enqueue = outbox.enqueue
+        calls = []
+
+        def flaky_enqueue(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 3:
+                raise ConnectionError('БД недоступна')
+            return enqueue(*args, **kwargs)
+
+        with mock.patch('news.outbox.enqueue', flaky_enqueue), self.assertRaises(ConnectionError):
+            digest.send_weekly_digest()
+        run = NewsletterRun.objects.get()
+        self.assertEqual((run.status, run.queued, run.last_user_id),
+                         (NewsletterRun.STATUS_RUNNING, 2, self.readers[1].pk))
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+        self.assertEqual(digest.send_weekly_digest(), 3)
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.queued), (NewsletterRun.STATUS_COMPLETED, 5))
+        self.assertEqual(OutboxEmail.objects.count(), 5)
+        self.assertEqual(digest.send_weekly_digest(), 0)
+
+    def test_second_runner_backs_off_while_lock_is_held(self):
+        cache.add(digest.LOCK_KEY, 'другой процесс')
+        self.assertEqual(digest.send_weekly_digest(), 0)
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.assertEqual(cache.get(digest.LOCK_KEY), 'другой процесс')
+
+    def test_stops_when_lock_is_taken_over(self):
+        enqueue = outbox.enqueue
+
+        def enqueue_and_lose_lock(*args, **kwargs):
+            # Блокировка истекла посреди прогона и досталась другому процессу
+            cache.set(digest.LOCK_KEY, 'другой процесс')
+            return enqueue(*args, **kwargs)
+
+        with mock.patch('news.outbox.enqueue', enqueue_and_lose_lock):
+            self.assertEqual(digest.send_weekly_digest(), 2)
+        run = NewsletterRun.objects.get()
+        self.assertEqual((run.status, run.last_user_id), (NewsletterRun.STATUS_RUNNING, self.readers[1].pk))
+        self.assertEqual(cache.get(digest.LOCK_KEY), 'другой процесс')
+
+        cache.delete(digest.LOCK_KEY)
+        self.assertEqual(digest.send_weekly_digest(), 3)
+        self.assertEqual(OutboxEmail.objects.count(), 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DigestTests(TestCase):
+    def setUp(self):
+        self.science, self.sport, self.art = (Category.objects.create(name=name)
+                                              for name in ('Наука', 'Спорт', 'Искусство'))
+        self.author = Author.objects.create(user=User.objects.create_user('author', '', 'pass'))
+        now = timezone.now()
+        self.both = self.article('В обеих', now - timedelta(days=2), self.science, self.sport)
+        self.older = self.article('Старая', now - timedelta(days=3), self.science)
+        self.newest = self.article('Свежая', now - timedelta(days=1), self.sport)
+        self.article('Прошлогодняя', now - timedelta(days=400), self.art)
+
+    def article(self, title, created_at, *categories):
+        post = Post.objects.create(author=self.author, post_type='article', title=title, content='Текст')
+        Post.objects.filter(pk=post.pk).update(created_at=created_at)
+        post.categories.add(*categories)
+        return post
+
+    def subscribe(self, username, email, *categories):
+        user = User.objects.create(username=username, email=email)
+        for category in categories:
+            Subscription.objects.create(user=user, category=category)
+        return user
+
+    def test_each_post_once_newest_first(self):
+        reader = self.subscribe('reader', 'reader@example.com', self.science, self.sport)
+        (user, articles), = digest.iter_digests()
+        self.assertEqual(user, reader)
+        self.assertEqual([article['title'] for article in articles], ['Свежая', 'В обеих', 'Старая'])
+
+    def test_users_without_posts_or_email_are_skipped(self):
+        reader = self.subscribe('reader', 'reader@example.com', self.sport)
+        self.subscribe('no_posts', 'no_posts@example.com', self.art)
+        self.subscribe('no_email', '', self.science)
+        self.assertEqual([user for user, _ in digest.iter_digests()], [reader])
+
+    def test_query_count_does_not_grow_with_subscribers(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(sum(1 for _ in digest.iter_digests()), User.objects.exclude(email='').count())
+            return len(queries)
+
+        for i in range(10):
+            self.subscribe(f'reader{i}', f'reader{i}@example.com', self.science, self.sport)
+        queries = count_queries()
+        for i in range(10, 20):
+            self.subscribe(f'reader{i}', f'reader{i}@example.com', self.sport)
+        self.assertEqual(count_queries(), queries)
+
+
+class DigestRendererTests(SimpleTestCase):
+    articles = [{'title': 'Статья', 'url': 'https://example.com/articles/1/', 'summary': 'Текст',
+                 'published': timezone.now()}]
+
+    def test_memoized_matches_direct_render_and_escapes_username(self):
+        memoized, direct = digest.DigestRenderer(), digest.DigestRenderer(memoize=False)
+        for username in ('alice', '<b>bob</b> & "co"', 'carol'):
+            user = User(username=username)
+            self.assertEqual(memoized.render(user, (1, 2), self.articles),
+                             direct.render(user, (1, 2), self.articles))
+        self.assertEqual(memoized.renders, 1)
+        plain, html = memoized.render(User(username='<b>bob</b>'), (1, 2), self.articles)
+        self.assertIn('<b>bob</b>', plain)
+        self.assertIn('&lt;b&gt;bob&lt;/b&gt;', html)
+        self.assertNotIn('<b>bob</b>', html)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TimezoneMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'pass')
+        self.middleware = TimezoneMiddleware(lambda request: HttpResponse(timezone.get_current_timezone_name()))
+
+    def request_with_cookie(self, name):
+        response = HttpResponse()
+        remember_timezone(response, name)
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.TIMEZONE_COOKIE_NAME] = response.cookies[settings.TIMEZONE_COOKIE_NAME].value
+        # Любое обращение к пользователю или сессии дало бы запрос к БД
+        request.user = SimpleLazyObject(lambda: User.objects.get(pk=self.user.pk))
+        return request
+
+    def test_no_queries(self):
+        request = self.request_with_cookie('Asia/Tokyo')
+        with self.assertNumQueries(0):
+            response = self.middleware(request)
+        self.assertEqual(response.content, b'Asia/Tokyo')
+        self.assertEqual(request.timezone_name, 'Asia/Tokyo')
+
+    def test_tampered_cookie_is_ignored(self):
+        request = self.request_with_cookie('Asia/Tokyo')
+        request.COOKIES[settings.TIMEZONE_COOKIE_NAME] = 'Asia/Tokyo:forged'
+        self.assertEqual(self.middleware(request).content.decode(), settings.TIME_ZONE)
+
+    def test_set_timezone_and_login_refresh_cookie(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('set_timezone'), {'timezone': 'Asia/Tokyo'})
+        self.assertIn(settings.TIMEZONE_COOKIE_NAME, response.cookies)
+        self.user.userprofile.refresh_from_db()
+        self.assertEqual(self.user.userprofile.timezone, 'Asia/Tokyo')
+
+        def log_in(request):
+            user_logged_in.send(sender=User, request=request, user=self.user)
+            return HttpResponse()
+
+        response = TimezoneMiddleware(log_in)(RequestFactory().get('/'))
+        request = self.request_with_cookie('UTC')
+        request.COOKIES[settings.TIMEZONE_COOKIE_NAME] = response.cookies[settings.TIMEZONE_COOKIE_NAME].value
+        self.assertEqual(self.middleware(request).content, b'Asia/Tokyo')
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_session_without_cookie_falls_back_to_profile(self):
+        self.user.userprofile.timezone = 'Asia/Tokyo'
+        self.user.userprofile.save()
+        # Вход до появления cookie: сессия есть, cookie пояса нет
+        self.client.force_login(self.user)
+        self.client.cookies.pop(settings.TIMEZONE_COOKIE_NAME, None)
+        response = self.client.get(reverse('news_list'))
+        self.assertEqual(response.wsgi_request.timezone_name, 'Asia/Tokyo')
+        self.assertIn(settings.TIMEZONE_COOKIE_NAME, response.cookies)
+
+        response = self.client.post(reverse('set_timezone'), {'timezone': 'America/New_York'})
+        self.assertIn(settings.TIMEZONE_COOKIE_NAME, response.cookies)
+        response = self.client.get(reverse('news_list'))
+        self.assertEqual(response.wsgi_request.timezone_name, 'America/New_York')
+        self.assertNotIn(settings.TIMEZONE_COOKIE_NAME, response.cookies)
+
+    def test_anonymous_request_without_cookie_does_not_query(self):
+        request = RequestFactory().get('/')
+        request.user = SimpleLazyObject(lambda: User.objects.get(pk=self.user.pk))
+        with self.assertNumQueries(0):
+            response = self.middleware(request)
+        self.assertEqual(response.content.decode(), settings.TIME_ZONE)
+        self.assertNotIn(settings.TIMEZONE_COOKIE_NAME, response.cookies)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ThemeTests(TestCase):
+    def test_anonymous_request_does_not_create_session(self):
+        response = self.client.get(reverse('news_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_toggle_theme_uses_cookie(self):
+        response = self.client.post(reverse('toggle_theme'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'dark_mode': True})
+        self.assertEqual(response.cookies[settings.THEME_COOKIE_NAME].value, 'dark')
+        self.assertContains(self.client.get(reverse('news_list')), 'class="dark-theme"')
+        self.assertFalse(Session.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(user=User.objects.create_user('author', 'author@example.com', 'pass'))
+
+    def get(self, url):
+        self.client.cookies.clear()
+        return self.client.get(url)
+
+    def test_cookieless_hit_skips_the_stack(self):
+        url = reverse('news_list')
+        first = self.get(url)
+        with self.assertNumQueries(0):
+            second = self.get(url)
+        self.assertEqual(second.status_code, 200)
+        self.assertIn('Cookie', second['Vary'])
+        self.assertIn('private', second['Cache-Control'])
+        # Свой CSRF-токен на каждую выдачу, и он подходит к выданной cookie
+        secret = second.cookies[settings.CSRF_COOKIE_NAME].value
+        self.assertNotEqual(secret, first.cookies[settings.CSRF_COOKIE_NAME].value)
+        self.assertNotIn(CSRF_PLACEHOLDER.decode(), second.content.decode())
+        token = re.search(r'name="csrfmiddlewaretoken" value="(\w+)"', second.content.decode())[1]
+        self.assertEqual(_unmask_cipher_token(token), secret)
+
+    def test_version_bump_invalidates(self):
+        url = reverse('news_list')
+        self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(author=self.author, post_type='news', title='Свежая новость', content='Текст')
+        self.assertContains(self.get(url), 'Свежая новость')
+
+    def test_versioned_page_is_shared_across_csrf_cookies(self):
+        url = reverse('news_list')
+        tokens = {}
+        for secret in ('a' * 32, 'b' * 32, None):
+            self.client.cookies.clear()
+            self.client.cookies[settings.THEME_COOKIE_NAME] = 'dark'
+            if secret:
+                self.client.cookies[settings.CSRF_COOKIE_NAME] = secret
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            content = response.content.decode()
+            self.assertNotIn(CSRF_PLACEHOLDER.decode(), content)
+            token = re.search(r'name="csrfmiddlewaretoken" value="(\w+)"', content)[1]
+            tokens[secret] = (_unmask_cipher_token(token), len(queries))
+        self.assertEqual(tokens['a' * 32][0], 'a' * 32)
+        # Второй и третий посетители получили ту же копию страницы, без запросов к БД
+        self.assertEqual(tokens['b' * 32], ('b' * 32, 0))
+        secret, queries = tokens[None]
+        self.assertEqual(queries, 0)
+        self.assertEqual(secret, self.client.cookies[settings.CSRF_COOKIE_NAME].value)
+
+    def test_requests_with_cookies_bypass(self):
+        url = reverse('news_list')
+        self.get(url)
+        self.client.cookies[settings.THEME_COOKIE_NAME] = 'dark'
+        self.assertContains(self.client.get(url), 'class="dark-theme"')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TimezoneSelectorTests(TestCase):
+    def test_page_renders_only_current_timezone(self):
+        response = self.client.get(reverse('news_list'))
+        self.assertContains(response, f'<option value="{settings.TIME_ZONE}" selected>')
+        self.assertNotContains(response, 'Pacific/Auckland')
+
+    def test_timezone_list_is_long_lived(self):
+        response = self.client.get(reverse('timezone_list'))
+        self.assertIn('Pacific/Auckland', response.json())
+        self.assertIn('max-age', response['Cache-Control'])
+        response = self.client.get(reverse('timezone_list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_SAMPLE_RATE=1.0, METRICS_OVERHEAD_BUDGET=0.01,
+                   METRICS_SERVER_TIMING=True)
+class RequestMetricsTests(TestCase):
+    def test_records_sql_cache_and_templates(self):
+        with self.assertLogs('news.metrics', 'INFO') as logs:
+            response = self.client.get(reverse('articles_list'), HTTP_COOKIE='theme=dark')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'articles_list')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['sql_count'], 0)
+        self.assertGreater(record['cache_hits'] + record['cache_misses'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertIn(f'{record["sql_count"]} queries', response['Server-Timing'])
+        self.assertIn('template;dur=', response['Server-Timing'])
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        response = self.client.get(reverse('articles_list'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_overhead_budget_lowers_sample_rate(self):
+        middleware = RequestMetricsMiddleware(lambda request: HttpResponse())
+        middleware.wall, middleware.overhead = 1.0, 0.05
+        self.assertAlmostEqual(middleware.effective_rate(), 0.2)
+
+
+@unittest.skipIf(fakeredis is None, 'нужен fakeredis')
+@override_settings(CACHES=LOCMEM_CACHES, VOTE_BUFFER_ENABLED=True)
+class VoteBufferTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        vote_buffer.set_client(self.redis)
+        self.addCleanup(vote_buffer.set_client, None)
+        author = Author.objects.create(user=User.objects.create_user('author', '', 'pass'))
+        self.post = Post.objects.create(author=author, post_type='news', title='Новость', content='Текст')
+        self.reader = User.objects.create_user('reader', '', 'pass')
+
+    def counts(self):
+        post = Post.objects.get(pk=self.post.pk)
+        stored = (post.likes_count, post.rating)
+        vote_buffer.merge_buffered_counts([post])
+        return stored, (post.likes_count, post.rating)
+
+    def test_votes_are_buffered_until_flush(self):
+        self.assertTrue(vote_buffer.cast_vote(self.post, self.reader, 1))
+        self.assertFalse(vote_buffer.cast_vote(self.post, self.reader, 1))
+        self.assertEqual(self.counts(), ((0, 0), (1, 1)))
+
+        self.assertEqual(vote_buffer.flush(), 1)
+        self.assertEqual(self.counts(), ((1, 1), (1, 1)))
+        self.assertTrue(self.post.likes.filter(pk=self.reader.pk).exists())
+        self.assertEqual(self.redis.keys('votebuf:*'), [])
+
+    def test_failed_write_keeps_votes_for_next_flush(self):
+        vote_buffer.cast_vote(self.post, self.reader, 1)
+        with mock.patch.object(Post, 'apply_votes', side_effect=DatabaseError('БД недоступна')), \
+                self.assertLogs('news.vote_buffer', 'ERROR'):
+            self.assertEqual(vote_buffer.flush(), 0)
+        # Голос не потерян и по-прежнему виден читателям
+        self.assertEqual(self.counts(), ((0, 0), (1, 1)))
+
+        self.assertEqual(vote_buffer.flush(), 1)
+        self.assertEqual(self.counts(), ((1, 1), (1, 1)))
+
+    def test_interrupted_flush_is_drained(self):
+        vote_buffer.cast_vote(self.post, self.reader, 1)
+        # Воркер успел перенести голоса в ключи обработки и упал
+        self.assertTrue(vote_buffer._claim(self.redis, self.post.pk))
+        self.redis.delete(vote_buffer.DIRTY_KEY)
+        self.assertEqual(vote_buffer.leftover_post_ids(self.redis), [self.post.pk])
+        self.assertFalse(vote_buffer.cast_vote(self.post, self.reader, 1))
+
+        self.assertEqual(vote_buffer.flush(), 1)
+        self.assertEqual(self.counts(), ((1, 1), (1, 1)))
+
+    def test_sparse_fetch_does_not_load_deferred_counters(self):
+        vote_buffer.cast_vote(self.post, self.reader, 1)
+        self.client.force_login(self.reader)
+        url = reverse('api-news-detail', args=[self.post.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'title'})
+        self.assertEqual(response.json(), {'title': 'Новость'})
+        deferred_loads = [q['sql'] for q in queries
+                          if re.match(r'SELECT "news_post"\."id", "news_post"\."(likes_count|dislikes_count|rating)" FROM',
+                                      q['sql'])]
+        self.assertEqual(deferred_loads, [])
+        self.assertEqual(self.client.get(url, {'fields': 'title,likes_count'}).json()['likes_count'], 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CensorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(user=User.objects.create_user('author', 'author@example.com', 'pass'))
+        self.post = Post.objects.create(author=author, post_type='news', title='Снова редиска', content='Редиска и репа')
+        self.other = Post.objects.create(author=author, post_type='news', title='Про погоду', content='Солнечно')
+
+    def test_banned_word_recensors_posts_and_bumps_pages(self):
+        keys = [page_cache.post_version_key(self.post.pk), page_cache.post_version_key(self.other.pk),
+                page_cache.list_version_key('news')]
+        before = page_cache.get_versions(keys)
+        with mock.patch('news.signals.recensor_posts.delay', side_effect=tasks.recensor_posts) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                BannedWord.objects.create(word='редиска')
+                BannedWord.objects.create(word='репа')
+        delay.assert_called_once_with()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.title_censored, 'Снова р******')
+        self.assertEqual(self.post.content_censored, 'Р****** и р***')
+        post_version, other_version, list_version = page_cache.get_versions(keys)
+        self.assertNotEqual(post_version, before[0])
+        self.assertEqual(other_version, before[1])
+        self.assertNotEqual(list_version, before[2])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('author', 'author@example.com', 'pass')
+        self.post = Post.objects.create(author=Author.objects.create(user=self.user), post_type='news',
+                                        title='Новость', content='Текст')
+        self.category = Category.objects.create(name='Спорт')
+        self.post.categories.add(self.category)
+
+    def etags(self):
+        detail = self.client.get(reverse('api-news-detail', args=[self.post.pk]))['ETag']
+        listing = self.client.get(reverse('api-news-list'))['ETag']
+        return detail, listing
+
+    def assertChangesETags(self, change):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        after = self.etags()
+        self.assertNotEqual(after[0], before[0])
+        self.assertNotEqual(after[1], before[1])
+
+    def test_category_rename_changes_etags(self):
+        self.category.name = 'Футбол'
+        self.assertChangesETags(self.category.save)
+
+    def test_author_rename_changes_etags(self):
+        self.user.email = 'new@example.com'
+        self.assertChangesETags(self.user.save)
+
+    def test_login_keeps_etags(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=['last_login'])
+        self.assertEqual(self.etags(), before)
+
+    def test_vote_is_not_hidden_by_if_modified_since(self):
+        urls = (reverse('api-news-detail', args=[self.post.pk]), reverse('news_detail', args=[self.post.pk]))
+        first = [self.client.get(url) for url in urls]
+        since = http_date(time.time() + 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.like(User.objects.create(username='reader'))
+        for url, response in zip(urls, first):
+            with self.subTest(url):
+                self.assertNotIn('Last-Modified', response)
+                repeat = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+                self.assertEqual(repeat.status_code, 200)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=repeat['ETag']).status_code, 304)
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES, LEGACY_PAGE_CHECKPOINT_ROWS=4)
+class LegacyDeepPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(user=User.objects.create(username='author'))
+        Post.objects.bulk_create(
+            Post(author=author, post_type='news', title=f'Новость {i}', content='Текст') for i in range(45)
+        )
+        self.titles = list(Post.objects.order_by('-created_at', '-id').values_list('title', flat=True))
+
+    def page_titles(self, page):
+        response = self.client.get(reverse('api-news-list'), {'page': page, 'fields': 'title'})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()['results']]
+
+    def test_deep_pages_resolve_without_long_offsets(self):
+        for page in (5, 3, 1, 4):
+            with self.subTest(page=page), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.page_titles(page), self.titles[(page - 1) * 10:page * 10])
+            offsets = [int(offset) for query in queries
+                       for offset in re.findall(r'OFFSET (\d+)', query['sql'])]
+            self.assertTrue(all(offset < 4 for offset in offsets), offsets)
+        self.assertEqual(self.client.get(reverse('news_list'), {'page': 5}).status_code, 200)
+        self.assertEqual(self.client.get(reverse('api-news-list'), {'page': 6}).status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPageEdgeTests(TestCase):
+    urls = ('news_list', 'articles_list', 'news_search', 'api-news-list', 'api-articles-list')
+
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(user=User.objects.create(username='author'))
+        for post_type in ('news', 'article'):
+            for i in range(3):
+                Post.objects.create(author=author, post_type=post_type, title=f'Пост {i}', content='Текст')
+        posts = Post.objects.order_by('created_at', 'id')
+        self.oldest, self.newest = posts.first(), posts.last()
+
+    def test_legacy_page_past_the_end_is_404(self):
+        for name in self.urls:
+            with self.subTest(name):
+                self.assertEqual(self.client.get(reverse(name), {'page': 2}).status_code, 404)
+
+    def test_empty_cursor_pages_render(self):
+        cursors = (encode_cursor(self.oldest.created_at, self.oldest.pk),
+                   encode_cursor(self.newest.created_at, self.newest.pk, reverse=True))
+        for name in self.urls:
+            for cursor in cursors:
+                with self.subTest(name, cursor=cursor):
+                    self.assertEqual(self.client.get(reverse(name), {'cursor': cursor}).status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, NOTIFY_BATCH_SIZE=2)
+class NewArticleNotificationTests(TestCase):
+    def setUp(self):
+        self.science, self.sport = Category.objects.create(name='Наука'), Category.objects.create(name='Спорт')
+        self.readers = []
+        for i in range(5):
+            user = User.objects.create(username=f'reader{i}', email=f'reader{i}@example.com')
+            Subscription.objects.create(user=user, category=self.science)
+            if i % 2:
+                Subscription.objects.create(user=user, category=self.sport)
+            self.readers.append(user)
+        User.objects.create(username='no_email', email='').subscriptions.create(category=self.sport)
+        author = Author.objects.create(user=User.objects.create(username='author'))
+        self.post = Post.objects.create(author=author, post_type='article', title='Статья', content='Текст')
+        OutboxEmail.objects.all().delete()
+
+    def publish(self):
+        with mock.patch('news.signals.notify_new_article.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.post.categories.add(self.science, self.sport)
+        delay.assert_called_once_with(self.post.pk, sorted([self.science.pk, self.sport.pk]))
+        return delay.call_args.args
+
+    def notify(self, post_id, category_ids):
+        with mock.patch('news.tasks.send_new_article_batch.delay',
+                        side_effect=tasks.send_new_article_batch) as delay:
+            tasks.notify_new_article(post_id, category_ids)
+        return [call.args for call in delay.call_args_list]
+
+    def test_one_email_per_subscriber_in_batches(self):
+        batches = self.notify(*self.publish())
+        reader_ids = [user.pk for user in self.readers]
+        self.assertEqual([user_ids for _, _, user_ids in batches],
+                         [reader_ids[0:2], reader_ids[2:4], reader_ids[4:]])
+        # В задачи уходят только id — их можно сериализовать в JSON без моделей
+        self.assertEqual(json.loads(json.dumps(batches)), [list(args) for args in batches])
+        self.assertEqual(sorted(email.to[0] for email in OutboxEmail.objects.all()),
+                         sorted(user.email for user in self.readers))
+
+    def test_rerun_does_not_duplicate_emails(self):
+        args = self.publish()
+        self.notify(*args)
+        self.notify(*args)
+        self.assertEqual(OutboxEmail.objects.count(), len(self.readers))
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PostAPIQueryCountTests(TestCase):
+    """Число запросов API постов не зависит от числа постов и комментариев"""
+    # Анонимные GET идут быстрым путём (news.fast_render), вошедшие — через сериализатор;
+    # у вошедшего ещё два запроса: сессия и пользователь
+    anonymous = {'list': 2, 'fields': 2, 'comments': 3, 'retrieve': 4, 'retrieve_fields': 2}
+    authenticated = {name: count + 2 for name, count in anonymous.items()}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(user=User.objects.create(username='author', email='author@example.com'))
+        cls.categories = [Category.objects.create(name=name) for name in ('Наука', 'Спорт')]
+        cls.readers = [User.objects.create(username=f'reader{i}') for i in range(3)]
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(author=self.author, post_type='news', title=f'Новость {i}', content='Текст')
+            post.categories.add(*self.categories)
+            Comment.objects.bulk_create(Comment(post=post, user=user, content='Комментарий') for user in self.readers)
+        return post
+
+    def requests(self, post):
+        detail = reverse('api-news-detail', args=[post.pk])
+        return {
+            'list': (reverse('api-news-list'), {}),
+            'fields': (reverse('api-news-list'), {'fields': 'id,title,categories'}),
+            'comments': (reverse('api-news-list'), {'expand': 'comments'}),
+            'retrieve': (detail, {}),
+            'retrieve_fields': (detail, {'fields': 'id,title'}),
+        }
+
+    def assertQueriesPerRequest(self, expected):
+        # Сначала N постов, потом 2N (страница — 10 постов)
+        for count in (5, 5):
+            post = self.add_posts(count)
+            for name, (url, params) in self.requests(post).items():
+                cache.clear()
+                with self.subTest(name, posts=Post.objects.count()), self.assertNumQueries(expected[name]):
+                    self.assertEqual(self.client.get(url, params).status_code, 200)
+
+    def test_anonymous(self):
+        self.assertQueriesPerRequest(self.anonymous)
+
+    def test_authenticated(self):
+        self.client.force_login(User.objects.create(username='viewer'))
+        # force_login не ставит cookie часового пояса; первый запрос берёт его из профиля
+        self.client.get(reverse('api-news-list'))
+        self.assertIn(settings.TIMEZONE_COOKIE_NAME, self.client.cookies)
+        self.assertQueriesPerRequest(self.authenticated)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FragmentCacheKeyTests(TestCase):
+    published = datetime(2026, 10, 18, 21, 0, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='author')
+        author = Author.objects.create(user=self.user)
+        self.posts = {}
+        for post_type in ('news', 'article'):
+            post = Post.objects.create(author=author, post_type=post_type, title='Пост', content='Текст')
+            Post.objects.filter(pk=post.pk).update(created_at=self.published)
+            self.posts[post_type] = post
+        Comment.objects.create(post=self.posts['news'], user=self.user, content='Комментарий')
+        Comment.objects.filter(post=self.posts['news']).update(created_at=self.published)
+
+    def get(self, name, post_type, zone):
+        response = HttpResponse()
+        remember_timezone(response, zone)
+        self.client.cookies[settings.TIMEZONE_COOKIE_NAME] = response.cookies[settings.TIMEZONE_COOKIE_NAME].value
+        return self.client.get(reverse(name, args=[self.posts[post_type].pk])).content.decode()
+
+    def test_dates_follow_visitor_timezone(self):
+        for zone, article_date, news_date in (('Pacific/Auckland', '19.10.2026 10:00', '19.10.2026'),
+                                              ('America/Los_Angeles', '18.10.2026 14:00', '18.10.2026')):
+            with self.subTest(zone):
+                self.assertIn(article_date, self.get('article_detail', 'article', zone))
+                news = self.get('news_detail', 'news', zone)
+                self.assertIn(f'Дата публикации: {news_date}', news)
+                self.assertIn(article_date, news)
+
+    def test_article_body_follows_author_rename(self):
+        self.assertIn('author', self.get('article_detail', 'article', 'UTC'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'renamed'
+            self.user.save()
+        self.assertIn('renamed', self.get('article_detail', 'article', 'UTC'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FastAPIRenderingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='author', email='author@example.com')
+        science, sport = Category.objects.create(name='Наука'), Category.objects.create(name='Спорт')
+        self.post = Post.objects.create(author=Author.objects.create(user=user), post_type='news',
+                                        title='Новость "в кавычках"', content='Текст\u2028с разделителем')
+        # Связи добавлены не в порядке id категорий
+        self.post.categories.add(sport)
+        self.post.categories.add(science)
+        Comment.objects.create(post=self.post, user=user, content='Комментарий')
+
+    def test_fast_path_matches_serializer_byte_for_byte(self):
+        detail = reverse('api-news-detail', args=[self.post.pk])
+        for url, params in ((reverse('api-news-list'), {}), (detail, {}),
+                            (reverse('api-news-list'), {'fields': 'id,title,categories'}),
+                            (detail, {'fields': 'id,categories,author'}),
+                            (reverse('api-news-list'), {'expand': 'comments'})):
+            with self.subTest(url, **params):
+                bodies = []
+                for fast in (True, False):
+                    with self.settings(FAST_API_RENDERING=fast):
+                        response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 200)
+                    bodies.append(response.content)
+                self.assertEqual(bodies[0], bodies[1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VoteCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.readers = [User.objects.create(username=f'reader{i}') for i in range(3)]
+        author = Author.objects.create(user=User.objects.create(username='author'))
+        self.post = Post.objects.create(author=author, post_type='news', title='Новость', content='Текст')
+
+    def assertCounters(self, obj, likes, dislikes):
+        obj.refresh_from_db()
+        self.assertEqual((obj.likes_count, obj.dislikes_count, obj.rating), (likes, dislikes, likes - dislikes))
+        self.assertEqual((obj.likes.count(), obj.dislikes.count()), (likes, dislikes))
+
+    def test_apply_votes_maintains_counters(self):
+        first, second, third = self.readers
+        self.assertTrue(self.post.apply_votes({first.pk: 1, second.pk: 1, third.pk: -1}))
+        self.assertCounters(self.post, 2, 1)
+        self.assertFalse(self.post.apply_votes({first.pk: 1}))
+        self.assertTrue(self.post.apply_votes({second.pk: -1, third.pk: 1}))
+        self.assertCounters(self.post, 2, 1)
+        comment = Comment.objects.create(post=self.post, user=first, content='Комментарий')
+        comment.like(second)
+        comment.dislike(third)
+        comment.like(third)
+        self.assertCounters(comment, 2, 0)
+
+    def test_edit_while_voting_keeps_votes(self):
+        # Форма или админка прочитала пост до голоса и сохраняет его целиком после
+        stale = Post.objects.get(pk=self.post.pk)
+        self.post.like(self.readers[0])
+        stale.title = 'Исправленный заголовок'
+        stale.save()
+        self.assertCounters(self.post, 1, 0)
+        self.assertEqual(self.post.title, 'Исправленный заголовок')
+
+    def test_post_form_does_not_edit_votes(self):
+        self.assertFalse({'rating', 'likes', 'dislikes', 'likes_count', 'dislikes_count'} & set(PostForm().fields))
+
+    def test_recount_votes_repairs_drift(self):
+        self.post.apply_votes({self.readers[0].pk: 1, self.readers[1].pk: -1})
+        Post.objects.filter(pk=self.post.pk).update(likes_count=7, dislikes_count=0, rating=5)
+        self.assertEqual(recount_votes(Post), 1)
+        self.assertCounters(self.post, 1, 1)
+
+
+@unittest.skipIf(fakeredis is None, 'нужен fakeredis')
+@override_settings(CACHES=LOCMEM_CACHES)
+class TwoTierCacheTests(SimpleTestCase):
+    """Два узла с общим удалённым кэшем и каналом инвалидаций на fakeredis"""
+
+    def setUp(self):
+        cache.clear()
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server)
+        self.channel = f'test-invalidation:{time.monotonic_ns()}'
+        patcher = mock.patch.object(TwoTierCache, '_redis_client',
+                                    lambda backend: fakeredis.FakeRedis(server=server))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.a, self.b = self.node('a'), self.node('b')
+        # Первое обращение запускает слушателей; ждём, пока оба подпишутся
+        self.a.get('warmup'), self.b.get('warmup')
+        self.wait_for(lambda: self.redis.pubsub_numsub(self.channel)[0][1] == 2)
+
+    def node(self, name):
+        location = f'{self.channel}:{name}'
+        self.addCleanup(cache_backends._tiers.pop, location, None)
+        return TwoTierCache(location, {'OPTIONS': {'REMOTE': 'default', 'CHANNEL': self.channel}})
+
+    def wait_for(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'не дождались')
+            time.sleep(0.01)
+
+    def is_local(self, node, key):
+        return node._local_key(key, None) in node._local
+
+    def test_set_and_get_through_both_tiers(self):
+        self.a.set('menu', ['новости'])
+        self.assertTrue(self.is_local(self.a, 'menu'))
+        self.assertEqual(self.b.get('menu'), ['новости'])
+        self.assertEqual(self.b.stats()['remote_hits'], 1)
+        self.assertEqual(self.b.get('menu'), ['новости'])
+        self.assertEqual(self.b.stats()['remote_hits'], 1)
+        self.assertTrue(self.is_local(self.b, 'menu'))
+
+    def test_other_node_write_evicts_local_copy(self):
+        self.a.set('menu', 1)
+        self.b.get('menu')
+        self.a.set('menu', 2)
+        self.wait_for(lambda: not self.is_local(self.b, 'menu'))
+        self.assertEqual(self.b.get('menu'), 2)
+
+    def test_delete_and_clear_propagate(self):
+        for key in ('menu', 'categories'):
+            self.a.set(key, key)
+            self.b.get(key)
+        self.a.delete('menu')
+        self.wait_for(lambda: not self.is_local(self.b, 'menu'))
+        self.assertIsNone(self.b.get('menu'))
+        self.a.clear()
+        self.wait_for(lambda: not self.is_local(self.b, 'categories'))
+        self.assertIsNone(self.b.get('categories'))
+
+    def test_invalidation_during_remote_read_is_not_cached(self):
+        self.a.set('menu', 'старое')
+        self.wait_for(lambda: self.b.stats()['invalidations'] == 1)
+        remote_get = self.b.remote.get
+
+        def get_then_invalidate(*args, **kwargs):
+            value = remote_get(*args, **kwargs)
+            # Пока значение шло из Redis, другой узел записал новое и разослал инвалидацию
+            self.a.set('menu', 'новое')
+            self.wait_for(lambda: self.b.stats()['invalidations'] == 2)
+            return value
+
+        with mock.patch.object(self.b.remote, 'get', get_then_invalidate):
+            self.assertEqual(self.b.get('menu'), 'старое')
+        self.assertFalse(self.is_local(self.b, 'menu'))
+        self.assertEqual(self.b.get('menu'), 'новое')
+
+    def test_forked_child_resubscribes(self):
+        tier = self.b._tier
+        node, listener = tier.node, tier.listener
+        self.b.set('menu', 1)
+        with mock.patch('news.cache_backends.os.getpid', return_value=tier.pid + 1):
+            self.b.get('other')
+            self.assertIsNot(tier.listener, listener)
+        self.assertNotEqual(tier.node, node)
+        self.assertFalse(self.is_local(self.b, 'menu'))
+        self.wait_for(lambda: self.redis.pubsub_numsub(self.channel)[0][1] == 3)
+
+
+@unittest.skipUnless(search.is_available(), 'нужен SQLite с FTS5')
+@override_settings(CACHES=LOCMEM_CACHES)
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+
+    def create(self, title, content, **kwargs):
+        return Post.objects.create(author=self.author, post_type='news', title=title, content=content, **kwargs)
+
+    def found(self, query):
+        return [post.pk for post in search.search(query)]
+
+    def test_fts_matches_all_terms(self):
+        both = self.create('Выборы мэра', 'Итоги голосования в городе')
+        self.create('Погода', 'В городе дождь')
+        self.assertEqual(self.found('город голосование'), [both.pk])
+        self.assertEqual(self.found('"; DROP TABLE news_post; --'), [])
+
+    def test_russian_stemming(self):
+        post = self.create('Новость дня', 'Текст')
+        for query in ('новость', 'новости', 'новостями', 'НОВОСТЕЙ'):
+            with self.subTest(query):
+                self.assertEqual(self.found(query), [post.pk])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        self.create('Заметка', 'Код <script>alert(1)</script> и редкое слово тут')
+        response = self.client.get(reverse('api_search'), {'q': 'редкое'})
+        snippet = response.json()['results'][0]['snippet']
+        self.assertIn('&lt;script&gt;', snippet)
+        self.assertNotIn('<script>', snippet)
+        self.assertIn('<mark>редкое</mark>', snippet)
+
+    def test_index_follows_create_update_delete(self):
+        post = self.create('Старый заголовок', 'Текст')
+        self.assertEqual(self.found('старый'), [post.pk])
+        post.title = 'Свежий заголовок'
+        post.save()
+        self.assertEqual(self.found('старый'), [])
+        self.assertEqual(self.found('свежий'), [post.pk])
+        # Сохранение без title/content индекс не трогает, но и не ломает
+        post.save(update_fields=['is_published'])
+        self.assertEqual(self.found('свежий'), [post.pk])
+        post.delete()
+        self.assertEqual(self.found('свежий'), [])
+
+    def test_html_search_is_ranked_by_relevance(self):
+        now = timezone.now()
+        in_title = self.create('Комета над городом', 'Текст', created_at=now - timedelta(days=30))
+        in_content = [self.create(f'Заметка {i}', 'Вчера видели комету', created_at=now - timedelta(days=i))
+                      for i in range(11)]
+        self.create('Другое', 'Ничего', created_at=now)
+        response = self.client.get(reverse('news_search'), {'q': 'комета'})
+        self.assertEqual(response.status_code, 200)
+        first_page = [post.pk for post in response.context['news_list']]
+        self.assertEqual(first_page[0], in_title.pk)
+        self.assertEqual(len(first_page), 10)
+        response = self.client.get(reverse('news_search'), {'q': 'комета', 'page': 2})
+        second_page = [post.pk for post in response.context['news_list']]
+        self.assertEqual(sorted(first_page[1:] + second_page), sorted(post.pk for post in in_content))
+        self.assertContains(response, '?q=%D0%BA%D0%BE%D0%BC%D0%B5%D1%82%D0%B0&amp;page=1')
+        self.assertEqual(self.client.get(reverse('news_search'), {'q': 'комета', 'page': 3}).status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AuthorRatingDeltaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(username=f'user{i}') for i in range(4)]
+        self.first, self.second = (Author.objects.create(user=user) for user in self.users[:2])
+
+    def assertMatchesRecompute(self):
+        expected = ratings.compute_author_ratings()
+        self.assertEqual(dict(Author.objects.values_list('pk', 'rating')), expected)
+        # Старый полный пересчёт по объектам даёт то же самое
+        for author in Author.objects.all():
+            legacy = (3 * sum(post.rating for post in author.posts.all())
+                      + sum(comment.rating for comment in author.user.comment_set.all())
+                      + sum(comment.rating for post in author.posts.all() for comment in post.comments.all()))
+            self.assertEqual(author.rating, legacy)
+
+    def test_deltas_match_full_recompute(self):
+        reader, other = self.users[2:]
+        post = Post.objects.create(author=self.first, post_type='news', title='Новость', content='Текст')
+        article = Post.objects.create(author=self.second, post_type='article', title='Статья', content='Текст')
+        post.like(reader)
+        post.like(other)
+        article.dislike(reader)
+        self.assertMatchesRecompute()
+
+        # Комментарии автора к чужому посту, к своему и комментарий читателя
+        own = Comment.objects.create(post=post, user=self.first.user, content='Свой')
+        foreign = Comment.objects.create(post=article, user=self.first.user, content='Чужой')
+        from_reader = Comment.objects.create(post=post, user=reader, content='Читатель')
+        self.assertMatchesRecompute()
+        own.like(reader)
+        own.like(other)
+        foreign.dislike(other)
+        from_reader.like(self.second.user)
+        post.dislike(other)
+        self.assertMatchesRecompute()
+
+        # Удаление по устаревшему экземпляру: голос пришёл после загрузки
+        stale = Comment.objects.get(pk=from_reader.pk)
+        from_reader.like(other)
+        stale.delete()
+        self.assertMatchesRecompute()
+        foreign.delete()
+        self.assertMatchesRecompute()
+
+        # Удаление поста каскадом удаляет и комментарии к нему
+        stale = Post.objects.get(pk=post.pk)
+        post.like(self.second.user)
+        stale.delete()
+        self.assertMatchesRecompute()
+        self.assertEqual(self.first.__class__.objects.get(pk=self.first.pk).rating, 0)
+
+    def test_delta_is_atomic_with_vote(self):
+        post = Post.objects.create(author=self.first, post_type='news', title='Новость', content='Текст')
+        with mock.patch('news.signals.apply_post_rating_delta', side_effect=DatabaseError('сбой')):
+            with self.assertRaises(DatabaseError):
+                post.like(self.users[2])
+        post.refresh_from_db()
+        self.assertEqual((post.likes.count(), post.likes_count, post.rating), (0, 0, 0))
+        self.assertMatchesRecompute()
+        post.like(self.users[2])
+        self.assertEqual(Author.objects.get(pk=self.first.pk).rating, 3)
+        self.assertMatchesRecompute()
+
+
+@unittest.skipIf(fakeredis is None, 'нужен fakeredis')
+class CacheLockTests(SimpleTestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+        self.caches = {'redis': RedisCache('redis://127.0.0.1:6379/15', {}),
+                       'locmem': LocMemCache('cache-lock-tests', {})}
+        patcher = mock.patch.object(self.caches['redis']._cache, 'get_client', lambda *args, **kwargs: self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_release_and_extend_check_token(self):
+        for name, backend in self.caches.items():
+            with self.subTest(name):
+                token = locks.acquire('lock', 10, backend)
+                self.assertIsNotNone(token)
+                self.assertIsNone(locks.acquire('lock', 10, backend))
+                self.assertFalse(locks.release('lock', 'чужой', backend))
+                self.assertFalse(locks.extend('lock', 'чужой', 100, backend))
+                self.assertEqual(backend.get('lock'), token)
+                self.assertTrue(locks.extend('lock', token, 100, backend))
+                self.assertTrue(locks.release('lock', token, backend))
+                self.assertIsNone(backend.get('lock'))
+                self.assertFalse(locks.release('lock', token, backend))
+                self.assertFalse(locks.extend('lock', token, 100, backend))
+
+    def test_extend_sets_ttl_in_redis(self):
+        backend = self.caches['redis']
+        token = locks.acquire('lock', 10, backend)
+        self.assertTrue(locks.extend('lock', token, 100, backend))
+        self.assertGreater(self.redis.ttl(backend.make_and_validate_key('lock')), 10)
+
+    def test_lock_changed_during_release_is_kept(self):
+        backend = self.caches['redis']
+        token = locks.acquire('lock', 10, backend)
+        raw_key = backend.make_and_validate_key('lock')
+        serializer = backend._cache._serializer
+        dumps = serializer.dumps
+
+        def race(value):
+            # Между проверкой токена и удалением блокировку перехватил другой воркер
+            fakeredis.FakeRedis(server=self.server).set(raw_key, dumps('other'))
+            return dumps(value)
+
+        with mock.patch.object(serializer, 'dumps', race):
+            self.assertFalse(locks.release('lock', token, backend))
+        self.assertEqual(backend.get('lock'), 'other')
@@ -40,6 +40,7 @@ urlpatterns = [
 
     # Утилиты
     path('set-timezone/', views.set_timezone, name='set_timezone'),
+    path('timezones/', views.timezone_list, name='timezone_list'),
     path('toggle-theme/', views.toggle_theme, name='toggle_theme'),
 
     # Аутентификация
@@ -51,6 +52,8 @@ urlpatterns = [
     path('api/subscriptions/', views.SubscriptionAPIView.as_view(), name='api_subscriptions'),
     path('api/profile/', views.ProfileAPIView.as_view(), name='api_profile'),
     path('api/become-author/', views.BecomeAuthorAPIView.as_view(), name='api_become_author'),
+    path('api/search/', views.SearchAPIView.as_view(), name='api_search'),
+    path('api/cache-stats/', views.CacheStatsAPIView.as_view(), name='api_cache_stats'),
 
     # Аутентификация для API
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
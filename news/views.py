@@ -1,7 +1,12 @@
+import hashlib
+import json
+from functools import lru_cache
+
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import Group, User
-from django.views.decorators.http import require_POST
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, etag, require_POST
 from django.views.generic import (ListView, CreateView, UpdateView,
                                   DeleteView, DetailView, View)
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
@@ -9,16 +14,25 @@ from django.urls import reverse_lazy
 import django_filters
 from django_filters.views import FilterView
 from django import forms
-from .models import Post, Comment, Subscription, Category
+from .models import Post, Comment, Subscription, Category, timezone_choices
 from .forms import CommentForm, RegisterForm, SubscriptionForm, PostForm
+from .vote_buffer import cast_vote, merge_buffered_counts
+from .pagination import KeysetPaginationMixin, PostCursorPagination
+from .fast_render import FastReadMixin, post_values, render_posts
+from . import search
+from .conditional import ConditionalReadMixin, html_etag
+from .middleware import is_valid_timezone, remember_theme, remember_timezone
+from .page_cache import (comments_version_key, get_versions, list_version_key, page_versions, post_version_key,
+                         versioned_cache_page)
 from django.contrib.auth import login, logout
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-import pytz
-from django.http import HttpResponseBadRequest, JsonResponse
-from rest_framework import viewsets, permissions, status
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.db.models import Prefetch
+from rest_framework import viewsets, permissions, serializers, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -40,29 +54,43 @@ def custom_logout(request):
 
 
 def toggle_theme(request):
-    if 'dark_mode' not in request.session:
-        request.session['dark_mode'] = True
-    else:
-        request.session['dark_mode'] = not request.session['dark_mode']
+    theme = 'light' if request.theme == 'dark' else 'dark'
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'dark_mode': request.session['dark_mode']})
-    return redirect(request.META.get('HTTP_REFERER', '/'))
+        response = JsonResponse({'dark_mode': theme == 'dark'})
+    else:
+        response = redirect(request.META.get('HTTP_REFERER', '/'))
+    remember_theme(response, theme)
+    return response
 
 
 def set_timezone(request):
     if request.method == 'POST':
         tz = request.POST.get('timezone')
-        if tz in pytz.all_timezones:
-            request.session['django_timezone'] = tz
+        if is_valid_timezone(tz):
             if hasattr(request.user, 'userprofile'):
                 request.user.userprofile.timezone = tz
                 request.user.userprofile.save()
-            return redirect(request.META.get('HTTP_REFERER', '/'))
+            response = redirect(request.META.get('HTTP_REFERER', '/'))
+            remember_timezone(response, tz)
+            return response
     return HttpResponseBadRequest("Invalid timezone")
 
 
+@lru_cache(maxsize=None)
+def _timezone_list_json():
+    return json.dumps([name for name, _ in timezone_choices()]).encode()
+
+
+@cache_control(public=True, max_age=settings.TIMEZONE_LIST_MAX_AGE)
+@etag(lambda request: hashlib.md5(_timezone_list_json()).hexdigest())
+def timezone_list(request):
+    """Список часовых поясов для селектора в шапке; меняется только с обновлением pytz"""
+    return HttpResponse(_timezone_list_json(), content_type='application/json')
+
+
 class PostFilter(django_filters.FilterSet):
-    title = django_filters.CharFilter(lookup_expr='icontains', label=_('Название'))
+    q = django_filters.CharFilter(method='filter_text', label=_('Текст'))
+    title = django_filters.CharFilter(method='filter_title', label=_('Название'))
     author__user__username = django_filters.CharFilter(
         field_name='author__user__username',
         lookup_expr='icontains',
@@ -77,7 +105,13 @@ class PostFilter(django_filters.FilterSet):
 
     class Meta:
         model = Post
-        fields = ['title', 'author__user__username', 'created_at']
+        fields = ['q', 'title', 'author__user__username', 'created_at']
+
+    def filter_text(self, queryset, name, value):
+        return search.rank_queryset(queryset, value)
+
+    def filter_title(self, queryset, name, value):
+        return search.filter_queryset(queryset, value, column='title')
 
 
 @login_required
@@ -113,7 +147,7 @@ def manage_subscriptions(request):
 @require_POST
 def article_like(request, pk):
     article = get_object_or_404(Post, pk=pk, post_type='article')
-    article.like()
+    cast_vote(article, request.user, 1)
     return redirect('article_detail', pk=pk)
 
 
@@ -121,7 +155,7 @@ def article_like(request, pk):
 @require_POST
 def article_dislike(request, pk):
     article = get_object_or_404(Post, pk=pk, post_type='article')
-    article.dislike()
+    cast_vote(article, request.user, -1)
     return redirect('article_detail', pk=pk)
 
 
@@ -129,7 +163,7 @@ def article_dislike(request, pk):
 @require_POST
 def news_like(request, pk):
     news = get_object_or_404(Post, pk=pk, post_type='news')
-    news.like()
+    cast_vote(news, request.user, 1)
     return redirect('news_detail', pk=pk)
 
 
@@ -137,7 +171,7 @@ def news_like(request, pk):
 @require_POST
 def news_dislike(request, pk):
     news = get_object_or_404(Post, pk=pk, post_type='news')
-    news.dislike()
+    cast_vote(news, request.user, -1)
     return redirect('news_detail', pk=pk)
 
 
@@ -152,11 +186,12 @@ def become_author(request):
 
 
 class NewsDetailViewWithComments(View):
+    @method_decorator(page_versions(lambda request, pk: [post_version_key(pk)]))
+    @method_decorator(condition(etag_func=html_etag('news')))
     def get(self, request, pk):
         news = get_object_or_404(Post, pk=pk, post_type='news')
-        form = CommentForm()
-        comments = news.comments.all().order_by('-created_at')
-        return render(request, 'news/news_detail.html', {'item': news, 'form': form, 'comments': comments})
+        merge_buffered_counts([news])
+        return self.render_detail(request, news, CommentForm())
 
     def post(self, request, pk):
         news = get_object_or_404(Post, pk=pk, post_type='news')
@@ -167,22 +202,33 @@ class NewsDetailViewWithComments(View):
             comment.user = request.user
             comment.save()
             return redirect('news_detail', pk=pk)
-        comments = news.comments.all().order_by('-created_at')
-        return render(request, 'news/news_detail.html', {'item': news, 'form': form, 'comments': comments})
+        return self.render_detail(request, news, form)
+
+    def render_detail(self, request, news, form):
+        # Тело новости и список комментариев берутся из кэша фрагментов,
+        # queryset комментариев выполняется только при промахе
+        comments = news.comments.select_related('user').order_by('-created_at')
+        return render(request, 'news/news_detail.html', {
+            'item': news,
+            'form': form,
+            'comments': comments,
+            'comments_version': get_versions([comments_version_key(news.pk)])[0],
+            'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+        })
 
 
-@method_decorator(cache_page(60), name='dispatch')
-class NewsListView(ListView):
+@method_decorator(versioned_cache_page(lambda request: [list_version_key('news')]), name='dispatch')
+class NewsListView(KeysetPaginationMixin, ListView):
     model = Post
     template_name = 'news/default.html'
     context_object_name = 'news_list'
     paginate_by = 10
 
     def get_queryset(self):
-        return Post.objects.filter(post_type='news').order_by('-created_at')
+        return Post.objects.filter(post_type='news').order_by('-created_at', '-id')
 
 
-class NewsSearchView(FilterView):
+class NewsSearchView(KeysetPaginationMixin, FilterView):
     model = Post
     filterset_class = PostFilter
     template_name = 'news/news_search.html'
@@ -190,22 +236,31 @@ class NewsSearchView(FilterView):
     paginate_by = 10
 
     def get_queryset(self):
-        return super().get_queryset().filter(post_type='news').order_by('-created_at')
+        return super().get_queryset().filter(post_type='news').order_by('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, page_size):
+        if 'rank' in queryset.query.annotations:
+            # Выдача по релевантности: (rank, pk) не ложится на keyset по дате,
+            # поэтому она листается номерами страниц через OFFSET
+            return super(KeysetPaginationMixin, self).paginate_queryset(queryset, page_size)
+        return super().paginate_queryset(queryset, page_size)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['request'] = self.request
+        context['ranked'] = 'rank' in self.object_list.query.annotations
         return context
 
 
-class ArticlesListView(ListView):
+@method_decorator(page_versions(lambda request: [list_version_key('article')]), name='dispatch')
+class ArticlesListView(KeysetPaginationMixin, ListView):
     model = Post
-    template_name = 'articles/articles_list.html'
+    template_name = 'articles/article_list.html'
     context_object_name = 'articles_list'
     paginate_by = 10
 
     def get_queryset(self):
-        return Post.objects.filter(post_type='article').order_by('-created_at')
+        return Post.objects.filter(post_type='article').order_by('-created_at', '-id')
 
 
 class NewsCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
@@ -266,7 +321,8 @@ class ArticleUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView)
         return Post.objects.filter(post_type='article')
 
 
-@method_decorator(cache_page(60 * 5), name='dispatch')
+@method_decorator(condition(etag_func=html_etag('article')), name='get')
+@method_decorator(page_versions(lambda request, pk: [post_version_key(pk)]), name='get')
 class ArticleDetailView(DetailView):
     model = Post
     template_name = 'articles/article_detail.html'
@@ -275,6 +331,19 @@ class ArticleDetailView(DetailView):
     def get_queryset(self):
         return Post.objects.filter(post_type='article')
 
+    def get_object(self, queryset=None):
+        article = super().get_object(queryset)
+        merge_buffered_counts([article])
+        return article
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Тело статьи (с именем автора) кэшируется по версии поста, счётчики и формы
+        # рендерятся на каждый запрос
+        context['post_version'] = get_versions([post_version_key(self.object.pk)])[0]
+        context['fragment_cache_timeout'] = settings.FRAGMENT_CACHE_TIMEOUT
+        return context
+
 
 class ArticleDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
     model = Post
@@ -312,44 +381,123 @@ def csrf_failure(request, reason=""):
 
 
 # REST API Viewsets
-class NewsViewSet(viewsets.ModelViewSet):
+class BasePostViewSet(ConditionalReadMixin, FastReadMixin, viewsets.ModelViewSet):
+    """Общий API новостей и статей.
+
+    Для list/retrieve queryset собирается под запрошенные поля: ?fields=id,title
+    ограничивает ответ, ?expand=comments добавляет в список последние комментарии
+    (в retrieve они есть по умолчанию). Число запросов на страницу не зависит
+    от количества постов и комментариев. Ответы несут ETag, повторный запрос
+    с совпавшим валидатором получает 304.
+    """
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = PostCursorPagination
+    post_type = None
+    read_serializer_class = PostSerializer
+
+    def get_requested_fields(self):
+        all_fields = self.read_serializer_class.Meta.fields
+        fields_param = self.request.query_params.get('fields')
+        expand = self.request.query_params.get('expand', '').split(',')
+        if fields_param:
+            requested = set(fields_param.split(','))
+        else:
+            requested = set(all_fields)
+            if self.action != 'retrieve':
+                requested.discard('comments')
+        if 'comments' in expand:
+            requested.add('comments')
+        # Порядок ключей в ответе — как в Meta.fields сериализатора
+        return [name for name in all_fields if name in requested]
+
+    def get_base_queryset(self):
+        return Post.objects.filter(post_type=self.post_type, is_published=True)
 
     def get_queryset(self):
-        return Post.objects.filter(post_type='news', is_published=True)
+        queryset = self.get_base_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        fields = self.get_requested_fields()
+        # created_at нужен курсору пагинации
+        only = {'id', 'created_at'} | {
+            name for name in fields if name in {'title', 'content', 'post_type', 'rating', 'likes_count',
+                                                'dislikes_count', 'is_published'}
+        }
+        if 'author' in fields:
+            queryset = queryset.select_related('author__user')
+            only |= {'author__user__id', 'author__user__username', 'author__user__email'}
+        if 'categories' in fields:
+            # Тот же порядок, что у быстрого пути (news.fast_render)
+            queryset = queryset.prefetch_related(Prefetch('categories', queryset=Category.objects.order_by('id')))
+        if 'comments' in fields:
+            queryset = queryset.prefetch_related(Prefetch(
+                'comments',
+                queryset=Comment.objects.select_related('user').order_by('-created_at', '-id')[
+                    :self.read_serializer_class.COMMENTS_LIMIT
+                ],
+                to_attr='preview_comments',
+            ))
+        return queryset.only(*only)
+
+    def get_object(self):
+        post = super().get_object()
+        if self.action == 'retrieve':
+            merge_buffered_counts([post])
+        return post
+
+    def use_fast_path(self, request):
+        # Для списка с комментариями быстрый путь дал бы запрос на каждый пост
+        return super().use_fast_path(request) and (
+            self.action == 'retrieve' or 'comments' not in self.get_requested_fields()
+        )
+
+    def get_fast_queryset(self):
+        return post_values(self.get_base_queryset(), self.get_requested_fields())
+
+    def render_fast(self, rows):
+        return render_posts(rows, self.get_requested_fields(), self.read_serializer_class.COMMENTS_LIMIT)
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
-            return PostCreateUpdateSerializer  # Исправлено имя
-        return PostSerializer
+            return PostCreateUpdateSerializer
+        return self.read_serializer_class
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve'):
+            context['fields'] = self.get_requested_fields()
+        return context
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user.author, post_type='news')
+        serializer.save(author=self.request.user.author, post_type=self.post_type)
 
     @action(detail=True, methods=['post'])
     def like(self, request, pk=None):
         post = self.get_object()
-        if request.user in post.dislikes.all():
-            post.dislikes.remove(request.user)
-        post.likes.add(request.user)
+        cast_vote(post, request.user, 1)
         return Response({
             'status': 'liked',
-            'likes_count': post.likes.count(),
-            'dislikes_count': post.dislikes.count()
+            'likes_count': post.likes_count,
+            'dislikes_count': post.dislikes_count
         })
 
     @action(detail=True, methods=['post'])
     def dislike(self, request, pk=None):
         post = self.get_object()
-        if request.user in post.likes.all():
-            post.likes.remove(request.user)
-        post.dislikes.add(request.user)
+        cast_vote(post, request.user, -1)
         return Response({
             'status': 'disliked',
-            'likes_count': post.likes.count(),
-            'dislikes_count': post.dislikes.count()
+            'likes_count': post.likes_count,
+            'dislikes_count': post.dislikes_count
         })
 
+    @action(detail=True, methods=['get'])
+    def comments(self, request, pk=None):
+        post = self.get_object()
+        paginator = PostCursorPagination()
+        page = paginator.paginate_queryset(post.comments.select_related('user'), request, view=self)
+        return paginator.get_paginated_response(CommentSerializer(page, many=True).data)
+
     @action(detail=True, methods=['post'])
     def add_comment(self, request, pk=None):
         post = self.get_object()
@@ -360,59 +508,41 @@ class NewsViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ArticleViewSet(viewsets.ModelViewSet):
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-
-    def get_queryset(self):
-        return Post.objects.filter(post_type='article', is_published=True)
-
-    def get_serializer_class(self):
-        if self.action in ['create', 'update', 'partial_update']:
-            return PostCreateUpdateSerializer
-        return ArticleSerializer
+class NewsViewSet(BasePostViewSet):
+    post_type = 'news'
+    read_serializer_class = NewsSerializer
 
-    def perform_create(self, serializer):
-        serializer.save(author=self.request.user.author, post_type='article')
 
-    @action(detail=True, methods=['post'])
-    def like(self, request, pk=None):
-        post = self.get_object()
-        if request.user in post.dislikes.all():
-            post.dislikes.remove(request.user)
-        post.likes.add(request.user)
-        return Response({
-            'status': 'liked',
-            'likes_count': post.likes.count(),
-            'dislikes_count': post.dislikes.count()
-        })
+class ArticleViewSet(BasePostViewSet):
+    post_type = 'article'
+    read_serializer_class = ArticleSerializer
 
-    @action(detail=True, methods=['post'])
-    def dislike(self, request, pk=None):
-        post = self.get_object()
-        if request.user in post.likes.all():
-            post.likes.remove(request.user)
-        post.dislikes.add(request.user)
-        return Response({
-            'status': 'disliked',
-            'likes_count': post.likes.count(),
-            'dislikes_count': post.dislikes.count()
-        })
 
-    @action(detail=True, methods=['post'])
-    def add_comment(self, request, pk=None):
-        post = self.get_object()
-        serializer = CommentSerializer(data=request.data)
-        if serializer.is_valid():
-            comment = serializer.save(user=request.user, post=post)
-            return Response(CommentSerializer(comment).data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+CATEGORY_LIST_CACHE_KEY = 'categories:list'
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(FastReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
+    def get_fast_queryset(self):
+        return Category.objects.values('id', 'name')
+
+    def render_fast(self, rows):
+        return list(rows)
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_path(request):
+            return super().list(request, *args, **kwargs)
+        # Список категорий маленький и читается постоянно — держим его в двухуровневом кэше
+        rows = caches['tiered'].get_or_set(
+            CATEGORY_LIST_CACHE_KEY, lambda: list(self.get_fast_queryset().order_by('id')))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(rows)
+
 
 class CommentViewSet(viewsets.ModelViewSet):
     serializer_class = CommentSerializer
@@ -462,6 +592,46 @@ class ProfileAPIView(APIView):
         })
 
 
+class SearchAPIView(APIView):
+    """Полнотекстовый поиск: ?q=...&type=news|article&limit=20&offset=0"""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        post_type = request.query_params.get('type')
+        if post_type not in dict(Post.POST_TYPE_CHOICES):
+            post_type = None
+        try:
+            limit = int(request.query_params.get('limit', 20))
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            return Response({'detail': 'limit и offset должны быть числами'}, status=status.HTTP_400_BAD_REQUEST)
+        posts = search.search(query, post_type=post_type, limit=limit, offset=offset) if query else []
+        return Response({
+            'query': query,
+            'results': [
+                {
+                    'id': post.pk,
+                    'title': post.title,
+                    'post_type': post.post_type,
+                    'created_at': serializers.DateTimeField().to_representation(post.created_at),
+                    'url': post.get_absolute_url(),
+                    'snippet': post.snippet,
+                    'rank': post.rank,
+                }
+                for post in posts
+            ],
+        })
+
+
+class CacheStatsAPIView(APIView):
+    """Попадания и промахи двухуровневого кэша в текущем процессе"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(caches['tiered'].stats())
+
+
 class BecomeAuthorAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -0,0 +1,239 @@
+"""Буфер голосов в Redis (write-behind).
+
+При VOTE_BUFFER_ENABLED голоса не пишутся в БД в момент запроса: последний
+голос каждого пользователя за пост хранится в Redis, а периодическая задача
+flush_vote_buffer переносит их пачками в Post.likes/dislikes и счётчики.
+Пока голос не сброшен, его вклад в счётчики хранится отдельной дельтой и
+подмешивается при чтении через merge_buffered_counts.
+
+flush() сначала переименовывает голоса поста в ключи обработки и удаляет их
+только после коммита в БД: если запись упала или воркер умер, голоса
+остаются в Redis, читатели продолжают видеть дельту, а следующий flush
+применяет их повторно (apply_votes идемпотентен — голоса абсолютные).
+"""
+import logging
+
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import Post
+
+KEY_PREFIX = 'votebuf'
+DIRTY_KEY = f'{KEY_PREFIX}:dirty'
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def is_enabled():
+    return getattr(settings, 'VOTE_BUFFER_ENABLED', False)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        url = getattr(settings, 'VOTE_BUFFER_REDIS_URL', 'redis://127.0.0.1:6379/2')
+        if url.startswith('fakeredis://'):
+            import fakeredis
+
+            _client = fakeredis.FakeRedis()
+        else:
+            _client = redis.Redis.from_url(url)
+    return _client
+
+
+def set_client(client):
+    """Подменяет клиент Redis (fakeredis в тестах и нагрузочных прогонах)"""
+    global _client
+    _client = client
+
+
+def _votes_key(post_id):
+    return f'{KEY_PREFIX}:post:{post_id}:votes'
+
+
+def _delta_key(post_id):
+    return f'{KEY_PREFIX}:post:{post_id}:delta'
+
+
+def _processing_votes_key(post_id):
+    return f'{KEY_PREFIX}:processing:{post_id}:votes'
+
+
+def _processing_delta_key(post_id):
+    return f'{KEY_PREFIX}:processing:{post_id}:delta'
+
+
+def _stored_vote(post, user):
+    if post.likes.through.objects.filter(post_id=post.pk, user_id=user.pk).exists():
+        return 1
+    if post.dislikes.through.objects.filter(post_id=post.pk, user_id=user.pk).exists():
+        return -1
+    return 0
+
+
+def record_vote(post, user, value):
+    """Записывает голос в буфер. Повторный одинаковый голос ничего не меняет."""
+    client = get_client()
+    votes_key, delta_key = _votes_key(post.pk), _delta_key(post.pk)
+    processing_key = _processing_votes_key(post.pk)
+    field = str(user.pk)
+    stored = None
+
+    def update(pipe):
+        nonlocal stored
+        # Голос, который сейчас сбрасывается в БД, ещё считается отложенным
+        pending = pipe.hget(votes_key, field)
+        if pending is None:
+            pending = pipe.hget(processing_key, field)
+        if pending is not None:
+            current = int(pending)
+        else:
+            if stored is None:
+                stored = _stored_vote(post, user)
+            current = stored
+        if current == value:
+            pipe.multi()
+            return False
+        pipe.multi()
+        pipe.hset(votes_key, field, value)
+        pipe.hincrby(delta_key, 'likes', (value == 1) - (current == 1))
+        pipe.hincrby(delta_key, 'dislikes', (value == -1) - (current == -1))
+        pipe.sadd(DIRTY_KEY, post.pk)
+        return True
+
+    return client.transaction(update, votes_key, processing_key, value_from_callable=True)
+
+
+def cast_vote(post, user, value):
+    """Единая точка голосования: через буфер, если он включён, иначе сразу в БД"""
+    if is_enabled():
+        changed = record_vote(post, user, value)
+        merge_buffered_counts([post])
+        return changed
+    return post.like(user) if value == 1 else post.dislike(user)
+
+
+def buffered_deltas(post_ids):
+    """Возвращает {post_id: (likes, dislikes)} по ещё не сброшенным голосам"""
+    if not is_enabled() or not post_ids:
+        return {}
+    pipe = get_client().pipeline(transaction=False)
+    for post_id in post_ids:
+        pipe.hgetall(_delta_key(post_id))
+        pipe.hgetall(_processing_delta_key(post_id))
+    results = pipe.execute()
+    deltas = {}
+    for post_id, pending, processing in zip(post_ids, results[::2], results[1::2]):
+        if pending or processing:
+            deltas[post_id] = tuple(
+                int(pending.get(field, 0)) + int(processing.get(field, 0))
+                for field in (b'likes', b'dislikes')
+            )
+    return deltas
+
+
+COUNTER_FIELDS = ('likes_count', 'dislikes_count', 'rating')
+
+
+def merge_buffered_counts(posts):
+    """Добавляет к likes_count/dislikes_count/rating ещё не сброшенные голоса.
+
+    Отложенные (only/defer) счётчики не трогаются: обращение к ним стоило бы
+    отдельного запроса на каждое поле.
+    """
+    loaded = [post for post in posts if not set(COUNTER_FIELDS) <= post.get_deferred_fields()]
+    deltas = buffered_deltas([post.pk for post in loaded])
+    for post in loaded:
+        if post.pk not in deltas:
+            continue
+        likes, dislikes = deltas[post.pk]
+        deferred = post.get_deferred_fields()
+        for field, delta in zip(COUNTER_FIELDS, (likes, dislikes, likes - dislikes)):
+            if field not in deferred:
+                setattr(post, field, getattr(post, field) + delta)
+    return posts
+
+
+def _claim(client, post_id):
+    """Переносит накопленные голоса поста в ключи обработки. False — переносить нечего."""
+    votes_key, delta_key = _votes_key(post_id), _delta_key(post_id)
+    processing_votes, processing_delta = _processing_votes_key(post_id), _processing_delta_key(post_id)
+
+    def rename(pipe):
+        if pipe.exists(processing_votes) or not pipe.exists(votes_key):
+            pipe.multi()
+            return False
+        has_delta = pipe.exists(delta_key)
+        pipe.multi()
+        pipe.rename(votes_key, processing_votes)
+        if has_delta:
+            pipe.rename(delta_key, processing_delta)
+        return True
+
+    return client.transaction(rename, votes_key, delta_key, processing_votes, value_from_callable=True)
+
+
+def _apply_processing(client, post_id):
+    """Записывает голоса из ключей обработки в БД и только после коммита удаляет ключи"""
+    votes = client.hgetall(_processing_votes_key(post_id))
+    votes = {int(user_id): int(value) for user_id, value in votes.items()}
+    with transaction.atomic():
+        # Пользователь мог быть удалён, пока голос лежал в буфере
+        existing = set(User.objects.filter(pk__in=votes).values_list('pk', flat=True))
+        votes = {user_id: value for user_id, value in votes.items() if user_id in existing}
+        post = Post.objects.filter(pk=post_id).first()
+        if post is not None and votes:
+            post.apply_votes(votes)
+    client.delete(_processing_votes_key(post_id), _processing_delta_key(post_id))
+
+
+def _flush_post(client, post_id):
+    # Остаток прерванного сброса применяется раньше новых голосов
+    if client.exists(_processing_votes_key(post_id)):
+        _apply_processing(client, post_id)
+    if _claim(client, post_id):
+        _apply_processing(client, post_id)
+
+
+def leftover_post_ids(client=None):
+    """Посты, сброс которых был прерван (ключи обработки остались в Redis)"""
+    client = client or get_client()
+    pattern = _processing_votes_key('*')
+    prefix, suffix = pattern.split('*')
+    return [int(key.decode()[len(prefix):-len(suffix)]) for key in client.scan_iter(match=pattern)]
+
+
+def flush(batch_size=500):
+    """Переносит накопленные голоса в БД. Возвращает число обработанных постов.
+
+    Ошибка записи одного поста не теряет его голоса: они остаются в ключах
+    обработки и применяются при следующем запуске.
+    """
+    client = get_client()
+    flushed = 0
+    failed = []
+    post_ids = leftover_post_ids(client)
+    seen = set()
+    while True:
+        post_ids += [int(raw_id) for raw_id in client.spop(DIRTY_KEY, batch_size) or []]
+        if not post_ids:
+            break
+        for post_id in post_ids:
+            if post_id in seen:
+                continue
+            seen.add(post_id)
+            try:
+                _flush_post(client, post_id)
+            except Exception:
+                logger.exception('Не удалось сбросить голоса поста %s, повтор при следующем запуске', post_id)
+                failed.append(post_id)
+            else:
+                flushed += 1
+        post_ids = []
+    if failed:
+        client.sadd(DIRTY_KEY, *failed)
+    return flushed
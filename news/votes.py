@@ -0,0 +1,33 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def vote_count_subquery(model, field):
+    """Подзапрос с количеством голосов из M2M-таблицы likes/dislikes"""
+    m2m = model._meta.get_field(field)
+    source = m2m.m2m_field_name()
+    votes = (
+        m2m.remote_field.through.objects
+        .filter(**{source: OuterRef('pk')})
+        .order_by()
+        .values(source)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(votes), Value(0))
+
+
+def recount_votes(model, queryset=None, rating=True):
+    """Пересчитывает счётчики голосов одним UPDATE по M2M-таблицам.
+
+    При rating=True рейтинг тоже выставляется как likes_count - dislikes_count.
+    Возвращает количество обновлённых строк.
+    """
+    queryset = model.objects.all() if queryset is None else queryset
+    updated = queryset.update(
+        likes_count=vote_count_subquery(model, 'likes'),
+        dislikes_count=vote_count_subquery(model, 'dislikes'),
+    )
+    if rating:
+        queryset.update(rating=F('likes_count') - F('dislikes_count'))
+    return updated